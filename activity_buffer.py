@@ -0,0 +1,192 @@
+"""
+Отложенная запись даты последней активности пользователей (write-behind).
+
+GET /users/<id> не пишет в базу: отметка активности кладётся в буфер в памяти, где для каждого пользователя
+хранится только самая поздняя дата. Фоновый поток сбрасывает буфер пачкой UPDATE раз в ACTIVITY_FLUSH_INTERVAL
+секунд или раньше, когда в буфере набирается ACTIVITY_FLUSH_MAX_PENDING пользователей. При завершении процесса
+буфер сбрасывается (atexit).
+
+Буфер свой у каждого процесса. Ответы этого процесса учитывают ещё не записанные отметки (см. pending),
+а в базе, выгрузке и пакетной оценке дата последней активности может отставать на ACTIVITY_FLUSH_INTERVAL.
+При аварийном завершении процесса несброшенные отметки теряются.
+
+При ACTIVITY_WRITE_BEHIND = False отметка записывается сразу, как раньше.
+"""
+import atexit
+import logging
+import threading
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import bindparam, or_, select, update
+
+import cache
+import scoring
+import sharding
+import user_cache
+from models import db, User
+
+
+class ActivityBuffer:
+    """
+    Буфер отметок активности с фоновым сбросом в базу.
+
+    Аргументы:
+        app (Flask): Приложение, в контексте которого выполняется сброс.
+        flush_interval (float): Интервал сброса в секундах.
+        max_pending (int): Количество пользователей в буфере, при котором сброс начинается досрочно.
+        batch_size (int): Размер пачки UPDATE.
+    """
+
+    def __init__(self, app, flush_interval=5, max_pending=1000, batch_size=1000):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flushed = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def touch(self, user_id, moment):
+        """Запоминает активность пользователя; из нескольких отметок остаётся самая поздняя."""
+        with self._lock:
+            previous = self._pending.get(user_id)
+            if previous is None or moment > previous:
+                self._pending[user_id] = moment
+            size = len(self._pending)
+            if self._thread is None:
+                self._start()
+        if size >= self.max_pending:
+            self._wake.set()
+
+    def pending(self, user_id):
+        """Возвращает ещё не записанную отметку активности пользователя или None."""
+        return self._pending.get(user_id)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self):
+        """
+        Записывает накопленные отметки в базу.
+
+        Возвращает:
+            int: Количество пользователей, отметки которых были записаны.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            try:
+                with self.app.app_context():
+                    # В режиме шардирования отметки записываются в шард каждого пользователя (см. sharding.py)
+                    for engine, part in sharding.split_by_shard(pending):
+                        with sharding.use_engine(engine):
+                            _write(db.session, part, self.batch_size)
+                            db.session.commit()
+                    # UPDATE идёт мимо ORM, поэтому кэш пользователей и ответы с датой активности сбрасываем явно
+                    user_cache.invalidate(pending)
+                    cache.invalidate((cache.LONGEST_NAMES, cache.STATISTICS))
+            except Exception as e:
+                logging.error(f"Error flushing activity buffer: {e}")
+                # Возвращаем отметки в буфер, чтобы записать их при следующем сбросе
+                with self._lock:
+                    for user_id, moment in pending.items():
+                        current = self._pending.get(user_id)
+                        if current is None or moment > current:
+                            self._pending[user_id] = moment
+                return 0
+            self.flushed += len(pending)
+            return len(pending)
+
+    def close(self):
+        """Останавливает фоновый поток и сбрасывает оставшиеся отметки."""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name="activity-buffer-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+def _write(session, pending, batch_size):
+    """Записывает отметки пачками и пересчитывает сохранённые оценки активности этих пользователей."""
+    user = User.__table__
+    # Более новая дата, записанная в обход буфера (например, PUT /users/<id>), не перетирается
+    statement = (update(user)
+                 .where(user.c.id == bindparam("user_id"),
+                        or_(user.c.last_active_date.is_(None), user.c.last_active_date < bindparam("moment")))
+                 .values(last_active_date=bindparam("moment")))
+    items = sorted(pending.items())
+    now = datetime.utcnow()
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        session.execute(statement, [{"user_id": user_id, "moment": moment} for user_id, moment in batch])
+        rows = session.execute(select(*scoring.SCORING_COLUMNS)
+                               .where(User.id.in_([user_id for user_id, _ in batch]))).all()
+        scoring.save_scores(session, rows, now)
+
+
+def get_buffer():
+    """Возвращает буфер текущего приложения, создавая его при первом обращении."""
+    buffer = current_app.extensions.get("activity_buffer")
+    if buffer is None:
+        buffer = current_app.extensions["activity_buffer"] = ActivityBuffer(
+            current_app._get_current_object(),
+            current_app.config["ACTIVITY_FLUSH_INTERVAL"],
+            current_app.config["ACTIVITY_FLUSH_MAX_PENDING"],
+            current_app.config["ACTIVITY_FLUSH_BATCH_SIZE"])
+    return buffer
+
+
+def touch(user, moment):
+    """
+    Отмечает активность пользователя: через буфер или сразу, если отложенная запись выключена.
+
+    Аргументы:
+        user: Пользователь (User или user_cache.UserSnapshot).
+        moment (datetime): Момент активности.
+
+    Возвращает:
+        Пользователь с актуальными данными: тот же объект или, при записи сразу, сохранённый объект User.
+    """
+    if current_app.config["ACTIVITY_WRITE_BEHIND"]:
+        get_buffer().touch(user.id, moment)
+        return user
+    # Из кэша приходит не ORM-объект, поэтому пишем через User из сессии (без запроса, если он уже загружен)
+    user = db.session.get(User, user.id)
+    user.last_active_date = moment
+    db.session.commit()
+    return user
+
+
+def last_active_date(user):
+    """Возвращает дату последней активности пользователя с учётом ещё не записанной отметки."""
+    buffer = current_app.extensions.get("activity_buffer")
+    pending = buffer.pending(user.id) if buffer is not None else None
+    if pending is not None and (user.last_active_date is None or pending > user.last_active_date):
+        return pending
+    return user.last_active_date
+
+
+def init_app(app):
+    """Задаёт настройки отложенной записи активности по умолчанию."""
+    app.config.setdefault("ACTIVITY_WRITE_BEHIND", True)
+    app.config.setdefault("ACTIVITY_FLUSH_INTERVAL", 5)
+    app.config.setdefault("ACTIVITY_FLUSH_MAX_PENDING", 1000)
+    app.config.setdefault("ACTIVITY_FLUSH_BATCH_SIZE", 1000)
@@ -0,0 +1,510 @@
+"""
+Инкрементально поддерживаемые агрегаты для статистики пользователей.
+
+Хранятся в трёх небольших таблицах:
+    - registration_day_stat: гистограмма регистраций по дням;
+    - email_domain_stat: количество пользователей по доменам почты;
+    - longest_name_top: ограниченный топ пользователей с самыми длинными именами.
+
+Таблицы обновляются в той же транзакции, что и сами пользователи: обработчик события after_flush смотрит
+на добавленных, изменённых и удалённых в сессии пользователей и пересчитывает только их вклад. Поэтому
+/users/statistics не зависит от размера таблицы user.
+
+Если агрегаты разошлись с таблицей user (например, после ручной правки базы), их можно проверить
+и пересобрать командами:
+    flask stats verify
+    flask stats rebuild
+"""
+import json
+import math
+from collections import Counter, namedtuple
+from datetime import date, datetime, time, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, event, func, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, User
+
+# Сколько пользователей хранится в топе самых длинных имен
+TOP_K_CAPACITY = 20
+
+# Вклад одного пользователя в агрегаты
+UserFacts = namedtuple("UserFacts", ["user_id", "registration_day", "email_domain", "username_length"])
+
+
+class RegistrationDayStat(db.Model):
+    """
+    Количество пользователей, зарегистрированных в конкретный день.
+
+    Атрибуты:
+        day (date): День регистрации.
+        users (int): Количество зарегистрированных в этот день пользователей.
+    """
+    __tablename__ = 'registration_day_stat'
+
+    day = db.Column(db.Date, primary_key=True)
+    users = db.Column(db.Integer, nullable=False, default=0)
+
+
+class EmailDomainStat(db.Model):
+    """
+    Количество пользователей с конкретным доменом почты.
+
+    Атрибуты:
+        domain (str): Нормализованный домен (пустая строка - для адресов без домена).
+        users (int): Количество пользователей с этим доменом.
+    """
+    __tablename__ = 'email_domain_stat'
+
+    domain = db.Column(db.String(120), primary_key=True)
+    users = db.Column(db.Integer, nullable=False, default=0)
+
+
+class LongestNameTop(db.Model):
+    """
+    Пользователи с самыми длинными именами, не больше TOP_K_CAPACITY записей.
+
+    Атрибуты:
+        user_id (int): Идентификатор пользователя.
+        username_length (int): Длина имени пользователя.
+    """
+    __tablename__ = 'longest_name_top'
+
+    user_id = db.Column(db.Integer, primary_key=True)
+    username_length = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_longest_name_top_username_length', db.desc('username_length')),
+    )
+
+
+def _bump(connection, model, key_column, key, delta):
+    """Увеличивает (или уменьшает) счётчик в таблице агрегата, удаляя обнулившиеся строки."""
+    table = model.__table__
+    connection.execute(sqlite_insert(table)
+                       .values({key_column: key, "users": delta})
+                       .on_conflict_do_update(index_elements=[key_column],
+                                              set_={"users": table.c.users + delta}))
+    if delta < 0:
+        connection.execute(table.delete().where(table.c[key_column] == key, table.c.users <= 0))
+
+
+def _top_count(connection):
+    top = LongestNameTop.__table__
+    return connection.execute(select(func.count()).select_from(top)).scalar()
+
+
+def _top_refill(connection):
+    """Дополняет топ лучшими пользователями из таблицы user, которых в нём ещё нет."""
+    missing = TOP_K_CAPACITY - _top_count(connection)
+    if missing <= 0:
+        return
+    top, user = LongestNameTop.__table__, User.__table__
+    rows = connection.execute(select(user.c.id, user.c.username_length)
+                              .where(user.c.id.not_in(select(top.c.user_id)))
+                              .order_by(user.c.username_length.desc(), user.c.id)
+                              .limit(missing)).all()
+    if rows:
+        connection.execute(top.insert(), [{"user_id": row.id, "username_length": row.username_length}
+                                          for row in rows])
+
+
+def _top_update(connection, user_id, username_length):
+    """Обновляет топ после добавления пользователя или изменения длины его имени."""
+    top = LongestNameTop.__table__
+    connection.execute(top.delete().where(top.c.user_id == user_id))
+    _top_refill(connection)
+
+    in_top = connection.execute(select(top.c.user_id).where(top.c.user_id == user_id)).first()
+    if in_top:
+        return
+
+    # Топ заполнен - пользователь попадает в него, только если он лучше худшего участника.
+    # Порядок тот же, что и у эндпоинтов: длина по убыванию, затем id по возрастанию
+    worst = connection.execute(select(top.c.user_id, top.c.username_length)
+                               .order_by(top.c.username_length, top.c.user_id.desc())
+                               .limit(1)).first()
+    if (username_length, -user_id) > (worst.username_length, -worst.user_id):
+        connection.execute(top.delete().where(top.c.user_id == worst.user_id))
+        connection.execute(top.insert().values(user_id=user_id, username_length=username_length))
+
+
+def record_insert(connection, facts):
+    """Учитывает в агрегатах добавленного пользователя."""
+    _bump(connection, RegistrationDayStat, "day", facts.registration_day, 1)
+    _bump(connection, EmailDomainStat, "domain", facts.email_domain or "", 1)
+    _top_update(connection, facts.user_id, facts.username_length)
+
+
+def record_bulk_insert(connection, facts_list):
+    """
+    Учитывает в агрегатах пачку добавленных пользователей.
+
+    Счётчики увеличиваются одним запросом на каждый день и домен, а в топ предлагаются только
+    TOP_K_CAPACITY лучших пользователей пачки - остальные в него всё равно не попадут.
+    """
+    for day, users in Counter(facts.registration_day for facts in facts_list).items():
+        _bump(connection, RegistrationDayStat, "day", day, users)
+    for domain, users in Counter(facts.email_domain or "" for facts in facts_list).items():
+        _bump(connection, EmailDomainStat, "domain", domain, users)
+    best = sorted(facts_list, key=lambda facts: (-facts.username_length, facts.user_id))[:TOP_K_CAPACITY]
+    for facts in best:
+        _top_update(connection, facts.user_id, facts.username_length)
+
+
+def record_delete(connection, facts):
+    """Убирает из агрегатов удалённого пользователя."""
+    _bump(connection, RegistrationDayStat, "day", facts.registration_day, -1)
+    _bump(connection, EmailDomainStat, "domain", facts.email_domain or "", -1)
+    top = LongestNameTop.__table__
+    connection.execute(top.delete().where(top.c.user_id == facts.user_id))
+    _top_refill(connection)
+
+
+def record_update(connection, old, new):
+    """Переносит вклад пользователя в агрегатах со старых значений на новые."""
+    if old.registration_day != new.registration_day:
+        _bump(connection, RegistrationDayStat, "day", old.registration_day, -1)
+        _bump(connection, RegistrationDayStat, "day", new.registration_day, 1)
+    if (old.email_domain or "") != (new.email_domain or ""):
+        _bump(connection, EmailDomainStat, "domain", old.email_domain or "", -1)
+        _bump(connection, EmailDomainStat, "domain", new.email_domain or "", 1)
+    if old.username_length != new.username_length:
+        _top_update(connection, new.user_id, new.username_length)
+
+
+def _previous_value(user, attribute):
+    history = inspect(user).attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(user, attribute)
+
+
+def _current_facts(user):
+    return UserFacts(user.id, user.registration_date.date(), user.email_domain, user.username_length)
+
+
+def _previous_facts(user):
+    return UserFacts(user.id,
+                     _previous_value(user, "registration_date").date(),
+                     _previous_value(user, "email_domain"),
+                     _previous_value(user, "username_length"))
+
+
+def _after_flush(session, flush_context):
+    """
+    Обновляет агрегаты по пользователям, изменённым во время flush.
+
+    На этом этапе строки пользователей уже записаны (id и значения по умолчанию известны), а история
+    атрибутов ещё не сброшена, поэтому видны и старые, и новые значения.
+    """
+    connection = session.connection()
+    for user in session.deleted:
+        if isinstance(user, User):
+            record_delete(connection, _previous_facts(user))
+    for user in session.new:
+        if isinstance(user, User):
+            record_insert(connection, _current_facts(user))
+    for user in session.dirty:
+        if isinstance(user, User) and session.is_modified(user):
+            record_update(connection, _previous_facts(user), _current_facts(user))
+
+
+def _load_previous_value(target, value, oldvalue, initiator):
+    pass
+
+
+# active_history заставляет SQLAlchemy загрузить старое значение атрибута перед его перезаписью,
+# иначе для незагруженного атрибута _previous_facts не узнал бы, откуда переносить вклад
+for _attribute in (User.registration_date, User.email_domain, User.username_length):
+    event.listen(_attribute, "set", _load_previous_value, active_history=True)
+
+
+# Запросы подсчётов собираются один раз, как в repository.py
+_COUNT_USERS = select(func.coalesce(func.sum(RegistrationDayStat.users), 0))
+_COUNT_DOMAIN_USERS = select(EmailDomainStat.users).where(EmailDomainStat.domain == bindparam("domain"))
+_COUNT_FULL_DAYS_SINCE = (select(func.coalesce(func.sum(RegistrationDayStat.users), 0))
+                          .where(RegistrationDayStat.day >= bindparam("next_day")))
+_COUNT_REGISTERED_BETWEEN = (select(func.count(User.id))
+                             .where(User.registration_date >= bindparam("start"),
+                                    User.registration_date < bindparam("end")))
+
+
+def count_users():
+    """Возвращает общее количество пользователей по гистограмме регистраций."""
+    return db.session.execute(_COUNT_USERS).scalar()
+
+
+def count_domain_users(domain):
+    """Возвращает количество пользователей с заданным (нормализованным) доменом почты."""
+    return db.session.execute(_COUNT_DOMAIN_USERS, {"domain": domain}).scalar() or 0
+
+
+def count_registered_since(moment):
+    """
+    Считает пользователей, зарегистрированных начиная с заданного момента.
+
+    Полные дни берутся из гистограммы, а неполный первый день досчитывается по индексу
+    на registration_date, поэтому результат точный, а не округлённый до дней.
+    """
+    next_day = moment.date() + timedelta(days=1)
+    full_days = db.session.execute(_COUNT_FULL_DAYS_SINCE, {"next_day": next_day}).scalar()
+    first_day = db.session.execute(_COUNT_REGISTERED_BETWEEN,
+                                   {"start": moment, "end": datetime.combine(next_day, time.min)}).scalar()
+    return full_days + first_day
+
+
+def get_top_users(k):
+    """
+    Возвращает k пользователей с самыми длинными именами из сохранённого топа.
+
+    Аргументы:
+        k (int): Количество пользователей, не больше TOP_K_CAPACITY.
+
+    Возвращает:
+        list[User]: Список пользователей.
+    """
+    return (User.query
+            .join(LongestNameTop, LongestNameTop.user_id == User.id)
+            .order_by(LongestNameTop.username_length.desc(), LongestNameTop.user_id)
+            .limit(k)
+            .all())
+
+
+# Интервалы гистограммы регистраций: выражение SQLite, округляющее дату вниз до начала интервала,
+# та же операция в Python и шаг между интервалами. Неделя начинается с понедельника
+REGISTRATION_BUCKETS = {
+    "hour": (lambda column: func.strftime("%Y-%m-%d %H:00:00", column),
+             lambda moment: moment.replace(minute=0, second=0, microsecond=0),
+             timedelta(hours=1)),
+    "day": (lambda column: func.datetime(column, "start of day"),
+            lambda moment: datetime.combine(moment.date(), time.min),
+            timedelta(days=1)),
+    "week": (lambda column: func.datetime(column, "weekday 0", "-6 days", "start of day"),
+             lambda moment: datetime.combine(moment.date() - timedelta(days=moment.weekday()), time.min),
+             timedelta(weeks=1)),
+}
+
+
+def count_buckets(start, end, bucket):
+    """Возвращает количество интервалов `bucket`, которые пересекаются с периодом [start, end)."""
+    _, floor, step = REGISTRATION_BUCKETS[bucket]
+    return max(math.ceil((end - floor(start)) / step), 0)
+
+
+def bucket_starts(start, end, bucket):
+    """Возвращает начала интервалов `bucket`, которые пересекаются с периодом [start, end)."""
+    _, floor, step = REGISTRATION_BUCKETS[bucket]
+    first = floor(start)
+    return [first + step * i for i in range(count_buckets(start, end, bucket))]
+
+
+def count_registrations_by_bucket(start, end, bucket):
+    """
+    Считает регистрации за период [start, end) по интервалам длиной в час, день или неделю.
+
+    Считается одним запросом с GROUP BY: условие на период выполняется по индексу на registration_date,
+    и индекс покрывает запрос, поэтому читаются только записи индекса из периода, без строк таблицы.
+
+    Аргументы:
+        start (datetime): Начало периода (включительно).
+        end (datetime): Конец периода (не включительно).
+        bucket (str): Интервал, один из REGISTRATION_BUCKETS.
+
+    Возвращает:
+        list[tuple[datetime, int]]: Начало интервала и количество регистраций для каждого интервала
+                                    из bucket_starts, в том числе пустых.
+    """
+    to_bucket = REGISTRATION_BUCKETS[bucket][0]
+    bucket_start = to_bucket(User.registration_date).label("bucket_start")
+    rows = (db.session.query(bucket_start, func.count())
+            .filter(User.registration_date >= start, User.registration_date < end)
+            .group_by(bucket_start)
+            .all())
+    counts = {datetime.fromisoformat(moment): users for moment, users in rows}
+    return [(moment, counts.get(moment, 0)) for moment in bucket_starts(start, end, bucket)]
+
+
+# Части комбинированной статистики (см. combined_statistics)
+STATISTICS_FIELDS = ("user_count_7_days", "top_5_longest_names", "email_domain_proportion")
+
+
+def _registered_since_expression(moment):
+    """Выражение для count_registered_since в виде скалярных подзапросов."""
+    next_day = moment.date() + timedelta(days=1)
+    full_days = (select(func.coalesce(func.sum(RegistrationDayStat.users), 0))
+                 .where(RegistrationDayStat.day >= next_day)
+                 .scalar_subquery())
+    first_day = (select(func.count(User.id))
+                 .where(User.registration_date >= moment,
+                        User.registration_date < datetime.combine(next_day, time.min))
+                 .scalar_subquery())
+    return full_days + first_day
+
+
+def _top_users_expression(k):
+    """Выражение, собирающее топ из get_top_users в JSON-массив, без загрузки объектов User."""
+    user = User.__table__
+    top = (select(user.c.id, user.c.username, user.c.email, user.c.registration_date, user.c.last_active_date,
+                  LongestNameTop.username_length)
+           .join(LongestNameTop, LongestNameTop.user_id == user.c.id)
+           .order_by(LongestNameTop.username_length.desc(), LongestNameTop.user_id)
+           .limit(k)
+           .subquery())
+    return select(func.json_group_array(func.json_object(
+        "id", top.c.id, "username", top.c.username, "email", top.c.email,
+        "registration_date", top.c.registration_date, "last_active_date", top.c.last_active_date,
+        "username_length", top.c.username_length))).scalar_subquery()
+
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+def combined_statistics(moment, domain, k=5, fields=STATISTICS_FIELDS):
+    """
+    Считает части комбинированной статистики одним запросом к базе.
+
+    Каждая часть - скалярный подзапрос к агрегатам, в SELECT попадают только запрошенные части.
+    Топ собирается в JSON прямо в SQLite, поэтому объекты User не создаются.
+
+    Аргументы:
+        moment (datetime): Начало периода для количества регистраций.
+        domain (str): Нормализованный домен почты.
+        k (int): Размер топа самых длинных имен, не больше TOP_K_CAPACITY.
+        fields (tuple[str]): Нужные части из STATISTICS_FIELDS.
+
+    Возвращает:
+        dict: Значения запрошенных частей: `user_count_7_days` (int), `top_5_longest_names` (список словарей
+              в формате User.json()), `email_domain_proportion` (кортеж: всего пользователей, пользователей домена).
+    """
+    columns = []
+    if "user_count_7_days" in fields:
+        columns.append(_registered_since_expression(moment).label("user_count_7_days"))
+    if "top_5_longest_names" in fields:
+        columns.append(_top_users_expression(k).label("top_5_longest_names"))
+    if "email_domain_proportion" in fields:
+        columns.append(select(func.coalesce(func.sum(RegistrationDayStat.users), 0))
+                       .scalar_subquery().label("total_users"))
+        columns.append(func.coalesce(select(EmailDomainStat.users)
+                                     .where(EmailDomainStat.domain == domain)
+                                     .scalar_subquery(), 0).label("domain_users"))
+    if not columns:
+        return {}
+
+    row = db.session.execute(select(*columns)).one()._mapping
+    result = {}
+    if "user_count_7_days" in fields:
+        result["user_count_7_days"] = row["user_count_7_days"]
+    if "top_5_longest_names" in fields:
+        # Порядок элементов json_group_array не гарантирован, поэтому сортируем так же, как в get_top_users
+        top = sorted(json.loads(row["top_5_longest_names"]),
+                     key=lambda item: (-item.pop("username_length"), item["id"]))
+        for item in top:
+            item["registration_date"] = _parse_datetime(item["registration_date"])
+            item["last_active_date"] = _parse_datetime(item["last_active_date"])
+        result["top_5_longest_names"] = top
+    if "email_domain_proportion" in fields:
+        result["email_domain_proportion"] = (row["total_users"], row["domain_users"])
+    return result
+
+
+def _compute_from_base(connection):
+    """Пересчитывает агрегаты с нуля по таблице user."""
+    user = User.__table__
+    registration_day = func.date(user.c.registration_date)
+    days = {date.fromisoformat(day): users for day, users in
+            connection.execute(select(registration_day, func.count()).group_by(registration_day))}
+    email_domain = func.coalesce(user.c.email_domain, "")
+    domains = dict(connection.execute(select(email_domain, func.count()).group_by(email_domain)).all())
+    top = connection.execute(select(user.c.id, user.c.username_length)
+                             .order_by(user.c.username_length.desc(), user.c.id)
+                             .limit(TOP_K_CAPACITY)).all()
+    return days, domains, [tuple(row) for row in top]
+
+
+def _read_stored(connection):
+    """Читает текущее состояние таблиц агрегатов."""
+    days_table, domains_table = RegistrationDayStat.__table__, EmailDomainStat.__table__
+    top = LongestNameTop.__table__
+    days = dict(connection.execute(select(days_table.c.day, days_table.c.users)).all())
+    domains = dict(connection.execute(select(domains_table.c.domain, domains_table.c.users)).all())
+    top_rows = connection.execute(select(top.c.user_id, top.c.username_length)
+                                  .order_by(top.c.username_length.desc(), top.c.user_id)).all()
+    return days, domains, [tuple(row) for row in top_rows]
+
+
+def _diff_counters(name, expected, stored):
+    drift = []
+    for key in sorted(set(expected) | set(stored), key=str):
+        if expected.get(key, 0) != stored.get(key, 0):
+            drift.append(f"{name}[{key}]: expected {expected.get(key, 0)}, stored {stored.get(key, 0)}")
+    return drift
+
+
+def verify_aggregates():
+    """
+    Сравнивает сохранённые агрегаты с пересчитанными по таблице user.
+
+    Возвращает:
+        list[str]: Описания расхождений, пустой список - если агрегаты актуальны.
+    """
+    connection = db.session.connection()
+    expected_days, expected_domains, expected_top = _compute_from_base(connection)
+    stored_days, stored_domains, stored_top = _read_stored(connection)
+
+    drift = _diff_counters("registration_day_stat", expected_days, stored_days)
+    drift += _diff_counters("email_domain_stat", expected_domains, stored_domains)
+    if expected_top != stored_top:
+        drift.append(f"longest_name_top: expected {expected_top}, stored {stored_top}")
+    return drift
+
+
+def rebuild_aggregates():
+    """Пересчитывает агрегаты по таблице user и перезаписывает их."""
+    connection = db.session.connection()
+    days, domains, top = _compute_from_base(connection)
+
+    for model in (RegistrationDayStat, EmailDomainStat, LongestNameTop):
+        connection.execute(model.__table__.delete())
+    if days:
+        connection.execute(RegistrationDayStat.__table__.insert(),
+                           [{"day": day, "users": users} for day, users in days.items()])
+    if domains:
+        connection.execute(EmailDomainStat.__table__.insert(),
+                           [{"domain": domain, "users": users} for domain, users in domains.items()])
+    if top:
+        connection.execute(LongestNameTop.__table__.insert(),
+                           [{"user_id": user_id, "username_length": length} for user_id, length in top])
+    db.session.commit()
+
+
+stats_cli = AppGroup("stats", help="Проверка и пересборка агрегатов статистики пользователей.")
+
+
+@stats_cli.command("verify")
+def verify_command():
+    """Сравнивает агрегаты с таблицей user и выводит расхождения."""
+    drift = verify_aggregates()
+    for line in drift:
+        click.echo(line)
+    if drift:
+        click.echo(f"Found {len(drift)} discrepancies, run `flask stats rebuild` to fix them")
+        raise SystemExit(1)
+    click.echo("Aggregates are consistent")
+
+
+@stats_cli.command("rebuild")
+def rebuild_command():
+    """Пересчитывает агрегаты по таблице user."""
+    rebuild_aggregates()
+    click.echo("Aggregates rebuilt")
+
+
+def init_app(app):
+    """Подключает обновление агрегатов к сессии и регистрирует команды `flask stats`."""
+    if not event.contains(db.session, "after_flush", _after_flush):
+        event.listen(db.session, "after_flush", _after_flush)
+    app.cli.add_command(stats_cli)
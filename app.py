@@ -1,65 +1,100 @@
 import logging
-from flask import Flask, request, jsonify, make_response
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-from flask_swagger_ui import get_swaggerui_blueprint
+import math
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, make_response, stream_with_context
 from datetime import datetime, timedelta
-from email_validator import validate_email, EmailNotValidError
-
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///data_base.db'
+from models import db, User
+import activity_buffer
+import aggregates
+import bulk_import
+import cache
+import database
+import email_check
+import export
+import json_provider
+import metrics
+import pagination
+import profiling
+import repository
+import scoring
+import search
+import sharding
+import snapshot
+import user_cache
+
+# Ограничение на параметр `k` у эндпоинта с самыми длинными именами
+TOP_NAMES_MAX_K = 100
+# Ограничение на параметр `limit` у эндпоинта с распределением доменов
+EMAIL_DOMAINS_MAX_LIMIT = 100
+# Ограничение на количество интервалов в ответе эндпоинта с гистограммой регистраций
+REGISTRATIONS_MAX_BUCKETS = 2000
+# Ограничение на параметр `limit` у поиска пользователей
+SEARCH_MAX_LIMIT = 100
 
 # Swagger будет доступен по адресу http://127.0.0.1:5000/swagger
 SWAGGER_URL = '/swagger'
 API_URL = '/static/swagger.json'
-swaggerui_blueprint = get_swaggerui_blueprint(
-    SWAGGER_URL,
-    API_URL,
-    config={
-        'app_name': "User Management API"
-    }
-)
-app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
 
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+api = Blueprint("api", __name__)
 
 
-class User(db.Model):
+def register_swagger(app):
     """
-    Модель пользователя
+    Подключает Swagger UI по адресу SWAGGER_URL, если он не выключен настройкой SWAGGER_ENABLED.
 
-    Представляет собой пользователя с уникальным именем пользователя, электронной почтой,
-    а также хранит дату регистрации
+    flask_swagger_ui импортируется только здесь, поэтому приложение без Swagger его не загружает.
+    """
+    if not app.config["SWAGGER_ENABLED"]:
+        return
+    from flask_swagger_ui import get_swaggerui_blueprint
 
-    Атрибуты:
-        id (int): Уникальный идентификатор пользователя.
-        username (str): Имя пользователя, которое должно быть уникальным и обязательным.
-        email (str): Электронная почта пользователя, которая также должна быть уникальной и обязательной.
-        registration_date (datetime): Дата и время регистрации пользователя, по умолчанию устанавливается текущее время.
+    swaggerui_blueprint = get_swaggerui_blueprint(
+        SWAGGER_URL,
+        API_URL,
+        config={
+            'app_name': "User Management API"
+        }
+    )
+    app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
 
-    Методы:
-        json(): Возвращает словарь с данными пользователя для сериализации в формат JSON.
-    """
-    __tablename__ = 'user'
 
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    registration_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    # Добавил для модели предсказания активности значение ниже
-    last_active_date = db.Column(db.DateTime, nullable=True)
+def create_app(config=None):
+    """
+    Создаёт и настраивает приложение Flask.
 
-    def json(self):
-        return {"id": self.id,
-                "username": self.username,
-                "email": self.email,
-                "registration_date": self.registration_date,
-                "last_active_date": self.last_active_date}
+    При создании база не открывается и схема не создаётся: таблицы создаёт команда `flask init-db`,
+    а миграции - `flask db upgrade` (Flask-Migrate и Alembic загружаются только при вызове `flask db`,
+    см. database.py).
 
+    Аргументы:
+        config (dict): Настройки приложения; применяются до настроек по умолчанию модулей.
 
-with app.app_context():
-    db.create_all()
+    Возвращает:
+        Flask: Новое приложение.
+    """
+    app = Flask(__name__)
+    app.config.update(config or {})
+    app.config.setdefault("SWAGGER_ENABLED", True)
+
+    # Адрес базы и профиль настроек SQLite задаются через DATABASE_URL и DB_PROFILE (см. database.py)
+    database.init_app(app)
+    sharding.init_app(app)
+    json_provider.init_app(app)
+    aggregates.init_app(app)
+    activity_buffer.init_app(app)
+    cache.init_app(app)
+    email_check.init_app(app)
+    bulk_import.init_app(app)
+    export.init_app(app)
+    scoring.init_app(app)
+    search.init_app(app)
+    snapshot.init_app(app)
+    user_cache.init_app(app)
+    metrics.init_app(app)
+    profiling.init_app(app)
+
+    app.register_blueprint(api)
+    register_swagger(app)
+    return app
 
 
 def get_user_by_id(user_id):
@@ -73,44 +108,90 @@ def get_user_by_id(user_id):
         User: Объект пользователя, если найден, иначе None.
     """
     try:
-        return User.query.filter_by(id=user_id).first()
+        return repository.get_user(user_id)
     except Exception as e:
         logging.error(f"Error fetching user: {e}")
         return None
 
 
+def get_longest_name_users(k=5):
+    """
+    Возвращает k пользователей с самыми длинными именами.
+
+    Запрос идёт по индексу ix_user_username_length, поэтому читается только k строк независимо от размера
+    таблицы. При равной длине порядок - по возрастанию id, как и у прежней сортировки в Python.
+
+    Аргументы:
+        k (int): Количество пользователей в выборке.
+
+    Возвращает:
+        list[Row]: Строки с колонками models.USER_JSON_COLUMNS.
+    """
+    if sharding.is_enabled():
+        return sharding.longest_names(k)
+    return repository.longest_names(k)
+
+
+def get_email_domain_counts(domain):
+    """
+    Считает общее количество пользователей и количество пользователей с заданным доменом почты.
+
+    Оба значения берутся из агрегатов (см. aggregates.py), а не пересчитываются по таблице user.
+
+    Аргументы:
+        domain (str): Нормализованный домен электронной почты.
+
+    Возвращает:
+        tuple[int, int]: Общее количество пользователей и количество пользователей домена.
+    """
+    if sharding.is_enabled():
+        return sharding.email_domain_counts(domain)
+    return aggregates.count_users(), aggregates.count_domain_users(domain)
+
+
+def parse_datetime_arg(name, source=None):
+    """
+    Читает из параметров запроса дату и время в формате ISO 8601.
+
+    Аргументы:
+        name (str): Имя параметра.
+        source (dict): Откуда читать параметр, по умолчанию из строки запроса.
+
+    Возвращает:
+        datetime: Значение параметра или None, если параметр не передан.
+
+    Исключения:
+        ValueError: Если значение не является датой в формате ISO 8601.
+    """
+    value = (request.args if source is None else source).get(name)
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an ISO 8601 datetime")
+
+
 def calculate_activity(user):
     """
     Алгоритм предсказания вероятности активности пользователя на основе его истории.
 
     Возвращает вероятность активности в следующем месяце в процентах (от 0 до 100).
+    Сама модель вынесена в scoring.py, там же её векторная версия для пакетной оценки. Если сохранённая
+    оценка пользователя ещё действует, берётся она. Ещё не записанная в базу отметка активности
+    (см. activity_buffer.py) учитывается.
     """
-    current_date = datetime.utcnow()
-
     # Будет реализована простейшая модель для предсказания. Я хотел бы использовать машинное обучение и sklearn для
     # этого, но пока не понял, как правильно со всем этим состыковать/взаимодействовать. Попозже для себя разберусь,
     # скорее всего
+    now = datetime.utcnow()
+    last_active_date = activity_buffer.last_active_date(user)
+    if last_active_date != user.last_active_date:
+        return scoring.activity_probability(user.registration_date, last_active_date, now)
+    return scoring.user_activity_probability(user, now)
 
-    # Тут подразумевается, что если пользователь долгое время не активен, то вероятность очень низкая
-    if not user.last_active_date:
-        return 10
-
-    days_since_registration = (current_date - user.registration_date).days
-    days_since_last_active = (current_date - user.last_active_date).days
-
-    if days_since_registration > 90 and days_since_last_active <= 14:
-        probability = 80
-    elif days_since_registration <= 30 and days_since_last_active <= 30:
-        probability = 30
-    elif days_since_registration > 30 and days_since_last_active > 30:
-        probability = 50
-    else:
-        probability = 20
-
-    return probability
 
-
-@app.route("/users", methods=["POST"])
+@api.route("/users", methods=["POST"])
 def create_user():
     """
     Создает нового пользователя на основе данных, переданных в запросе.
@@ -127,28 +208,70 @@ def create_user():
         if "email" not in data or "username" not in data:
             return make_response(jsonify({"message": "username and email are required"}), 400)
 
+        # email_validator загружается при первой проверке адреса, а не при импорте приложения
+        from email_validator import EmailNotValidError
+
         try:
-            validate_email(data["email"])
+            # Доставляемость домена проверяется через кэш или в фоне, в зависимости от режима (см. email_check.py)
+            email_check.check_email(data["email"])
         except EmailNotValidError as e:
             return make_response(jsonify({"message": str(e)}), 400)
 
         new_user = User(username=data["username"],
                         email=data["email"])
-        db.session.add(new_user)
-        db.session.commit()
+        if sharding.is_enabled():
+            sharding.create_user(new_user)
+        else:
+            db.session.add(new_user)
+            db.session.commit()
         return make_response(jsonify({"status": "success", "user": new_user.json()}), 201)
     except Exception as e:
         return make_response(jsonify({"message": str(e)}), 500)
 
 
-@app.route("/users", methods=["GET"])
+@api.route("/users/bulk", methods=["POST"])
+@sharding.single_database_only
+def create_users_bulk():
+    """
+    Массово создает пользователей.
+
+    Ожидает JSON-массив объектов с полями "username" и "email" или NDJSON (Content-Type: application/x-ndjson).
+    Некорректные записи и дубликаты пропускаются, остальные создаются (см. bulk_import.py).
+
+    Возвращает:
+        Response: Ответ с кодом состояния 200 и JSON, содержащий количество созданных (`inserted`)
+                  и отклоненных (`failed`) записей и список ошибок `errors` с номером записи и причиной,
+                  или ошибку 400, если тело запроса не удалось разобрать.
+    """
+    try:
+        try:
+            records = bulk_import.iter_records(request)
+        except bulk_import.BulkImportError as e:
+            return make_response(jsonify({"message": str(e)}), 400)
+
+        return make_response(jsonify(bulk_import.import_users(records)), 200)
+    except Exception as e:
+        logging.error(f"Error importing users: {e}")
+        return make_response(jsonify({"message": str(e)}), 500)
+
+
+@api.route("/users", methods=["GET"])
 def get_users():
     """
     Получает список пользователей с поддержкой пагинации.
 
+    Есть два режима:
+        - по номеру страницы (OFFSET), используется по умолчанию;
+        - курсорный (keyset), включается параметром `cursor`. Глубокие страницы в нём не замедляются,
+          а следующая страница запрашивается по `next_cursor` из ответа.
+
     Параметры:
         - `page` (int): Номер страницы, по умолчанию 1.
         - `per_page` (int): Количество пользователей на одной странице, по умолчанию 10.
+        - `cursor` (str): Курсор следующей страницы из предыдущего ответа, пустая строка - первая страница.
+        - `order_by` (str): Порядок в курсорном режиме: `id` (по умолчанию) или `registration_date`.
+        - `include_total` (bool): Возвращать ли `total` и `total_pages`. По умолчанию да в режиме страниц
+          и нет в курсорном режиме.
 
     Ожидает:
         Параметры запроса:
@@ -157,38 +280,156 @@ def get_users():
 
     Возвращает:
         Response: Ответ с кодом состояния 200 и JSON, содержащий:
-            - `page`: Текущая страница.
+            - `page`: Текущая страница (только в режиме страниц).
             - `per_page`: Количество пользователей на странице.
             - `total`: Общее количество пользователей в базе данных.
             - `total_pages`: Общее количество страниц.
+            - `next_cursor`: Курсор следующей страницы или null (только в курсорном режиме).
             - `users`: Список пользователей на текущей странице, представленных в формате JSON.
 
     В случае ошибки:
-        Response: Ответ с кодом состояния 500 и сообщением об ошибке.
+        Response: Ответ с кодом состояния 400 при некорректных параметрах или 500 с сообщением об ошибке.
     """
     try:
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
+        cursor = request.args.get('cursor')
+        if per_page < 1:
+            return make_response(jsonify({"message": "per_page must be positive"}), 400)
+
+        include_total = request.args.get('include_total', 'true' if cursor is None else 'false').lower()
+        if include_total not in ('true', 'false', '1', '0'):
+            return make_response(jsonify({"message": "include_total must be true or false"}), 400)
+        include_total = include_total in ('true', '1')
+
+        if cursor is not None:
+            order = request.args.get('order_by', 'id')
+            if order not in pagination.KEYSET_ORDERS:
+                return make_response(jsonify({"message": f"order_by must be one of {pagination.KEYSET_ORDERS}"}),
+                                     400)
+            try:
+                key = pagination.decode_cursor(cursor, order) if cursor else None
+            except pagination.InvalidCursor as e:
+                return make_response(jsonify({"message": str(e)}), 400)
+            # Берём на одну запись больше, чтобы понять, есть ли следующая страница, без отдельного запроса
+            users_after = sharding.users_after if sharding.is_enabled() else repository.users_after
+            users, next_cursor = pagination.split_page(users_after(order, key, per_page + 1), order, per_page)
+            response = {"per_page": per_page, "next_cursor": next_cursor}
+        else:
+            # COUNT(*) по всей таблице не делаем: общее количество берётся из агрегатов статистики
+            page = max(page, 1)
+            users = (sharding.users_page if sharding.is_enabled() else repository.users_page)(page, per_page)
+            response = {"page": page, "per_page": per_page}
+
+        if include_total:
+            total = sharding.count_users() if sharding.is_enabled() else aggregates.count_users()
+            response["total"] = total
+            response["total_pages"] = math.ceil(total / per_page)
+        # Список только для чтения: строки колонок вместо ORM-объектов (см. repository.py)
+        response["users"] = [user._asdict() for user in users]
+
+        return make_response(jsonify(response), 200)
+    except Exception as e:
+        logging.error(f"Error fetching users: {e}")
+        return make_response(jsonify({"message": str(e)}), 500)
+
+
+@api.route("/users/search", methods=["GET"])
+def search_users():
+    """
+    Ищет пользователей по префиксу имени и адреса почты через индекс поиска (см. search.py).
+
+    Параметры:
+        - `q` (str): Строка поиска, обязательна. Последнее слово ищется как префикс: `ali` находит `Alice`,
+          `alice@ma` - `alice@mail.ru`.
+        - `field` (str): Где искать: `all` (по умолчанию), `username` или `email`.
+        - `limit` (int): Количество пользователей в ответе, по умолчанию 20 (не больше SEARCH_MAX_LIMIT).
+        - `cursor` (str): Курсор следующей страницы из предыдущего ответа.
 
-        users_paginated = User.query.paginate(page=page, per_page=per_page, error_out=False)
+    Возвращает:
+        Response: Ответ с кодом состояния 200 и JSON с `q`, `field`, `limit`, `next_cursor` и `users`
+                  (в порядке id) или ошибку 400 при некорректных параметрах.
+    """
+    try:
+        query = request.args.get('q', '')
+        field = request.args.get('field', 'all')
+        limit = request.args.get('limit', 20, type=int)
+        if field not in search.SEARCH_FIELDS:
+            return make_response(jsonify({"message": f"field must be one of {search.SEARCH_FIELDS}"}), 400)
+        if not 1 <= limit <= SEARCH_MAX_LIMIT:
+            return make_response(jsonify({"message": f"limit must be between 1 and {SEARCH_MAX_LIMIT}"}), 400)
+        match = search.match_query(query, field)
+        if match is None:
+            return make_response(jsonify({"message": "q must contain letters or digits"}), 400)
+
+        cursor = request.args.get('cursor')
+        try:
+            after_id = pagination.decode_cursor(cursor, "id")[0] if cursor else 0
+        except pagination.InvalidCursor as e:
+            return make_response(jsonify({"message": str(e)}), 400)
+        find_users = sharding.search_users if sharding.is_enabled() else repository.search_users
+        users = find_users(match, after_id, limit + 1)
+        users, next_cursor = pagination.split_page(users, "id", limit)
+
+        return make_response(jsonify({"q": query,
+                                      "field": field,
+                                      "limit": limit,
+                                      "next_cursor": next_cursor,
+                                      "users": [user._asdict() for user in users]}), 200)
+    except Exception as e:
+        logging.error(f"Error searching users: {e}")
+        return make_response(jsonify({"message": str(e)}), 500)
+
+
+@api.route("/users/export", methods=["GET"])
+@sharding.single_database_only
+def export_users():
+    """
+    Потоково выгружает пользователей в формате NDJSON или CSV (см. export.py).
+
+    Параметры:
+        - `format` (str): `ndjson` (по умолчанию) или `csv`.
+        - `registered_from` (str): Начало периода регистрации в формате ISO 8601 (включительно).
+        - `registered_to` (str): Конец периода регистрации в формате ISO 8601 (не включительно).
+        - `domain` (str): Домен электронной почты.
 
-        return make_response(jsonify({
-            "page": users_paginated.page,
-            "per_page": users_paginated.per_page,
-            "total": users_paginated.total,
-            "total_pages": users_paginated.pages,
-            "users": [user.json() for user in users_paginated.items]
-        }), 200)
+    Возвращает:
+        Response: Потоковый ответ с кодом состояния 200 или ошибку 400 при некорректных параметрах.
+    """
+    try:
+        export_format = request.args.get("format", "ndjson")
+        if export_format not in export.EXPORT_FORMATS:
+            return make_response(jsonify({"message": f"format must be one of {tuple(export.EXPORT_FORMATS)}"}), 400)
+        try:
+            registered_from = parse_datetime_arg("registered_from")
+            registered_to = parse_datetime_arg("registered_to")
+        except ValueError as e:
+            return make_response(jsonify({"message": str(e)}), 400)
+        domain = request.args.get("domain")
+        if domain is not None:
+            domain = domain.strip().lower()
+
+        result = db.session.execute(export.export_statement(registered_from, registered_to, domain),
+                                    bind_arguments={"bind": database.read_engine()})
+        generate = export.generate_ndjson if export_format == "ndjson" else export.generate_csv
+
+        response = Response(stream_with_context(generate(result)), mimetype=export.EXPORT_FORMATS[export_format])
+        response.headers["Content-Disposition"] = f"attachment; filename=users.{export_format}"
+        return response
     except Exception as e:
-        logging.error(f"Error fetching users: {e}")
+        logging.error(f"Error exporting users: {e}")
         return make_response(jsonify({"message": str(e)}), 500)
 
 
-@app.route("/users/<int:user_id>", methods=["GET"])
+@api.route("/users/<int:user_id>", methods=["GET"])
 def get_user(user_id):
     """
     Возвращает информацию о пользователе по его уникальному идентификатору и обновляет дату его последней активности.
 
+    Дата активности записывается в базу не сразу, а через буфер (см. activity_buffer.py), поэтому запрос
+    только читает из базы. В ответе дата и вероятность активности уже учитывают эту отметку.
+    Пользователь читается через кэш (см. user_cache.py).
+
     Аргументы:
         user_id (int): Уникальный идентификатор пользователя.
 
@@ -197,15 +438,16 @@ def get_user(user_id):
                   или ошибку 404, если пользователь не найден.
     """
     try:
-        user = get_user_by_id(user_id)
+        sharding.route_to_user(user_id)
+        user = user_cache.get_user(user_id)
         if user:
             # Сюда добавил фичу с тем, чтобы активность выводилась также с запросом информации по пользователю
-            user.last_active_date = datetime.utcnow()
-            db.session.commit()
+            user = activity_buffer.touch(user, datetime.utcnow())
 
             probability = calculate_activity(user)
 
             user_data = user.json()
+            user_data['last_active_date'] = activity_buffer.last_active_date(user)
             user_data['activity_probability'] = probability
 
             return make_response(jsonify({"user": user_data}), 200)
@@ -215,7 +457,7 @@ def get_user(user_id):
         return make_response(jsonify({"message": str(e)}), 500)
 
 
-@app.route("/users/<int:user_id>", methods=["PUT"])
+@api.route("/users/<int:user_id>", methods=["PUT"])
 def update_user(user_id):
     """
     Обновляет информацию о пользователе по его уникальному идентификатору и обновляет дату последней активности.
@@ -223,23 +465,32 @@ def update_user(user_id):
     Аргументы:
         user_id (int): Уникальный идентификатор пользователя.
 
-    Ожидает получение JSON-данных с возможными полями "username", "email", "registration_date".
+    Ожидает получение JSON-данных с возможными полями "username", "email", "registration_date"
+    (дата в формате ISO 8601).
 
     Возвращает:
         Response: Ответ с кодом состояния 200 и сообщением о том, что пользователь был обновлен,
-                  или ошибку 404, если пользователь не найден.
+                  ошибку 400 при некорректной дате регистрации или ошибку 404, если пользователь не найден.
     """
     try:
+        sharding.route_to_user(user_id)
         user = get_user_by_id(user_id)
         if user:
             data = request.get_json()
 
+            if sharding.is_enabled() and ("username" in data or "email" in data):
+                # UNIQUE действует только внутри шарда, поэтому имя и почта проверяются во всех шардах
+                sharding.check_unique(data.get("username"), data.get("email"), user_id)
             if "username" in data:
                 user.username = data["username"]
             if "email" in data:
                 user.email = data["email"]
             if "registration_date" in data:
-                user.registration_date = data["registration_date"]
+                try:
+                    user.registration_date = datetime.fromisoformat(data["registration_date"])
+                except (TypeError, ValueError):
+                    return make_response(jsonify({"message": "registration_date must be an ISO 8601 datetime"}),
+                                         400)
 
             user.last_active_date = datetime.utcnow()
 
@@ -250,7 +501,7 @@ def update_user(user_id):
         return make_response(jsonify({"message": str(e)}), 500)
 
 
-@app.route("/users/<int:user_id>", methods=["DELETE"])
+@api.route("/users/<int:user_id>", methods=["DELETE"])
 def delete_user(user_id):
     """
     Удаляет пользователя по его уникальному идентификатору.
@@ -263,6 +514,7 @@ def delete_user(user_id):
                   или ошибку 404, если пользователь не найден.
     """
     try:
+        sharding.route_to_user(user_id)
         user = get_user_by_id(user_id)
         if user:
             db.session.delete(user)
@@ -273,7 +525,8 @@ def delete_user(user_id):
         return make_response(jsonify({"message": str(e)}), 500)
 
 
-@app.route("/users/last_7_days", methods=["GET"])
+@api.route("/users/last_7_days", methods=["GET"])
+@cache.cached_response(cache.REGISTRATIONS)
 def get_users_last_7_days():
     """
     Подсчитывает количество пользователей, зарегистрированных за последние 7 дней.
@@ -284,7 +537,10 @@ def get_users_last_7_days():
     try:
         seven_days_ago = datetime.utcnow() - timedelta(days=7)
 
-        user_count = User.query.filter(User.registration_date >= seven_days_ago).count()
+        if sharding.is_enabled():
+            user_count = sharding.count_registered_since(seven_days_ago)
+        else:
+            user_count = aggregates.count_registered_since(seven_days_ago)
 
         return make_response(jsonify({"users_count_7_days": user_count}), 200)
 
@@ -293,29 +549,89 @@ def get_users_last_7_days():
         return make_response(jsonify({"message": str(e)}), 500)
 
 
-@app.route("/users/top_5_longest_names", methods=["GET"])
+@api.route("/users/registrations", methods=["GET"])
+@cache.cached_response(cache.REGISTRATIONS)
+def get_registrations():
+    """
+    Возвращает количество регистраций за период по интервалам (гистограмму для графиков роста).
+
+    Все интервалы считаются одним запросом с GROUP BY по индексу на registration_date
+    (см. aggregates.count_registrations_by_bucket), а при SNAPSHOT_ENABLED - сканом столбца снимка
+    (см. snapshot.py); интервалы без регистраций возвращаются с нулём.
+
+    Параметры:
+        - `bucket` (str): Интервал: `hour`, `day` (по умолчанию) или `week` (с понедельника).
+        - `registered_from` (str): Начало периода в формате ISO 8601 (включительно), по умолчанию 7 дней назад.
+        - `registered_to` (str): Конец периода в формате ISO 8601 (не включительно), по умолчанию текущий момент.
+
+    Возвращает:
+        Response: Ответ с кодом состояния 200 и JSON с `bucket`, `registered_from`, `registered_to`, `total`
+                  и `buckets` (список из `start` и `users`) или ошибку 400 при некорректных параметрах.
+    """
+    try:
+        bucket = request.args.get("bucket", "day")
+        if bucket not in aggregates.REGISTRATION_BUCKETS:
+            buckets = tuple(aggregates.REGISTRATION_BUCKETS)
+            return make_response(jsonify({"message": f"bucket must be one of {buckets}"}), 400)
+        try:
+            registered_to = parse_datetime_arg("registered_to") or datetime.utcnow()
+            registered_from = parse_datetime_arg("registered_from") or registered_to - timedelta(days=7)
+        except ValueError as e:
+            return make_response(jsonify({"message": str(e)}), 400)
+        if registered_from >= registered_to:
+            return make_response(jsonify({"message": "registered_from must be earlier than registered_to"}), 400)
+        if aggregates.count_buckets(registered_from, registered_to, bucket) > REGISTRATIONS_MAX_BUCKETS:
+            return make_response(jsonify({"message": f"at most {REGISTRATIONS_MAX_BUCKETS} buckets per request"}),
+                                 400)
+
+        if sharding.is_enabled():
+            buckets = sharding.count_registrations_by_bucket(registered_from, registered_to, bucket)
+        elif snapshot.is_enabled():
+            buckets = snapshot.get_snapshot().count_registrations_by_bucket(registered_from, registered_to, bucket)
+        else:
+            buckets = aggregates.count_registrations_by_bucket(registered_from, registered_to, bucket)
+        return make_response(jsonify({"bucket": bucket,
+                                      "registered_from": registered_from,
+                                      "registered_to": registered_to,
+                                      "total": sum(users for _, users in buckets),
+                                      "buckets": [{"start": start, "users": users} for start, users in buckets]}),
+                             200)
+    except Exception as e:
+        logging.error(f"Error fetching registrations: {e}")
+        return make_response(jsonify({"message": str(e)}), 500)
+
+
+@api.route("/users/top_5_longest_names", methods=["GET"])
+@cache.cached_response(cache.LONGEST_NAMES)
 def get_top_5_longest_name():
     """
     Возвращает топ-5 пользователей с самыми длинными именами.
 
+    Параметры:
+        - `k` (int): Размер топа, по умолчанию 5 (не больше TOP_NAMES_MAX_K).
+
     Возвращает:
-        Response: Ответ с кодом состояния 200 и списком пользователей с самыми длинными именами.
+        Response: Ответ с кодом состояния 200 и списком пользователей с самыми длинными именами,
+                  или ошибку 400 при некорректном `k`.
     """
 
     try:
-        all_users = User.query.all()
+        k = request.args.get("k", 5, type=int)
+        if not 1 <= k <= TOP_NAMES_MAX_K:
+            return make_response(jsonify({"message": f"k must be between 1 and {TOP_NAMES_MAX_K}"}), 400)
 
-        top_users = sorted(all_users, key=lambda user: len(user.username), reverse=True)[:5]
+        top_users = get_longest_name_users(k)
 
         # Единственное - тут решил выводить в принципе пользователя со всей его информацией (почта, дата регистрации),
         # но если нужно потом только имена выводить, то могу переделать
-        return make_response(jsonify({"top_5_longest_names": [user.json() for user in top_users]}), 200)
+        return make_response(jsonify({"top_5_longest_names": [user._asdict() for user in top_users]}), 200)
     except Exception as e:
         logging.error(f"Error fetching top 5 users with longest names: {e}")
         return make_response(jsonify({"message": str(e)}), 500)
 
 
-@app.route("/users/email_domain_proportion", methods=["GET"])
+@api.route("/users/email_domain_proportion", methods=["GET"])
+@cache.cached_response(cache.EMAIL_DOMAINS)
 def get_email_domain_proportion():
     """
     Определяет долю пользователей, у которых адрес электронной почты зарегистрирован в заданном домене.
@@ -328,31 +644,65 @@ def get_email_domain_proportion():
     """
     try:
         # Я тут использовал только не example.com, как в ТЗ, а mail.ru
-        domain = request.args.get("domain", "mail.ru")
+        domain = request.args.get("domain", "mail.ru").strip().lower()
 
-        users = User.query.all()
+        total_users, domain_users = get_email_domain_counts(domain)
 
-        domain_users = filter(lambda user: user.email.endswith(f"@{domain}"), users)
-        domain_users = list(domain_users)
-
-        if len(users) > 0:
-            proportions = len(domain_users) / len(users)
+        if total_users > 0:
+            proportions = domain_users / total_users
         else:
             proportions = 0
 
         return make_response(jsonify({"domain": domain,
-                                      "total_users": len(users),
-                                      "domain_users": len(domain_users),
+                                      "total_users": total_users,
+                                      "domain_users": domain_users,
                                       "proportions": proportions}), 200)
     except Exception as e:
         logging.error(f"Error calculating email domain proportions: {e}")
         return make_response(jsonify({"message": str(e)}), 500)
 
 
-@app.route("/users/<int:user_id>/activity_probability", methods=["GET"])
+@api.route("/users/email_domains", methods=["GET"])
+@sharding.single_database_only
+@cache.cached_response(cache.EMAIL_DOMAINS)
+def get_email_domains():
+    """
+    Возвращает распределение пользователей по доменам электронной почты (самые популярные домены).
+
+    Все значения считаются одним запросом с GROUP BY по индексу на email_domain, общее количество
+    пользователей - оконной функцией поверх тех же групп.
+
+    Параметры:
+        - `limit` (int): Количество доменов в ответе, по умолчанию 10 (не больше EMAIL_DOMAINS_MAX_LIMIT).
+
+    Возвращает:
+        Response: Ответ с кодом состояния 200 и списком доменов с количеством и долей пользователей,
+                  или ошибку 400 при некорректном `limit`.
+    """
+    try:
+        limit = request.args.get("limit", 10, type=int)
+        if not 1 <= limit <= EMAIL_DOMAINS_MAX_LIMIT:
+            return make_response(jsonify({"message": f"limit must be between 1 and {EMAIL_DOMAINS_MAX_LIMIT}"}),
+                                 400)
+
+        rows = repository.email_domains(limit)
+
+        total_users = rows[0].total_users if rows else 0
+        domains = [{"domain": row.email_domain,
+                    "users": row.users,
+                    "proportion": row.users / total_users} for row in rows]
+
+        return make_response(jsonify({"total_users": total_users, "domains": domains}), 200)
+    except Exception as e:
+        logging.error(f"Error fetching email domains distribution: {e}")
+        return make_response(jsonify({"message": str(e)}), 500)
+
+
+@api.route("/users/<int:user_id>/activity_probability", methods=["GET"])
 def get_activity_probability(user_id):
     try:
-        user = get_user_by_id(user_id)
+        sharding.route_to_user(user_id)
+        user = user_cache.get_user(user_id)
         if user:
             probability = calculate_activity(user)
             return make_response(jsonify({"user_id": user.id,
@@ -363,7 +713,114 @@ def get_activity_probability(user_id):
         return make_response(jsonify({"message": str(e)}), 500)
 
 
-@app.route("/users/statistics", methods=["GET"])
+@api.route("/users/activity_probability/batch", methods=["POST"])
+@sharding.single_database_only
+def get_activity_probability_batch():
+    """
+    Оценивает вероятность активности сразу для многих пользователей.
+
+    Ожидает JSON одного из видов:
+        - `{"ids": [1, 2, 3]}`: оценки указанных пользователей одним JSON-ответом;
+        - `{"filter": {"registered_from": ..., "registered_to": ..., "domain": ...}}` или `{}`: оценки всех
+          подходящих (или вообще всех) пользователей потоком NDJSON в порядке id. При SNAPSHOT_ENABLED
+          оценки считаются по снимку (см. snapshot.py) и могут отставать от базы на SNAPSHOT_MAX_AGE.
+
+    Возвращает:
+        Response: Ответ с кодом состояния 200 или ошибку 400 при некорректном теле запроса.
+    """
+    try:
+        data = request.get_json(silent=True)
+        if data is None:
+            data = {}
+        if not isinstance(data, dict):
+            return make_response(jsonify({"message": "expected a JSON object"}), 400)
+
+        now = datetime.utcnow()
+        batch_size = current_app.config["SCORING_BATCH_SIZE"]
+
+        if "ids" in data:
+            ids = data["ids"]
+            if not isinstance(ids, list) or not all(isinstance(user_id, int) and not isinstance(user_id, bool)
+                                                    for user_id in ids):
+                return make_response(jsonify({"message": "ids must be a list of integers"}), 400)
+            if len(ids) > current_app.config["SCORING_MAX_IDS"]:
+                return make_response(jsonify({"message": f"at most {current_app.config['SCORING_MAX_IDS']} ids "
+                                                         f"per request"}), 400)
+            results, not_found = scoring.score_users_by_ids(db.session, ids, now, batch_size)
+            return make_response(jsonify({"results": results, "not_found": not_found}), 200)
+
+        filters = data.get("filter") or {}
+        if not isinstance(filters, dict):
+            return make_response(jsonify({"message": "filter must be a JSON object"}), 400)
+        try:
+            registered_from = parse_datetime_arg("registered_from", filters)
+            registered_to = parse_datetime_arg("registered_to", filters)
+        except ValueError as e:
+            return make_response(jsonify({"message": str(e)}), 400)
+        domain = filters.get("domain")
+        if domain is not None:
+            if not isinstance(domain, str):
+                return make_response(jsonify({"message": "domain must be a string"}), 400)
+            domain = domain.strip().lower()
+
+        if snapshot.is_enabled():
+            # Оценка по столбцам снимка, без чтения строк из базы (см. snapshot.py)
+            batches = snapshot.get_snapshot().iter_scores(now, batch_size, registered_from, registered_to, domain)
+        else:
+            batches = scoring.iter_scores(db.session, now, batch_size, registered_from, registered_to, domain,
+                                          bind=database.read_engine())
+        return Response(stream_with_context(scoring.generate_ndjson(batches)), mimetype="application/x-ndjson")
+    except Exception as e:
+        logging.error(f"Error scoring activity probability: {e}")
+        return make_response(jsonify({"message": str(e)}), 500)
+
+
+@api.route("/users/by_activity_probability", methods=["GET"])
+@sharding.single_database_only
+def get_users_by_activity_probability():
+    """
+    Возвращает пользователей с заданной вероятностью активности, постранично по курсору.
+
+    Выборка идёт по индексу сохранённой оценки и ничего не пишет в базу. Оценки с наступившим порогом
+    пересчитывает `flask scores refresh` по расписанию, до этого пользователь остаётся в прежней группе.
+
+    Параметры:
+        - `probability` (int): Вероятность, одно из значений модели (10, 20, 30, 50, 80).
+        - `per_page` (int): Количество пользователей на странице, по умолчанию 10.
+        - `cursor` (str): Курсор следующей страницы из предыдущего ответа.
+
+    Возвращает:
+        Response: Ответ с кодом состояния 200 и JSON с `probability`, `per_page`, `next_cursor` и `users`
+                  или ошибку 400 при некорректных параметрах.
+    """
+    try:
+        probability = request.args.get('probability', type=int)
+        per_page = request.args.get('per_page', 10, type=int)
+        if probability not in scoring.PROBABILITY_BUCKETS:
+            return make_response(jsonify({"message": f"probability must be one of {scoring.PROBABILITY_BUCKETS}"}),
+                                 400)
+        if per_page < 1:
+            return make_response(jsonify({"message": "per_page must be positive"}), 400)
+
+        cursor = request.args.get('cursor')
+        try:
+            after_id = pagination.decode_cursor(cursor, "id")[0] if cursor else 0
+        except pagination.InvalidCursor as e:
+            return make_response(jsonify({"message": str(e)}), 400)
+        users = repository.users_by_probability(probability, after_id, per_page + 1)
+        users, next_cursor = pagination.split_page(users, "id", per_page)
+
+        return make_response(jsonify({"probability": probability,
+                                      "per_page": per_page,
+                                      "next_cursor": next_cursor,
+                                      "users": [user._asdict() for user in users]}), 200)
+    except Exception as e:
+        logging.error(f"Error fetching users by activity probability: {e}")
+        return make_response(jsonify({"message": str(e)}), 500)
+
+
+@api.route("/users/statistics", methods=["GET"])
+@cache.cached_response(cache.STATISTICS)
 def get_user_statistics():
     """
     Возвращает комбинированную статистику:
@@ -371,42 +828,106 @@ def get_user_statistics():
     - Топ-5 пользователей с самыми длинными именами.
     - Доля пользователей с определенным доменом электронной почты.
 
+    Все части считаются одним запросом к базе по агрегатам (см. aggregates.combined_statistics).
+
     Параметры:
         - `domain` (str): Домен электронной почты (по умолчанию 'mail.ru').
+        - `fields` (str): Нужные части через запятую (по умолчанию все); остальные не считаются
+          и не попадают в ответ.
 
     Возвращает:
-        Response: JSON с объединенной статистикой.
+        Response: JSON с объединенной статистикой или ошибка 400, если `fields` пуст или в нём есть
+                  неизвестная часть (в сообщении перечислены допустимые).
     """
     try:
-        domain = request.args.get("domain", "mail.ru")
+        domain = request.args.get("domain", "mail.ru").strip().lower()
+        fields = request.args.get("fields")
+        if fields is None:
+            fields = aggregates.STATISTICS_FIELDS
+        else:
+            fields = tuple(field.strip() for field in fields.split(",") if field.strip())
+            valid = ", ".join(aggregates.STATISTICS_FIELDS)
+            unknown = sorted(set(fields) - set(aggregates.STATISTICS_FIELDS))
+            if unknown:
+                return make_response(jsonify({"message": f"Unknown fields: {', '.join(unknown)}; "
+                                                         f"fields must be one of: {valid}"}), 400)
+            if not fields:
+                return make_response(jsonify({"message": f"fields must list at least one of: {valid}"}), 400)
 
         seven_days_ago = datetime.utcnow() - timedelta(days=7)
-        user_last_7_days = User.query.filter(User.registration_date >= seven_days_ago).count()
+        combined_statistics = sharding.combined_statistics if sharding.is_enabled() else aggregates.combined_statistics
+        statistics = combined_statistics(seven_days_ago, domain, 5, fields)
+
+        result = {}
+        if "user_count_7_days" in statistics:
+            result["user_count_7_days"] = statistics["user_count_7_days"]
+        if "top_5_longest_names" in statistics:
+            result["top_5_longest_names"] = statistics["top_5_longest_names"]
+        if "email_domain_proportion" in statistics:
+            total_users, domain_users = statistics["email_domain_proportion"]
+            domain_proportion = domain_users / total_users if total_users > 0 else 0
+            result["email_domain_proportion"] = {
+                "domain": domain,
+                "total_users": total_users,
+                "domain_users": domain_users,
+                "proportion": domain_proportion
+            }
+        return make_response(jsonify(result), 200)
 
-        all_users = User.query.all()
-        top_5_longest_names = sorted(all_users, key=lambda user: len(user.username), reverse=True)[:5]
-        top_5_longest_names_json = [user.json() for user in top_5_longest_names]
+    except Exception as e:
+        logging.error(f"Error fetching combined statistics: {e}")
+        return make_response(jsonify({"message": str(e)}), 500)
 
-        domain_users = list(filter(lambda user: user.email.endswith(f"@{domain}"), all_users))
-        total_users = len(all_users)
-        domain_proportion = len(domain_users) / total_users if total_users > 0 else 0
 
-        return make_response(jsonify({"user_count_7_days": user_last_7_days,
-                                      "top_5_longest_names": top_5_longest_names_json,
-                                      "email_domain_proportion": {
-                                          "domain": domain,
-                                          "total_users": total_users,
-                                          "domain_users": len(domain_users),
-                                          "proportion": domain_proportion
-                                      }}), 200)
+@api.route("/cache/stats", methods=["GET"])
+def get_cache_stats():
+    """
+    Возвращает счётчики кэша ответов аналитических эндпоинтов и кэша проверки доменов почты.
 
+    Возвращает:
+        Response: Ответ с кодом состояния 200 и JSON, содержащий бэкенд кэша, количество записей,
+                  попаданий, промахов, вытеснений и истёкших записей, а в `email_domains` - режим
+                  и счётчики проверки доменов почты (см. email_check.py).
+    """
+    try:
+        response_cache = cache.get_cache()
+        return make_response(jsonify({"backend": response_cache.name,
+                                      "entries": len(response_cache),
+                                      **response_cache.stats.as_dict(),
+                                      "email_domains": email_check.get_checker().stats()}), 200)
     except Exception as e:
-        logging.error(f"Error fetching combined statistics: {e}")
+        logging.error(f"Error fetching cache stats: {e}")
         return make_response(jsonify({"message": str(e)}), 500)
 
 
+@api.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Возвращает метрики производительности запросов в текстовом формате Prometheus (см. metrics.py).
+
+    Возвращает:
+        Response: Ответ с кодом состояния 200 или 404, если метрики выключены (METRICS_ENABLED = False).
+    """
+    if not current_app.config["METRICS_ENABLED"]:
+        return make_response(jsonify({"message": "metrics are disabled"}), 404)
+    return Response(metrics.get_metrics(current_app).render(), mimetype="text/plain; version=0.0.4")
+
+
+def __getattr__(name):
+    """
+    Возвращает приложение из wsgi.py по атрибуту `app` (`gunicorn app:app`, `flask --app app`, бенчмарки).
+
+    Приложение создаётся при первом обращении к атрибуту, а не при импорте модуля: тестам и процессам,
+    которые создают своё приложение через create_app, не нужно ещё одно приложение с основной базой.
+    """
+    if name == "app":
+        import wsgi
+        return wsgi.app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == "__main__":
     """
     Запускает приложение Flask на локальном сервере с включенным режимом отладки.
     """
-    app.run(debug=True)
+    create_app().run(debug=True)
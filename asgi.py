@@ -0,0 +1,177 @@
+"""
+Асинхронная точка входа (ASGI) для того же API.
+
+Самые частые чтения обрабатываются асинхронно, через асинхронный движок SQLAlchemy (aiosqlite,
+см. database.create_async_engine): GET /users, GET /users/<id> и GET /users/<id>/activity_probability.
+Пока запрос ждёт базу, воркер обслуживает другие запросы. Модель User и calculate_activity общие
+с синхронным приложением, ответы совпадают с ним по формату.
+
+Остальные маршруты (запись, аналитика, выгрузка, Swagger) передаются синхронному приложению Flask
+через адаптер asgiref и выполняются в пуле потоков. В режиме шардирования (см. sharding.py) туда же
+передаются и все чтения.
+
+Отметка активности в GET /users/<id> в этом режиме всегда идёт через буфер отложенной записи
+(см. activity_buffer.py), независимо от ACTIVITY_WRITE_BEHIND: синхронный коммит заблокировал бы цикл событий.
+
+Запуск:
+    uvicorn asgi:application
+"""
+import logging
+import math
+import re
+from datetime import datetime
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import activity_buffer
+import database
+import pagination
+import sharding
+from aggregates import RegistrationDayStat
+from app import calculate_activity
+from models import User, USER_JSON_COLUMNS
+from wsgi import app
+
+
+def _int_arg(args, name, default):
+    """Возвращает целочисленный параметр запроса или значение по умолчанию, как request.args.get(type=int)."""
+    try:
+        return int(args[name])
+    except (KeyError, ValueError):
+        return default
+
+
+class AsyncUsersApp:
+    """
+    ASGI-приложение: асинхронные обработчики для чтения пользователей, остальное - в приложение Flask.
+
+    Аргументы:
+        flask_app (Flask): Синхронное приложение, которому передаются остальные маршруты.
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.fallback = WsgiToAsgi(flask_app)
+        with flask_app.app_context():
+            self.engine = database.create_async_engine()
+            sharded = sharding.is_enabled()
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+        # Асинхронный движок читает только основную базу, поэтому в режиме шардирования все запросы идут во Flask
+        self.routes = [] if sharded else [
+            (re.compile(r"/users"), self.get_users),
+            (re.compile(r"/users/(\d+)"), self.get_user),
+            (re.compile(r"/users/(\d+)/activity_probability"), self.get_activity_probability),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] == "http" and scope["method"] == "GET":
+            for pattern, handler in self.routes:
+                match = pattern.fullmatch(scope["path"])
+                if match:
+                    args = {name: values[-1] for name, values in
+                            parse_qs(scope["query_string"].decode(), keep_blank_values=True).items()}
+                    with self.flask_app.app_context():
+                        status, payload = await handler(args, *map(int, match.groups()))
+                        # Как у jsonify: с переводом строки в конце
+                        body = f"{self.flask_app.json.dumps(payload)}\n".encode()
+                    await send({"type": "http.response.start", "status": status,
+                                "headers": [(b"content-type", b"application/json"),
+                                            (b"content-length", str(len(body)).encode())]})
+                    await send({"type": "http.response.body", "body": body})
+                    return
+        await self.fallback(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                buffer = self.flask_app.extensions.get("activity_buffer")
+                if buffer is not None:
+                    buffer.close()
+                await self.engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def get_users(self, args):
+        """Асинхронная версия GET /users (см. app.get_users), поддерживает оба режима пагинации."""
+        try:
+            page = _int_arg(args, "page", 1)
+            per_page = _int_arg(args, "per_page", 10)
+            cursor = args.get("cursor")
+            if per_page < 1:
+                return 400, {"message": "per_page must be positive"}
+
+            include_total = args.get("include_total", "true" if cursor is None else "false").lower()
+            if include_total not in ("true", "false", "1", "0"):
+                return 400, {"message": "include_total must be true or false"}
+            include_total = include_total in ("true", "1")
+
+            async with self.sessions() as session:
+                if cursor is not None:
+                    order = args.get("order_by", "id")
+                    if order not in pagination.KEYSET_ORDERS:
+                        return 400, {"message": f"order_by must be one of {pagination.KEYSET_ORDERS}"}
+                    try:
+                        statement = pagination.keyset_filter(select(*USER_JSON_COLUMNS), order,
+                                                             cursor).limit(per_page + 1)
+                    except pagination.InvalidCursor as e:
+                        return 400, {"message": str(e)}
+                    users, next_cursor = pagination.split_page((await session.execute(statement)).all(),
+                                                               order, per_page)
+                    response = {"per_page": per_page, "next_cursor": next_cursor}
+                else:
+                    page = max(page, 1)
+                    statement = select(*USER_JSON_COLUMNS).limit(per_page).offset((page - 1) * per_page)
+                    users = (await session.execute(statement)).all()
+                    response = {"page": page, "per_page": per_page}
+
+                if include_total:
+                    # То же, что aggregates.count_users()
+                    total = await session.scalar(select(func.coalesce(func.sum(RegistrationDayStat.users), 0)))
+                    response["total"] = total
+                    response["total_pages"] = math.ceil(total / per_page)
+            response["users"] = [user._asdict() for user in users]
+            return 200, response
+        except Exception as e:
+            logging.error(f"Error fetching users: {e}")
+            return 500, {"message": str(e)}
+
+    async def get_user(self, args, user_id):
+        """Асинхронная версия GET /users/<id> (см. app.get_user)."""
+        try:
+            async with self.sessions() as session:
+                user = await session.get(User, user_id)
+            if user is None:
+                return 404, {"message": "user not found"}
+            activity_buffer.get_buffer().touch(user.id, datetime.utcnow())
+
+            user_data = user.json()
+            user_data["last_active_date"] = activity_buffer.last_active_date(user)
+            user_data["activity_probability"] = calculate_activity(user)
+            return 200, {"user": user_data}
+        except Exception as e:
+            logging.error(f"Error fetching user {user_id}: {e}")
+            return 500, {"message": str(e)}
+
+    async def get_activity_probability(self, args, user_id):
+        """Асинхронная версия GET /users/<id>/activity_probability (см. app.get_activity_probability)."""
+        try:
+            async with self.sessions() as session:
+                user = await session.get(User, user_id)
+            if user is None:
+                return 404, {"message": "User not found"}
+            return 200, {"user_id": user.id, "activity_probability": calculate_activity(user)}
+        except Exception as e:
+            logging.error(f"Error fetching activity probability for user {user_id}: {e}")
+            return 500, {"message": str(e)}
+
+
+application = AsyncUsersApp(app)
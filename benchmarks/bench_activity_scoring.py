@@ -0,0 +1,52 @@
+"""
+Бенчмарк оценки вероятности активности.
+
+Замеряет на таблице заданного размера:
+    - оценку всей таблицы потоком POST /users/activity_probability/batch (векторная оценка NumPy);
+    - оценку 1000 пользователей по списку id одним запросом;
+    - прежний способ: по одному запросу GET /users/<id>/activity_probability на пользователя
+      (время пересчитывается на всю таблицу по 200 запросам).
+
+Запуск:
+    python -m benchmarks.bench_activity_scoring [размер]
+"""
+import sys
+import time
+
+from sqlalchemy import text
+
+from benchmarks.common import load_app, measure, seed_users
+
+DEFAULT_SIZE = 100_000
+
+
+def main(size):
+    app_module = load_app()
+    app, db = app_module.app, app_module.db
+    client = app.test_client()
+
+    seed_users(app_module, size)
+    with app.app_context():
+        # У части пользователей проставляем последнюю активность, чтобы оценки были разными
+        db.session.execute(text("UPDATE user SET last_active_date = datetime('now', '-' || (id % 60) || ' days') "
+                                "WHERE id % 3 != 0"))
+        db.session.commit()
+
+    full = measure(lambda: client.post("/users/activity_probability/batch", json={}).get_data(), repeat=3, warmup=1)
+    ids = list(range(1, min(size, 1000) + 1))
+    by_ids = measure(lambda: client.post("/users/activity_probability/batch", json={"ids": ids}), repeat=10)
+
+    sample = min(size, 200)
+    started = time.perf_counter()
+    for user_id in range(1, sample + 1):
+        client.get(f"/users/{user_id}/activity_probability")
+    legacy_total_s = (time.perf_counter() - started) / sample * size
+
+    print(f"rows: {size}")
+    print(f"batch, full table stream: {full['p50_ms']} ms ({size / full['p50_ms'] * 1000:,.0f} users/s)")
+    print(f"batch, {len(ids)} ids: {by_ids['p50_ms']} ms")
+    print(f"legacy, one request per user (extrapolated): {legacy_total_s * 1000:,.0f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SIZE)
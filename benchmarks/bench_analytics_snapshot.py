@@ -0,0 +1,81 @@
+"""
+Бенчмарк колоночного снимка для аналитики (см. snapshot.py).
+
+Замеряет на таблице заданного размера с выключенным и включённым снимком:
+    - оценку всей таблицы и пользователей одного домена потоком POST /users/activity_probability/batch;
+    - GET /users/registrations по дням за год;
+а также полную сборку снимка, перенос в него 1000 изменений и размер его файлов.
+
+Запуск:
+    python -m benchmarks.bench_analytics_snapshot [размер]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from benchmarks.common import load_app, measure, seed_users
+
+DEFAULT_SIZE = 1_000_000
+CHANGES = 1000
+
+
+def main(size):
+    app_module = load_app()
+    app, db, snapshot = app_module.app, app_module.db, app_module.snapshot
+    app.config["SNAPSHOT_PATH"] = tempfile.mkdtemp(prefix="bench_snapshot_")
+    client = app.test_client()
+
+    seed_users(app_module, size)
+    with app.app_context():
+        db.session.execute(text("UPDATE user SET last_active_date = datetime('now', '-' || (id % 60) || ' days') "
+                                "WHERE id % 3 != 0"))
+        db.session.commit()
+
+    def registrations():
+        # Каждый раз другой registered_from, чтобы ответ не брался из кэша аналитики
+        registered_from = (datetime.utcnow() - timedelta(days=365)).isoformat()
+        return client.get(f"/users/registrations?bucket=day&registered_from={registered_from}").get_data()
+
+    scenarios = {
+        "batch, full table": lambda: client.post("/users/activity_probability/batch", json={}).get_data(),
+        "batch, domain filter": lambda: client.post("/users/activity_probability/batch",
+                                                    json={"filter": {"domain": "gmail.com"}}).get_data(),
+        "registrations by day, 1 year": registrations,
+    }
+    results = {}
+    for enabled in (False, True):
+        app.config["SNAPSHOT_ENABLED"] = enabled
+        for name, scenario in scenarios.items():
+            results[name, enabled] = measure(scenario, repeat=5, warmup=1)["p50_ms"]
+
+    with app.app_context():
+        directory = snapshot.get_store().directory
+        started = time.perf_counter()
+        snapshot.refresh(directory, full=True)
+        full_ms = (time.perf_counter() - started) * 1000
+
+        db.session.execute(text("UPDATE user SET last_active_date = datetime('now') WHERE id % :step = 0"),
+                           {"step": max(size // CHANGES, 1)})
+        db.session.commit()
+        started = time.perf_counter()
+        mode = snapshot.refresh(directory)
+        incremental_ms = (time.perf_counter() - started) * 1000
+        meta = snapshot.read_meta(directory)
+        files_size = sum(os.path.getsize(os.path.join(directory, f"{meta['generation']}.{name}.npy"))
+                         for name in snapshot.COLUMNS)
+
+    print(f"rows: {size}")
+    print(f"{'scenario':<30} {'database, ms':>13} {'snapshot, ms':>13} {'speedup':>8}")
+    for name in scenarios:
+        before, after = results[name, False], results[name, True]
+        print(f"{name:<30} {before:>13.1f} {after:>13.1f} {before / after:>7.1f}x")
+    print(f"full rebuild: {full_ms:,.0f} ms, {CHANGES} changes ({mode}): {incremental_ms:,.1f} ms")
+    print(f"snapshot files: {files_size / 1024 / 1024:.1f} MiB ({files_size / size:.0f} bytes per user)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SIZE)
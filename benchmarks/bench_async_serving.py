@@ -0,0 +1,110 @@
+"""
+Бенчмарк синхронного и асинхронного режимов при большом количестве одновременных соединений.
+
+Оба режима запускаются отдельным процессом с одним воркером на одной и той же базе:
+    - sync: `flask run --without-threads`, обрабатывает один запрос за раз, как синхронный воркер gunicorn;
+    - async: `uvicorn asgi:application` (см. asgi.py), асинхронные обработчики с aiosqlite.
+
+Нагрузку даёт асинхронный клиент: CONCURRENCY одновременных соединений, каждое шлёт запросы
+GET /users/<id>/activity_probability и GET /users?page=<n> вперемешку. Для каждого режима выводятся
+пропускная способность и задержки.
+
+Запуск:
+    python -m benchmarks.bench_async_serving [количество пользователей] [количество соединений]
+"""
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+from benchmarks.common import load_app, seed_users
+
+HOST = "127.0.0.1"
+PORT = 5077
+REQUESTS_PER_CONNECTION = 20
+
+SERVERS = {
+    "sync": [sys.executable, "-m", "flask", "--app", "app", "run", "--without-threads",
+             "--host", HOST, "--port", str(PORT)],
+    "async": [sys.executable, "-m", "uvicorn", "asgi:application", "--host", HOST, "--port", str(PORT),
+              "--log-level", "warning"],
+}
+
+
+async def request(path):
+    """Отправляет GET-запрос по новому соединению и возвращает код ответа."""
+    reader, writer = await asyncio.open_connection(HOST, PORT)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {HOST}\r\nConnection: close\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return int(response.split(b" ", 2)[1])
+
+
+async def load(size, concurrency):
+    """
+    Гоняет запросы из `concurrency` одновременных соединений.
+
+    Возвращает:
+        tuple[float, list[float], int]: Общее время в секундах, задержки в миллисекундах и количество ошибок.
+    """
+    latencies, errors = [], 0
+
+    async def client(index):
+        nonlocal errors
+        rnd = random.Random(index)
+        for i in range(REQUESTS_PER_CONNECTION):
+            if i % 2:
+                path = f"/users/{rnd.randint(1, size)}/activity_probability"
+            else:
+                path = f"/users?page={rnd.randint(1, size // 10)}&include_total=false"
+            started = time.perf_counter()
+            try:
+                status = await request(path)
+            except OSError:
+                status = None
+            latencies.append((time.perf_counter() - started) * 1000)
+            if status != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    return time.perf_counter() - started, latencies, errors
+
+
+def wait_ready(timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://{HOST}:{PORT}/users/1/activity_probability", timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def main(size, concurrency):
+    seed_users(load_app(), size)
+    print(f"{size} users, {concurrency} concurrent connections, {REQUESTS_PER_CONNECTION} requests each")
+    print(f"{'mode':<8} {'req/s':>8} {'p50, ms':>9} {'p95, ms':>9} {'errors':>7}")
+    for mode, command in SERVERS.items():
+        server = subprocess.Popen(command, env=os.environ.copy(),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready()
+            elapsed, latencies, errors = asyncio.run(load(size, concurrency))
+        finally:
+            server.terminate()
+            server.wait()
+        latencies.sort()
+        print(f"{mode:<8} {len(latencies) / elapsed:>8,.0f} {statistics.median(latencies):>9.1f} "
+              f"{latencies[int(len(latencies) * 0.95) - 1]:>9.1f} {errors:>7}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 200)
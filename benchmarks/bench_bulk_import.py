@@ -0,0 +1,53 @@
+"""
+Бенчмарк массового импорта POST /users/bulk.
+
+Импортирует синтетических пользователей JSON-массивом и NDJSON и выводит скорость в строках в секунду.
+Для сравнения замеряется прежний путь: одна вставка и один коммит на пользователя (как в POST /users,
+без проверки доставляемости почты).
+
+Запуск:
+    python -m benchmarks.bench_bulk_import [количество пользователей] [процессов для проверки почты]
+"""
+import json
+import sys
+import time
+
+from benchmarks.common import load_app
+
+SINGLE_INSERT_ROWS = 2_000
+
+
+def _records(prefix, count):
+    return [{"username": f"{prefix}{i}", "email": f"{prefix}{i}@example.com"} for i in range(count)]
+
+
+def main(count, workers):
+    app_module = load_app()
+    app, db, User = app_module.app, app_module.db, app_module.User
+    app.config["BULK_VALIDATION_WORKERS"] = workers
+    client = app.test_client()
+
+    def report(name, rows, seconds):
+        print(f"{name:<40} {rows:>9} rows {seconds:>8.2f} s {rows / seconds:>12.0f} rows/s")
+
+    started = time.perf_counter()
+    with app.app_context():
+        for record in _records("single", SINGLE_INSERT_ROWS):
+            db.session.add(User(**record))
+            db.session.commit()
+    report("one insert + commit per user", SINGLE_INSERT_ROWS, time.perf_counter() - started)
+
+    body = json.dumps(_records("array", count))
+    started = time.perf_counter()
+    response = client.post("/users/bulk", data=body, content_type="application/json")
+    report("POST /users/bulk, JSON array", response.json["inserted"], time.perf_counter() - started)
+
+    body = "\n".join(json.dumps(record) for record in _records("ndjson", count))
+    started = time.perf_counter()
+    response = client.post("/users/bulk", data=body, content_type="application/x-ndjson")
+    report("POST /users/bulk, NDJSON", response.json["inserted"], time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 0)
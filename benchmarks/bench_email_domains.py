@@ -0,0 +1,40 @@
+"""
+Бенчмарк эндпоинтов /users/email_domain_proportion и /users/email_domains.
+
+Наращивает таблицу пользователей и на каждом размере замеряет время ответа эндпоинтов (COUNT и GROUP BY
+по индексу email_domain) и, для сравнения, прежнего способа: User.query.all() + endswith() в Python.
+
+Запуск:
+    python -m benchmarks.bench_email_domains [размер1 размер2 ...]
+"""
+import sys
+
+from benchmarks.common import load_app, measure, seed_users
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+
+def main(sizes):
+    app_module = load_app()
+    app, User = app_module.app, app_module.User
+    client = app.test_client()
+
+    def legacy_proportion():
+        with app.app_context():
+            users = User.query.all()
+            len([user for user in users if user.email.endswith("@mail.ru")]) / len(users)
+
+    print(f"{'rows':>10} {'proportion p50, ms':>20} {'domains p50, ms':>17} {'legacy p50, ms':>16}")
+    seeded = 0
+    for size in sizes:
+        seed_users(app_module, size - seeded, start=seeded)
+        seeded = size
+
+        proportion = measure(lambda: client.get("/users/email_domain_proportion?domain=mail.ru"))
+        domains = measure(lambda: client.get("/users/email_domains"), repeat=10)
+        legacy = measure(legacy_proportion, repeat=3, warmup=0)
+        print(f"{size:>10} {proportion['p50_ms']:>20} {domains['p50_ms']:>17} {legacy['p50_ms']:>16}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
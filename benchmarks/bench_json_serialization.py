@@ -0,0 +1,77 @@
+"""
+Бенчмарк сериализации списка пользователей в JSON.
+
+Замеряет построение ответа для страницы из PER_PAGE пользователей по шагам:
+    - прежний путь: ORM-объекты User, User.json() и стандартный провайдер Flask (даты в RFC 822);
+    - строки колонок (models.USER_JSON_COLUMNS) и стандартный провайдер;
+    - строки колонок и FastJSONProvider без orjson (стандартный модуль json, даты в ISO 8601);
+    - строки колонок и FastJSONProvider с orjson;
+а также эндпоинт GET /users?per_page=PER_PAGE целиком со стандартным провайдером и с FastJSONProvider.
+
+Запуск:
+    python -m benchmarks.bench_json_serialization [количество пользователей] [размер страницы]
+"""
+import sys
+
+from flask.json.provider import DefaultJSONProvider
+
+from benchmarks.common import load_app, measure, seed_users
+
+
+def main(size, per_page):
+    app_module = load_app()
+    app, db, User = app_module.app, app_module.db, app_module.User
+    json_provider = app_module.json_provider
+    seed_users(app_module, size)
+    client = app.test_client()
+
+    default_provider = DefaultJSONProvider(app)
+    fast_provider = json_provider.FastJSONProvider(app)
+
+    def orm_users():
+        return User.query.limit(per_page).all()
+
+    def column_rows():
+        return User.query.with_entities(*app_module.USER_JSON_COLUMNS).limit(per_page).all()
+
+    def legacy():
+        default_provider.response({"users": [user.json() for user in orm_users()]})
+
+    def rows_default():
+        default_provider.response({"users": [user._asdict() for user in column_rows()]})
+
+    def rows_fast():
+        fast_provider.response({"users": [user._asdict() for user in column_rows()]})
+
+    def rows_fast_stdlib():
+        orjson, json_provider.orjson = json_provider.orjson, None
+        try:
+            rows_fast()
+        finally:
+            json_provider.orjson = orjson
+
+    print(f"{size} users, page of {per_page}")
+    print(f"{'variant':<40} {'p50, ms':>10} {'p95, ms':>10}")
+    with app.app_context():
+        variants = [("ORM + User.json() + default provider", legacy),
+                    ("column rows + default provider", rows_default),
+                    ("column rows + fast provider (stdlib)", rows_fast_stdlib),
+                    ("column rows + fast provider (orjson)", rows_fast)]
+        for name, fn in variants:
+            if name.endswith("(orjson)") and json_provider.orjson is None:
+                continue
+            # Сессия очищается, чтобы ORM-объекты создавались заново, как в отдельном запросе
+            result = measure(lambda: (fn(), db.session.expunge_all()))
+            print(f"{name:<40} {result['p50_ms']:>10} {result['p95_ms']:>10}")
+
+    path = f"/users?per_page={per_page}&include_total=false"
+    for name, provider in [("endpoint, default provider", default_provider),
+                           ("endpoint, fast provider", fast_provider)]:
+        app.json = provider
+        result = measure(lambda: client.get(path))
+        print(f"{name:<40} {result['p50_ms']:>10} {result['p95_ms']:>10}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 1_000)
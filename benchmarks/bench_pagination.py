@@ -0,0 +1,50 @@
+"""
+Бенчмарк пагинации GET /users: первая страница против 10 000-й в режиме страниц (OFFSET) и в курсорном режиме.
+
+В режиме страниц глубокая страница замедляется линейно, потому что SQLite пропускает все предыдущие строки.
+В курсорном режиме страница выбирается по индексу от позиции курсора и время не зависит от глубины.
+
+Запуск:
+    python -m benchmarks.bench_pagination [количество пользователей]
+"""
+import sys
+
+from benchmarks.common import load_app, measure, seed_users
+
+PER_PAGE = 10
+DEEP_PAGE = 10_000
+
+
+def main(size):
+    app_module = load_app()
+    app, User, pagination = app_module.app, app_module.User, app_module.pagination
+    seed_users(app_module, size)
+    client = app.test_client()
+
+    with app.app_context():
+        # Курсор, с которого начинается страница DEEP_PAGE
+        offset = (DEEP_PAGE - 1) * PER_PAGE
+        id_user = User.query.order_by(User.id).offset(offset - 1).first()
+        date_user = User.query.order_by(User.registration_date, User.id).offset(offset - 1).first()
+        deep_id_cursor = pagination.encode_cursor("id", id_user)
+        deep_date_cursor = pagination.encode_cursor("registration_date", date_user)
+
+    scenarios = [
+        ("offset, page 1", {"page": 1}),
+        (f"offset, page {DEEP_PAGE}", {"page": DEEP_PAGE}),
+        (f"offset, page {DEEP_PAGE}, no total", {"page": DEEP_PAGE, "include_total": "false"}),
+        ("cursor by id, page 1", {"cursor": ""}),
+        (f"cursor by id, page {DEEP_PAGE}", {"cursor": deep_id_cursor}),
+        ("cursor by registration_date, page 1", {"cursor": "", "order_by": "registration_date"}),
+        (f"cursor by registration_date, page {DEEP_PAGE}",
+         {"cursor": deep_date_cursor, "order_by": "registration_date"}),
+    ]
+    print(f"{size} users, per_page={PER_PAGE}")
+    print(f"{'scenario':<45} {'p50, ms':>9} {'p95, ms':>9}")
+    for name, params in scenarios:
+        result = measure(lambda: client.get("/users", query_string={"per_page": PER_PAGE, **params}))
+        print(f"{name:<45} {result['p50_ms']:>9} {result['p95_ms']:>9}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
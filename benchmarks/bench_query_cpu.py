@@ -0,0 +1,108 @@
+"""
+Бенчмарк процессорного времени на запрос для эндпоинтов, которые обращаются к базе.
+
+Сначала сравнивается сам слой запросов: запрос, собранный заново через User.query, как раньше
+в обработчиках app.py, и готовый запрос из repository.py. Затем замеряются эндпоинты целиком.
+Кэши ответов и пользователей выключены, чтобы каждый запрос доходил до базы. Для каждого эндпоинта
+выполняется REQUESTS запросов через тестовый клиент Flask и выводится процессорное время (time.process_time)
+и время по часам на один запрос. Процессорное время показывает затраты Python: сборку и компиляцию
+запросов SQLAlchemy, создание ORM-объектов и сериализацию, без ожидания диска.
+
+Запуск:
+    python -m benchmarks.bench_query_cpu [количество пользователей] [запросов на эндпоинт]
+"""
+import random
+import sys
+import time
+
+from sqlalchemy import func
+
+from benchmarks.common import load_app, seed_users
+from models import USER_JSON_COLUMNS
+
+
+def _endpoints(size, rnd):
+    return {
+        "GET /users?page=N": lambda: ("GET", f"/users?page={rnd.randint(1, size // 10)}", None),
+        "GET /users?cursor=": lambda: ("GET", "/users?cursor=&order_by=registration_date", None),
+        "GET /users/<id>": lambda: ("GET", f"/users/{rnd.randint(1, size)}", None),
+        "GET /users/<id>/activity_probability": lambda: ("GET", f"/users/{rnd.randint(1, size)}/activity_probability",
+                                                         None),
+        "PUT /users/<id>": lambda: ("PUT", f"/users/{rnd.randint(1, size)}",
+                                    {"username": f"renamed_{time.time_ns()}"}),
+        "GET /users/last_7_days": lambda: ("GET", "/users/last_7_days", None),
+        "GET /users/top_5_longest_names": lambda: ("GET", "/users/top_5_longest_names", None),
+        "GET /users/email_domain_proportion": lambda: ("GET", "/users/email_domain_proportion?domain=mail.ru", None),
+        "GET /users/by_activity_probability": lambda: ("GET", "/users/by_activity_probability?probability=10", None),
+    }
+
+
+def _cpu_us(fn, repeat):
+    for _ in range(50):
+        fn()
+    started = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return (time.process_time() - started) * 1_000_000 / repeat
+
+
+def _query_layer(app_module):
+    """Пары (прежний запрос через User.query, запрос из repository.py) для одних и тех же данных."""
+    db, User, repository = app_module.db, app_module.User, app_module.repository
+    columns = USER_JSON_COLUMNS
+    users_count = func.count(User.id)
+    return {
+        "user by id": (lambda: (User.query.filter_by(id=5).first(), db.session.expunge_all()),
+                       lambda: (repository.get_user(5), db.session.expunge_all())),
+        "longest names": (lambda: User.query.with_entities(*columns)
+                          .order_by(User.username_length.desc(), User.id).limit(5).all(),
+                          lambda: repository.longest_names(5)),
+        "users page": (lambda: User.query.with_entities(*columns)
+                       .paginate(page=3, per_page=10, error_out=False, count=False).items,
+                       lambda: repository.users_page(3, 10)),
+        "users after cursor": (lambda: User.query.with_entities(*columns)
+                               .filter(User.id > 100).order_by(User.id).limit(11).all(),
+                               lambda: repository.users_after("id", [100], 11)),
+        "email domains": (lambda: db.session.query(User.email_domain, users_count.label("users"),
+                                                   func.sum(users_count).over().label("total_users"))
+                          .group_by(User.email_domain).order_by(users_count.desc(), User.email_domain)
+                          .limit(10).all(),
+                          lambda: repository.email_domains(10)),
+    }
+
+
+def main(size, requests):
+    app_module = load_app()
+    app = app_module.app
+    app.config["CACHE_BACKEND"] = "null"
+    app.config["USER_CACHE_BACKEND"] = "null"
+    app.config["ACTIVITY_WRITE_BEHIND"] = True
+    seed_users(app_module, size)
+    client = app.test_client()
+
+    print(f"{'query':<40} {'User.query, us':>15} {'repository, us':>15}")
+    with app.app_context():
+        for name, (legacy, prepared) in _query_layer(app_module).items():
+            print(f"{name:<40} {_cpu_us(legacy, requests):>15.1f} {_cpu_us(prepared, requests):>15.1f}")
+
+    print(f"\n{size} users, {requests} requests per endpoint")
+    print(f"{'endpoint':<40} {'CPU, ms/req':>12} {'wall, ms/req':>13}")
+    for name, build in _endpoints(size, random.Random(0)).items():
+        for _ in range(5):
+            method, path, body = build()
+            client.open(path, method=method, json=body)
+        cpu_started, wall_started = time.process_time(), time.perf_counter()
+        for _ in range(requests):
+            method, path, body = build()
+            client.open(path, method=method, json=body)
+        cpu = (time.process_time() - cpu_started) * 1000 / requests
+        wall = (time.perf_counter() - wall_started) * 1000 / requests
+        print(f"{name:<40} {cpu:>12.3f} {wall:>13.3f}")
+
+    with app.app_context():
+        app_module.activity_buffer.get_buffer().close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 1_000)
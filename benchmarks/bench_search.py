@@ -0,0 +1,52 @@
+"""
+Бенчмарк поиска пользователей GET /users/search.
+
+Наращивает таблицу пользователей (индекс поиска заполняют триггеры при вставке) и на каждом размере
+замеряет поиск по индексу FTS5 для частого и редкого префикса, по точному адресу и следующую страницу
+по курсору, а для сравнения - поиск без индекса: LIKE 'q%' по username и email, который просматривает
+всю таблицу.
+
+Запуск:
+    python -m benchmarks.bench_search [размер1 размер2 ...]
+"""
+import sys
+
+from sqlalchemy import or_
+
+from benchmarks.common import load_app, measure, seed_users
+from models import USER_JSON_COLUMNS
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+
+def main(sizes):
+    app_module = load_app()
+    app, User = app_module.app, app_module.User
+    client = app.test_client()
+
+    def without_index(prefix):
+        with app.app_context():
+            User.query.with_entities(*USER_JSON_COLUMNS) \
+                .filter(or_(User.username.like(f"{prefix}%"), User.email.like(f"{prefix}%"))) \
+                .order_by(User.id).limit(20).all()
+
+    print(f"{'rows':>10} {'frequent, ms':>13} {'rare, ms':>10} {'email, ms':>10} {'next page, ms':>14} "
+          f"{'LIKE, ms':>10}")
+    seeded = 0
+    for size in sizes:
+        seed_users(app_module, size - seeded, start=seeded)
+        seeded = size
+
+        # "user" есть в каждом имени, а "user1234_" - только у одного пользователя
+        frequent = measure(lambda: client.get("/users/search?q=user"))
+        rare = measure(lambda: client.get(f"/users/search?q=user{size - 1}_"))
+        email = measure(lambda: client.get(f"/users/search?q=user{size // 2}_&field=email"))
+        cursor = client.get("/users/search?q=user&limit=100").json["next_cursor"]
+        next_page = measure(lambda: client.get(f"/users/search?q=user&limit=100&cursor={cursor}"))
+        like = measure(lambda: without_index(f"user{size - 1}_"), repeat=5, warmup=1)
+        print(f"{size:>10} {frequent['p50_ms']:>13} {rare['p50_ms']:>10} {email['p50_ms']:>10} "
+              f"{next_page['p50_ms']:>14} {like['p50_ms']:>10}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
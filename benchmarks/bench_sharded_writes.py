@@ -0,0 +1,75 @@
+"""
+Бенчмарк скорости записи в режиме шардирования (см. sharding.py).
+
+Несколько процессов одновременно создают пользователей через POST /users, как воркеры gunicorn
+с профилем базы production. Замеряется общее количество созданных пользователей в секунду при 1, 2, 4
+и 8 шардах: с одним шардом все процессы ждут единственного писателя SQLite, с несколькими - пишут в разные
+файлы параллельно.
+
+Большая часть времени записи - работа Python (ORM, события агрегатов), а не SQLite, поэтому прирост
+виден, только когда ядер не меньше, чем процессов. На одном ядре процессы и так выполняются по очереди,
+и шарды добавляют лишь стоимость проверки уникальности во всех шардах.
+
+Запуск:
+    python -m benchmarks.bench_sharded_writes [количество процессов] [пользователей на процесс]
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from app import create_app
+
+SHARD_COUNTS = [1, 2, 4, 8]
+DEFAULT_PROCESSES = 4
+DEFAULT_USERS_PER_PROCESS = 500
+
+
+def sharded_app(directory, shards):
+    return create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(directory, 'main.db')}",
+                       "SHARD_DATABASE_URIS": [f"sqlite:///{os.path.join(directory, f'shard{index}.db')}"
+                                               for index in range(shards)],
+                       "DB_PROFILE": "production",
+                       "SWAGGER_ENABLED": False,
+                       "EMAIL_DELIVERABILITY_MODE": "syntax"})
+
+
+def write_users(directory, shards, worker, count, start):
+    client = sharded_app(directory, shards).test_client()
+    start.wait()
+    for i in range(count):
+        response = client.post("/users", json={"username": f"w{worker}_{i}", "email": f"w{worker}_{i}@example.com"})
+        assert response.status_code == 201, response.json
+
+
+def main(processes, users_per_process):
+    context = multiprocessing.get_context("spawn")
+    print(f"{processes} processes x {users_per_process} users, {os.cpu_count()} CPUs")
+    print(f"{'shards':>7} {'users/s':>10} {'speedup':>8}")
+    baseline = None
+    for shards in SHARD_COUNTS:
+        directory = tempfile.mkdtemp(prefix="bench_shards_")
+        result = sharded_app(directory, shards).test_cli_runner().invoke(args=["shards", "init"])
+        assert result.exit_code == 0, result.output
+
+        start = context.Event()
+        workers = [context.Process(target=write_users, args=(directory, shards, worker, users_per_process, start))
+                   for worker in range(processes)]
+        for process in workers:
+            process.start()
+        # Процессы сначала импортируют и создают приложение, отсчёт идёт с одновременного старта записи
+        time.sleep(3)
+        started = time.perf_counter()
+        start.set()
+        for process in workers:
+            process.join()
+            assert process.exitcode == 0
+        throughput = processes * users_per_process / (time.perf_counter() - started)
+        baseline = baseline or throughput
+        print(f"{shards:>7} {throughput:>10.0f} {throughput / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(args[0] if args else DEFAULT_PROCESSES, args[1] if len(args) > 1 else DEFAULT_USERS_PER_PROCESS)
@@ -0,0 +1,86 @@
+"""
+Нагрузочный бенчмарк профилей SQLite (см. database.py) с несколькими процессами, как у воркеров gunicorn.
+
+Каждый процесс импортирует приложение со своим пулом соединений и в течение DURATION секунд шлёт запросы:
+на WRITE_EVERY-й запрос - PUT /users/<id>, остальные - GET /users/<id>/activity_probability. Отметки активности
+пишутся сразу (ACTIVITY_WRITE_BEHIND = False), чтобы писатели конкурировали с читателями. Для каждого профиля
+база копируется из одного и того же заполненного файла.
+
+В профиле default на время записи каждый коммит блокирует читателей и делает fsync, в профиле production
+(WAL, synchronous=NORMAL) чтение идёт параллельно с записью. Ошибки (например, `database is locked`)
+считаются отдельно.
+
+Запуск:
+    python -m benchmarks.bench_sqlite_profiles [количество пользователей] [количество процессов]
+"""
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.common import load_app, seed_users
+
+DURATION = 5
+WRITE_EVERY = 10
+
+
+def worker(index, size, results):
+    app = load_app(os.environ["BENCH_DB_PATH"]).app
+    app.config["ACTIVITY_WRITE_BEHIND"] = False
+    client = app.test_client()
+    rnd = random.Random(index)
+    ok = errors = 0
+    deadline = time.perf_counter() + DURATION
+    while time.perf_counter() < deadline:
+        user_id = rnd.randint(1, size)
+        if (ok + errors) % WRITE_EVERY == 0:
+            response = client.put(f"/users/{user_id}", json={"username": f"user{user_id}_{index}_{ok + errors}"})
+        else:
+            response = client.get(f"/users/{user_id}/activity_probability")
+        if response.status_code == 200:
+            ok += 1
+        else:
+            errors += 1
+    results.put((ok, errors))
+
+
+def run(profile, db_path, size, processes):
+    """
+    Запускает процессы-воркеры на копии базы с профилем `profile`.
+
+    Возвращает:
+        tuple[float, int]: Успешных запросов в секунду и количество ошибок.
+    """
+    os.environ["DB_PROFILE"] = profile
+    os.environ["BENCH_DB_PATH"] = db_path
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    workers = [context.Process(target=worker, args=(i, size, results)) for i in range(processes)]
+    for process in workers:
+        process.start()
+    totals = [results.get() for _ in workers]
+    for process in workers:
+        process.join()
+    return sum(ok for ok, _ in totals) / DURATION, sum(errors for _, errors in totals)
+
+
+def main(size, processes):
+    directory = tempfile.mkdtemp(prefix="bench_")
+    seeded = os.path.join(directory, "seeded.db")
+    seed_users(load_app(seeded), size)
+
+    print(f"{size} users, {processes} processes, {DURATION} s per profile, every {WRITE_EVERY}th request writes")
+    print(f"{'profile':<15} {'req/s':>10} {'errors':>8}")
+    for profile in ("default", "production"):
+        db_path = os.path.join(directory, f"{profile}.db")
+        shutil.copy(seeded, db_path)
+        throughput, errors = run(profile, db_path, size, processes)
+        print(f"{profile:<15} {throughput:>10,.0f} {errors:>8}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 4)
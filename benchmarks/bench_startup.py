@@ -0,0 +1,84 @@
+"""
+Бенчмарк холодного старта воркера.
+
+Каждый замер выполняется в отдельном процессе Python, как запуск нового воркера gunicorn:
+    - import: импорт модуля app (модули приложения, без создания приложения);
+    - create_app: создание приложения, как в wsgi.py;
+    - first request: первый запрос GET /users/<id> тестовым клиентом (первое соединение с базой,
+      компиляция запроса SQLAlchemy, сериализация).
+Выводятся медиана и максимум по REPEAT процессам и бюджет для каждого шага. Если медиана превышает
+бюджет, скрипт завершается с кодом 1, поэтому его можно запускать в CI.
+
+Запуск:
+    python -m benchmarks.bench_startup [количество процессов]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Бюджет времени старта в миллисекундах (медиана)
+BUDGET_MS = {
+    "import": 700,
+    "create_app": 50,
+    "first request": 100,
+}
+
+_PROBE = """
+import json
+import time
+
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+response = application.test_client().get("/users/1")
+finished = time.perf_counter()
+assert response.status_code in (200, 404), response.status_code
+print(json.dumps({"import": (imported - started) * 1000,
+                  "create_app": (created - imported) * 1000,
+                  "first request": (finished - created) * 1000}))
+"""
+
+
+def _prepare_database(root, env):
+    """Создаёт схему во временной базе командой `flask init-db` и добавляет одного пользователя."""
+    subprocess.run([sys.executable, "-m", "flask", "--app", "app", "init-db"], env=env, cwd=root, check=True,
+                   capture_output=True)
+    subprocess.run([sys.executable, "-c",
+                    "import app\n"
+                    "with app.app.app_context():\n"
+                    "    app.db.session.add(app.User(username='startup', email='startup@example.com'))\n"
+                    "    app.db.session.commit()\n"],
+                   env=env, cwd=root, check=True, capture_output=True)
+
+
+def main(repeat):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    db_path = os.path.join(tempfile.mkdtemp(prefix="bench_"), "bench.db")
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{db_path}"}
+    _prepare_database(root, env)
+
+    samples = {step: [] for step in BUDGET_MS}
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", _PROBE], env=env, cwd=root, check=True,
+                                capture_output=True, text=True).stdout
+        for step, value in json.loads(output.splitlines()[-1]).items():
+            samples[step].append(value)
+
+    over_budget = False
+    print(f"{repeat} cold starts")
+    print(f"{'step':<20} {'p50, ms':>10} {'max, ms':>10} {'budget, ms':>11}")
+    for step, values in samples.items():
+        median = statistics.median(values)
+        over_budget |= median > BUDGET_MS[step]
+        mark = "" if median <= BUDGET_MS[step] else "  over budget"
+        print(f"{step:<20} {median:>10.1f} {max(values):>10.1f} {BUDGET_MS[step]:>11}{mark}")
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10))
@@ -0,0 +1,39 @@
+"""
+Бенчмарк эндпоинта /users/top_5_longest_names.
+
+Наращивает таблицу пользователей и на каждом размере замеряет время ответа эндпоинта (ORDER BY по индексу
+username_length) и, для сравнения, прежнего способа: User.query.all() + sorted() в Python.
+Время индексного запроса не должно расти вместе с таблицей.
+
+Запуск:
+    python -m benchmarks.bench_top_longest_names [размер1 размер2 ...]
+"""
+import sys
+
+from benchmarks.common import load_app, measure, seed_users
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+
+def main(sizes):
+    app_module = load_app()
+    app, User = app_module.app, app_module.User
+    client = app.test_client()
+
+    def legacy_top_5():
+        with app.app_context():
+            sorted(User.query.all(), key=lambda user: len(user.username), reverse=True)[:5]
+
+    print(f"{'rows':>10} {'endpoint p50, ms':>18} {'endpoint p95, ms':>18} {'legacy p50, ms':>16}")
+    seeded = 0
+    for size in sizes:
+        seed_users(app_module, size - seeded, start=seeded)
+        seeded = size
+
+        endpoint = measure(lambda: client.get("/users/top_5_longest_names"))
+        legacy = measure(legacy_top_5, repeat=3, warmup=0)
+        print(f"{size:>10} {endpoint['p50_ms']:>18} {endpoint['p95_ms']:>18} {legacy['p50_ms']:>16}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,65 @@
+"""
+Бенчмарк пропускной способности чтения GET /users/<id> несколькими потоками.
+
+Сравнивает прежнюю синхронную запись даты активности (ACTIVITY_WRITE_BEHIND = False: UPDATE и COMMIT
+на каждый запрос) с отложенной записью через буфер (ACTIVITY_WRITE_BEHIND = True), при которой запрос
+только читает из базы, а отметки сбрасываются пачкой в фоне.
+
+Запуск:
+    python -m benchmarks.bench_user_reads [количество пользователей] [количество потоков]
+"""
+import random
+import sys
+import threading
+import time
+
+from benchmarks.common import load_app, seed_users
+
+DURATION = 5
+
+
+def run(app, size, threads):
+    """
+    Гоняет запросы GET /users/<id> из `threads` потоков в течение DURATION секунд.
+
+    Возвращает:
+        float: Количество запросов в секунду.
+    """
+    deadline = time.perf_counter() + DURATION
+    counts = [0] * threads
+
+    def worker(index):
+        client = app.test_client()
+        rnd = random.Random(index)
+        while time.perf_counter() < deadline:
+            client.get(f"/users/{rnd.randint(1, size)}")
+            counts[index] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return sum(counts) / DURATION
+
+
+def main(size, threads):
+    app_module = load_app()
+    app = app_module.app
+    seed_users(app_module, size)
+
+    print(f"{size} users, {threads} threads, {DURATION} s per mode")
+    print(f"{'mode':<30} {'req/s':>10}")
+    for name, write_behind in [("synchronous commit", False), ("write-behind buffer", True)]:
+        app.config["ACTIVITY_WRITE_BEHIND"] = write_behind
+        print(f"{name:<30} {run(app, size, threads):>10,.0f}")
+
+    with app.app_context():
+        buffer = app_module.activity_buffer.get_buffer()
+        buffer.close()
+        print(f"buffered touches flushed in batches: {buffer.flushed}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 4)
@@ -0,0 +1,103 @@
+"""
+Общие утилиты для бенчмарков.
+
+Бенчмарки работают с отдельной временной базой: путь к ней передаётся приложению через переменную
+окружения DATABASE_URL до импорта модуля app, поэтому основная база не затрагивается.
+"""
+import importlib
+import os
+import random
+import statistics
+import string
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+DOMAINS = ["mail.ru", "gmail.com", "yandex.ru", "yahoo.com", "example.com"]
+
+
+def load_app(db_path=None):
+    """
+    Импортирует модуль app, направив его на временную базу данных, и создаёт в ней таблицы.
+
+    Возвращает:
+        module: Модуль app.
+    """
+    if db_path is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="bench_"), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    app_module = importlib.import_module("app")
+    with app_module.app.app_context():
+        app_module.db.create_all()
+    return app_module
+
+
+def seed_users(app_module, count, start=0, chunk_size=10_000):
+    """
+    Быстро добавляет `count` синтетических пользователей пачками через executemany.
+
+    Пользователи нумеруются с `start`, чтобы базу можно было наращивать несколькими вызовами.
+    """
+    app, db, User, aggregates = app_module.app, app_module.db, app_module.User, app_module.aggregates
+    rnd = random.Random(start)
+    now = datetime.utcnow()
+    with app.app_context():
+        for offset in range(start, start + count, chunk_size):
+            rows = []
+            for i in range(offset, min(offset + chunk_size, start + count)):
+                suffix = "".join(rnd.choices(string.ascii_lowercase, k=rnd.randint(0, 20)))
+                username = f"user{i}_{suffix}"
+                domain = rnd.choice(DOMAINS)
+                rows.append({"username": username,
+                             "email": f"{username}@{domain}",
+                             "registration_date": now - timedelta(days=rnd.randint(0, 365)),
+                             "username_length": len(username),
+                             "email_domain": domain})
+            db.session.execute(User.__table__.insert(), rows)
+            db.session.commit()
+        # Пачечная вставка идёт мимо ORM, поэтому агрегаты статистики пересчитываются целиком
+        aggregates.rebuild_aggregates()
+
+
+def measure(fn, repeat=50, warmup=3):
+    """
+    Замеряет время выполнения функции.
+
+    Возвращает:
+        dict: Медиана, 95-й перцентиль и среднее в миллисекундах.
+    """
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {"p50_ms": round(statistics.median(timings), 3),
+            "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3),
+            "mean_ms": round(statistics.fmean(timings), 3)}
+
+
+def summarize(timings, elapsed):
+    """
+    Сводит замеры отдельных запросов.
+
+    Аргументы:
+        timings (list[float]): Время запросов в миллисекундах.
+        elapsed (float): Общее время в секундах, за которое они выполнены.
+
+    Возвращает:
+        dict: Количество запросов, медиана, 95-й и 99-й перцентили, среднее и запросов в секунду.
+    """
+    timings = sorted(timings)
+
+    def percentile(share):
+        return round(timings[max(int(len(timings) * share) - 1, 0)], 3)
+
+    return {"requests": len(timings),
+            "p50_ms": round(statistics.median(timings), 3),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "mean_ms": round(statistics.fmean(timings), 3),
+            "throughput_rps": round(len(timings) / elapsed, 1)}
@@ -0,0 +1,39 @@
+"""
+Сравнение двух отчётов benchmarks.suite.
+
+Для каждого общего сценария выводит p50, p99 и пропускную способность в обоих отчётах и изменение в процентах.
+
+Запуск:
+    python -m benchmarks.compare before.json after.json
+"""
+import json
+import sys
+
+METRICS = ("p50_ms", "p99_ms", "throughput_rps")
+
+
+def _change(before, after):
+    if not before:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def main(before_path, after_path):
+    with open(before_path) as before_file, open(after_path) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+    print(f"before: {before['meta'].get('commit')} ({before['meta'].get('size')} users), "
+          f"after: {after['meta'].get('commit')} ({after['meta'].get('size')} users)")
+    print(f"{'scenario':<26}" + "".join(f" {metric:>32}" for metric in METRICS))
+    for name, result in after["scenarios"].items():
+        previous = before["scenarios"].get(name)
+        if previous is None:
+            continue
+        cells = [f"{previous[metric]} -> {result[metric]} ({_change(previous[metric], result[metric])})"
+                 for metric in METRICS]
+        print(f"{name:<26}" + "".join(f" {cell:>32}" for cell in cells))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m benchmarks.compare BEFORE.json AFTER.json")
+    main(sys.argv[1], sys.argv[2])
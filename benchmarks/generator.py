@@ -0,0 +1,99 @@
+"""
+Генератор синтетических пользователей с реалистичными распределениями.
+
+В отличие от seed_users из common.py (равномерные случайные данные), здесь:
+    - имена собираются из имени, фамилии и номера, поэтому длины имён распределены как у настоящих логинов;
+    - домены почты выбираются с весами популярных почтовых сервисов;
+    - регистраций больше в последние месяцы (база растёт), а не равномерно за год;
+    - у части пользователей есть дата последней активности между регистрацией и текущим моментом,
+      ближе к текущему моменту.
+
+Даты и оценки активности считаются векторно через NumPy, строки вставляются пачками через executemany,
+агрегаты статистики пересобираются один раз в конце. Результат детерминирован при одинаковом seed.
+"""
+from datetime import datetime
+
+import numpy as np
+
+import scoring
+
+FIRST_NAMES = ["alex", "anna", "dmitry", "elena", "ivan", "maria", "sergey", "olga", "nikolai", "tatiana",
+               "john", "emma", "michael", "sophia", "david", "olivia", "li", "yuki", "ahmed", "fatima"]
+LAST_NAMES = ["ivanov", "smirnova", "kuznetsov", "popova", "sokolov", "lebedeva", "smith", "johnson",
+              "williams", "brown", "garcia", "martinez", "wang", "tanaka", "kim", "nguyen", "novak", "muller"]
+SEPARATORS = ["", ".", "_"]
+DOMAINS = ["gmail.com", "mail.ru", "yandex.ru", "outlook.com", "yahoo.com", "icloud.com", "bk.ru", "example.com"]
+DOMAIN_WEIGHTS = [0.34, 0.22, 0.16, 0.09, 0.07, 0.05, 0.04, 0.03]
+# За сколько дней до текущего момента могут быть регистрации
+HISTORY_DAYS = 3 * 365
+# Доля пользователей, у которых есть дата последней активности
+ACTIVE_SHARE = 0.7
+
+
+def generate_chunk(rng, start, count, now):
+    """
+    Генерирует `count` пользователей с номерами от `start`.
+
+    Возвращает:
+        list[dict]: Строки для вставки в таблицу user.
+    """
+    first = rng.integers(len(FIRST_NAMES), size=count)
+    last = rng.integers(len(LAST_NAMES), size=count)
+    separators = rng.integers(len(SEPARATORS), size=count)
+    # У трети пользователей фамилия не указана
+    with_last = rng.random(count) > 0.33
+    domains = rng.choice(len(DOMAINS), size=count, p=DOMAIN_WEIGHTS)
+
+    now64 = np.datetime64(now, "us")
+    # Квадрат равномерного распределения смещает регистрации к текущему моменту
+    age_us = (rng.random(count) ** 2 * HISTORY_DAYS * 86_400e6).astype("int64")
+    registration_dates = now64 - age_us.astype("timedelta64[us]")
+    active_us = ((1 - rng.random(count) ** 3) * age_us).astype("int64")
+    last_active_dates = np.where(rng.random(count) < ACTIVE_SHARE,
+                                 registration_dates + active_us.astype("timedelta64[us]"),
+                                 np.datetime64("NaT", "us"))
+    probabilities = scoring.score_arrays(registration_dates, last_active_dates, now).tolist()
+    expires_at = scoring.next_score_change_arrays(registration_dates, last_active_dates, now).tolist()
+
+    rows = []
+    columns = zip(first.tolist(), last.tolist(), separators.tolist(), with_last.tolist(), domains.tolist(),
+                  registration_dates.tolist(), last_active_dates.tolist(), probabilities, expires_at)
+    for i, values in enumerate(columns, start):
+        first_name, last_name, separator, has_last, domain, registered, active, probability, expires = values
+        username = FIRST_NAMES[first_name]
+        if has_last:
+            username += SEPARATORS[separator] + LAST_NAMES[last_name]
+        # Номер делает имя уникальным
+        username += str(i)
+        rows.append({"username": username,
+                     "email": f"{username}@{DOMAINS[domain]}",
+                     "registration_date": registered,
+                     "last_active_date": active,
+                     "username_length": len(username),
+                     "email_domain": DOMAINS[domain],
+                     "activity_probability": probability,
+                     "activity_score_expires_at": expires})
+    return rows
+
+
+def load_users(app_module, count, start=0, seed=0, chunk_size=10_000):
+    """
+    Добавляет `count` синтетических пользователей пачками и пересобирает агрегаты статистики.
+
+    Аргументы:
+        app_module (module): Модуль app (см. common.load_app).
+        count (int): Количество пользователей.
+        start (int): Номер первого пользователя, чтобы базу можно было наращивать несколькими вызовами.
+        seed (int): Зерно генератора случайных чисел.
+        chunk_size (int): Размер пачки вставки.
+    """
+    app, db, User, aggregates = app_module.app, app_module.db, app_module.User, app_module.aggregates
+    rng = np.random.default_rng([seed, start])
+    now = datetime.utcnow()
+    with app.app_context():
+        for offset in range(start, start + count, chunk_size):
+            rows = generate_chunk(rng, offset, min(chunk_size, start + count - offset), now)
+            db.session.execute(User.__table__.insert(), rows)
+            db.session.commit()
+        # Пачечная вставка идёт мимо ORM, поэтому агрегаты статистики пересчитываются целиком
+        aggregates.rebuild_aggregates()
@@ -0,0 +1,162 @@
+"""
+Набор сценариев нагрузки с отчётом в JSON для сравнения от коммита к коммиту.
+
+Заполняет временную базу генератором (см. generator.py) и прогоняет сценарии через тестовый клиент Flask
+или, с параметром --url, против запущенного сервера (база сервера в этом случае не заполняется).
+Для каждого сценария в отчёт попадают p50/p95/p99, среднее, пропускная способность и количество ошибок,
+а в meta - коммит, размер базы и параметры запуска.
+
+Кэши ответов и пользователей в режиме тестового клиента по умолчанию выключены, чтобы замерять саму
+обработку запроса; --keep-caches оставляет их включёнными.
+
+Запуск:
+    python -m benchmarks.suite --size 100000 --output before.json
+    python -m benchmarks.suite --size 100000 --output after.json
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+from benchmarks.common import load_app, summarize
+from benchmarks.generator import DOMAINS, load_users
+
+
+def _scenarios(size, rnd):
+    """
+    Возвращает сценарии: имя -> функция, которая по номеру запроса строит (метод, путь, тело JSON).
+    """
+    pages = max(size // 10, 1)
+    return {
+        "get_users_first_page": lambda i: ("GET", "/users?page=1", None),
+        "get_users_random_page": lambda i: ("GET", f"/users?page={rnd.randint(1, pages)}", None),
+        "get_users_deep_page": lambda i: ("GET", f"/users?page={pages}", None),
+        "get_users_cursor": lambda i: ("GET", "/users?cursor=", None),
+        "get_user": lambda i: ("GET", f"/users/{rnd.randint(1, size)}", None),
+        "activity_probability": lambda i: ("GET", f"/users/{rnd.randint(1, size)}/activity_probability", None),
+        "statistics": lambda i: ("GET", f"/users/statistics?domain={rnd.choice(DOMAINS)}", None),
+        "email_domain_proportion": lambda i: ("GET", f"/users/email_domain_proportion?domain={rnd.choice(DOMAINS)}",
+                                              None),
+        "email_domains": lambda i: ("GET", "/users/email_domains", None),
+        "top_5_longest_names": lambda i: ("GET", "/users/top_5_longest_names", None),
+        "last_7_days": lambda i: ("GET", "/users/last_7_days", None),
+        "registrations_by_day": lambda i: ("GET", "/users/registrations?bucket=day&registered_from="
+                                                  f"{(datetime.utcnow() - timedelta(days=90)).isoformat()}", None),
+        "create_user": lambda i: ("POST", "/users", {"username": f"bench_{time.time_ns()}_{i}",
+                                                     "email": f"bench_{time.time_ns()}_{i}@gmail.com"}),
+    }
+
+
+def _client_sender(client):
+    def send(method, path, body):
+        return client.open(path, method=method, json=body).status_code
+    return send
+
+
+def _url_sender(base_url):
+    def send(method, path, body):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(base_url.rstrip("/") + path, data=data, method=method,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    return send
+
+
+def run_scenario(send, build, requests, warmup):
+    """
+    Выполняет сценарий последовательно `requests` раз после `warmup` прогревочных запросов.
+
+    Возвращает:
+        dict: Сводка замеров (см. common.summarize) и количество ответов с кодом 400 и выше.
+    """
+    for i in range(warmup):
+        send(*build(-1 - i))
+    timings, errors = [], 0
+    started = time.perf_counter()
+    for i in range(requests):
+        request_started = time.perf_counter()
+        status = send(*build(i))
+        timings.append((time.perf_counter() - request_started) * 1000)
+        if status >= 400:
+            errors += 1
+    return {**summarize(timings, time.perf_counter() - started), "errors": errors}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark scenarios with a JSON report.")
+    parser.add_argument("--size", type=int, default=100_000, help="users to generate (ignored with --url)")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=5, help="warm-up requests per scenario")
+    parser.add_argument("--scenarios", nargs="*", help="scenario names to run (default: all)")
+    parser.add_argument("--url", help="base URL of a running server instead of the Flask test client")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep-caches", action="store_true", help="keep response and user caches enabled")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.url:
+        send = _url_sender(args.url)
+        mode = "server"
+    else:
+        app_module = load_app()
+        if not args.keep_caches:
+            app_module.app.config["CACHE_BACKEND"] = "null"
+            app_module.app.config["USER_CACHE_BACKEND"] = "null"
+        started = time.perf_counter()
+        load_users(app_module, args.size, seed=args.seed)
+        print(f"generated {args.size} users in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+        send = _client_sender(app_module.app.test_client())
+        mode = "test_client"
+
+    scenarios = _scenarios(args.size, random.Random(args.seed))
+    names = args.scenarios or list(scenarios)
+    unknown = set(names) - set(scenarios)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = {}
+    for name in names:
+        results[name] = run_scenario(send, scenarios[name], args.requests, args.warmup)
+        print(f"{name:<26} p50 {results[name]['p50_ms']:>9} ms  p99 {results[name]['p99_ms']:>9} ms  "
+              f"{results[name]['throughput_rps']:>9} req/s  errors {results[name]['errors']}", file=sys.stderr)
+
+    report = {"meta": {"commit": _git_commit(),
+                       "created_at": datetime.utcnow().isoformat(),
+                       "mode": mode,
+                       "url": args.url,
+                       "size": None if args.url else args.size,
+                       "requests": args.requests,
+                       "seed": args.seed,
+                       "caches": None if args.url else args.keep_caches,
+                       "python": platform.python_version()},
+              "scenarios": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Массовый импорт пользователей (POST /users/bulk).
+
+Тело запроса - JSON-массив объектов {"username": ..., "email": ...} или NDJSON (по объекту на строку,
+Content-Type: application/x-ndjson). NDJSON читается построчно из потока запроса, поэтому память
+не зависит от размера импорта.
+
+Записи обрабатываются пачками по BULK_CHUNK_SIZE:
+    1. проверяются обязательные поля и адреса почты (при BULK_VALIDATION_WORKERS > 1 - в пуле процессов,
+       так как validate_email нагружает процессор);
+    2. отбрасываются дубликаты внутри пачки и уже существующие в базе имена и адреса;
+    3. оставшиеся строки вставляются многострочными INSERT в одной транзакции на пачку,
+       вместе с обновлением агрегатов статистики.
+
+Ошибочные записи не прерывают импорт: для каждой возвращается её номер и причина.
+
+Проверка доставляемости почты (DNS-запрос MX) для импорта по умолчанию выключена (BULK_CHECK_DELIVERABILITY),
+иначе на каждую запись приходился бы сетевой запрос.
+"""
+import json
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice, repeat
+
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+import aggregates
+import cache
+import scoring
+import user_cache
+from models import db, normalize_email_domain, User
+
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+class BulkImportError(ValueError):
+    """Тело запроса не является ни JSON-массивом, ни NDJSON."""
+
+
+def iter_records(request):
+    """
+    Возвращает записи импорта из запроса по одной.
+
+    Возвращает:
+        iterator[tuple[int, object, str]]: Номер записи, сама запись и ошибка разбора (или None).
+
+    Исключения:
+        BulkImportError: Если тело не является JSON-массивом или NDJSON.
+    """
+    if request.mimetype in NDJSON_MIMETYPES:
+        return _iter_ndjson(request.stream)
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        raise BulkImportError("expected a JSON array or an NDJSON body")
+    return ((index, record, None) for index, record in enumerate(data))
+
+
+def _iter_ndjson(stream):
+    index = 0
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield index, json.loads(line), None
+        except ValueError:
+            yield index, None, "invalid JSON"
+        index += 1
+
+
+def _check_email(email, check_deliverability):
+    """Возвращает текст ошибки проверки адреса или None, если адрес корректен."""
+    from email_validator import validate_email, EmailNotValidError
+
+    try:
+        validate_email(email, check_deliverability=check_deliverability)
+        return None
+    except EmailNotValidError as e:
+        return str(e)
+
+
+def _get_executor():
+    workers = current_app.config["BULK_VALIDATION_WORKERS"]
+    if workers <= 1:
+        return None
+    executor = current_app.extensions.get("bulk_validation_executor")
+    if executor is None:
+        executor = current_app.extensions["bulk_validation_executor"] = ProcessPoolExecutor(max_workers=workers)
+    return executor
+
+
+def _validate_chunk(chunk, errors):
+    """Проверяет поля и адреса почты пачки, возвращает корректные записи (номер, имя, почта)."""
+    candidates = []
+    for index, record, error in chunk:
+        if error:
+            errors.append({"index": index, "message": error})
+        elif (not isinstance(record, dict) or not isinstance(record.get("username"), str)
+              or not isinstance(record.get("email"), str)):
+            errors.append({"index": index, "message": "username and email are required"})
+        else:
+            candidates.append((index, record["username"], record["email"]))
+
+    emails = [email for _, _, email in candidates]
+    check_deliverability = current_app.config["BULK_CHECK_DELIVERABILITY"]
+    executor = _get_executor()
+    if executor is not None:
+        chunksize = max(1, len(emails) // (current_app.config["BULK_VALIDATION_WORKERS"] * 4))
+        results = executor.map(_check_email, emails, repeat(check_deliverability), chunksize=chunksize)
+    else:
+        results = map(_check_email, emails, repeat(check_deliverability))
+
+    valid = []
+    for (index, username, email), error in zip(candidates, results):
+        if error:
+            errors.append({"index": index, "message": error})
+        else:
+            valid.append((index, username, email))
+    return valid
+
+
+def _drop_duplicates(valid, errors):
+    """Убирает записи с именами или адресами, которые повторяются в пачке или уже есть в базе."""
+    usernames = {username for _, username, _ in valid}
+    emails = {email for _, _, email in valid}
+    taken_usernames = set(db.session.scalars(select(User.username).where(User.username.in_(usernames))))
+    taken_emails = set(db.session.scalars(select(User.email).where(User.email.in_(emails))))
+
+    unique = []
+    for index, username, email in valid:
+        if username in taken_usernames:
+            errors.append({"index": index, "message": "username already exists"})
+        elif email in taken_emails:
+            errors.append({"index": index, "message": "email already exists"})
+        else:
+            taken_usernames.add(username)
+            taken_emails.add(email)
+            unique.append((index, username, email))
+    return unique
+
+
+def _insert_chunk(unique, errors):
+    """Вставляет пачку пользователей и обновляет агрегаты, возвращает количество вставленных строк."""
+    now = datetime.utcnow()
+    rows = [{"username": username,
+             "email": email,
+             "registration_date": now,
+             "username_length": len(username),
+             "email_domain": normalize_email_domain(email),
+             # Оценка активности нового пользователя без активности постоянна (см. scoring.py)
+             "activity_probability": scoring.activity_probability(now, None, now),
+             "activity_score_expires_at": scoring.next_score_change(now, None, now)} for _, username, email in unique]
+    user = User.__table__
+
+    # Дубликаты уже отсеяны, поэтому обычно вся пачка уходит одним executemany. Если параллельный запрос
+    # успел вставить такое же имя или адрес, вставляем построчно с OR IGNORE, чтобы не откатывать пачку
+    try:
+        ids = db.session.execute(user.insert().returning(user.c.id, sort_by_parameter_order=True),
+                                 rows).scalars().all()
+        inserted = rows
+    except IntegrityError:
+        db.session.rollback()
+        ids, inserted = [], []
+        for (index, _, _), row in zip(unique, rows):
+            user_id = db.session.execute(user.insert().prefix_with("OR IGNORE").returning(user.c.id),
+                                         row).scalar()
+            if user_id is None:
+                errors.append({"index": index, "message": "username or email already exists"})
+            else:
+                ids.append(user_id)
+                inserted.append(row)
+
+    aggregates.record_bulk_insert(db.session.connection(),
+                                  [aggregates.UserFacts(user_id, now.date(), row["email_domain"],
+                                                        row["username_length"])
+                                   for user_id, row in zip(ids, inserted)])
+    db.session.commit()
+    # Новые id могли попасть в кэш пользователей как отсутствующие
+    user_cache.invalidate(ids)
+    return len(ids)
+
+
+def import_users(records):
+    """
+    Импортирует пользователей пачками.
+
+    Аргументы:
+        records (iterator): Записи из iter_records.
+
+    Возвращает:
+        dict: Количество вставленных и отклонённых записей и список ошибок по записям.
+    """
+    chunk_size = current_app.config["BULK_CHUNK_SIZE"]
+    inserted, errors = 0, []
+    try:
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                break
+            valid = _validate_chunk(chunk, errors)
+            unique = _drop_duplicates(valid, errors) if valid else []
+            if unique:
+                inserted += _insert_chunk(unique, errors)
+    finally:
+        # Вставка идёт мимо ORM, поэтому кэш аналитики сбрасываем явно (в том числе после частичного импорта)
+        if inserted:
+            cache.invalidate(cache.ALL_TAGS)
+
+    errors.sort(key=lambda error: error["index"])
+    return {"inserted": inserted, "failed": len(errors), "errors": errors}
+
+
+def init_app(app):
+    """Задаёт настройки массового импорта по умолчанию."""
+    app.config.setdefault("BULK_CHUNK_SIZE", 5000)
+    app.config.setdefault("BULK_VALIDATION_WORKERS", 0)
+    app.config.setdefault("BULK_CHECK_DELIVERABILITY", False)
@@ -0,0 +1,337 @@
+"""
+Кэш ответов для аналитических эндпоинтов.
+
+Поддерживаются бэкенды (настройка CACHE_BACKEND):
+    - "memory": LRU-кэш в памяти процесса с TTL и ограничением размера (по умолчанию);
+    - "sqlite": общий для всех воркеров gunicorn кэш в отдельном файле SQLite (CACHE_SQLITE_PATH);
+    - "null": кэширование отключено.
+
+Ключ кэша состоит из тега эндпоинта, пути и параметров запроса (например, `domain`). При изменении
+пользователей записи сбрасываются по тегам: после коммита сессии смотрим, какие поля пользователей
+поменялись, и удаляем только зависящие от них записи. Так сброс срабатывает и для POST/PUT/DELETE /users,
+и для любых других изменений через ORM. Запись мимо ORM (например, сброс буфера активности в
+activity_buffer.py) сбрасывает свои теги сама через invalidate.
+
+Ответы из кэша помечаются заголовком X-Cache (HIT или MISS), счётчики попаданий, промахов и вытеснений
+доступны на GET /cache/stats (см. app.py).
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import current_app, make_response, request
+from sqlalchemy import event, inspect
+
+import profiling
+from models import db, User
+
+# Теги записей кэша, зависящих от соответствующих данных пользователей
+REGISTRATIONS = "registrations"
+LONGEST_NAMES = "longest_names"
+EMAIL_DOMAINS = "email_domains"
+STATISTICS = "statistics"
+ALL_TAGS = (REGISTRATIONS, LONGEST_NAMES, EMAIL_DOMAINS, STATISTICS)
+
+# Какие теги надо сбросить при изменении поля пользователя
+_FIELD_TAGS = {
+    "registration_date": (REGISTRATIONS, STATISTICS),
+    "username": (LONGEST_NAMES, STATISTICS),
+    "email": (EMAIL_DOMAINS, STATISTICS),
+    # Топ длинных имён и статистика отдают пользователей целиком, вместе с датой последней активности
+    "last_active_date": (LONGEST_NAMES, STATISTICS),
+}
+
+
+class CacheStats:
+    """Счётчики работы кэша."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def as_dict(self):
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations}
+
+
+class LRUCache:
+    """
+    LRU-кэш в памяти процесса с временем жизни записей.
+
+    Аргументы:
+        max_entries (int): Максимальное количество записей, при превышении вытесняются самые старые по доступу.
+        default_ttl (float): Время жизни записи в секундах.
+    """
+    name = "memory"
+
+    def __init__(self, max_entries=1024, default_ttl=30):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.stats = CacheStats()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.default_ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """
+    Кэш в отдельном файле SQLite, общий для всех процессов на машине.
+
+    Значения сериализуются через pickle. Счётчики попаданий считаются в пределах процесса.
+
+    Аргументы:
+        path (str): Путь к файлу кэша.
+        max_entries (int): Максимальное количество записей, при превышении удаляются ближайшие к истечению.
+        default_ttl (float): Время жизни записи в секундах.
+    """
+    name = "sqlite"
+
+    def __init__(self, path, max_entries=1024, default_ttl=30):
+        self.path = path
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.stats = CacheStats()
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS cache_entry "
+                               "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_cache_entry_expires_at ON cache_entry (expires_at)")
+
+    def _connection(self):
+        # Соединение sqlite3 нельзя использовать из разных потоков, поэтому у каждого потока своё
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        connection = self._connection()
+        row = connection.execute("SELECT value, expires_at FROM cache_entry WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.stats.misses += 1
+            return None
+        value, expires_at = row
+        if expires_at <= time.time():
+            connection.execute("DELETE FROM cache_entry WHERE key = ? AND expires_at <= ?", (key, time.time()))
+            self.stats.expirations += 1
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.default_ttl if ttl is None else ttl)
+        connection = self._connection()
+        connection.execute("INSERT OR REPLACE INTO cache_entry (key, value, expires_at) VALUES (?, ?, ?)",
+                           (key, pickle.dumps(value), expires_at))
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            expired = connection.execute("DELETE FROM cache_entry WHERE expires_at <= ?", (time.time(),)).rowcount
+            self.stats.expirations += expired
+            excess -= expired
+        if excess > 0:
+            connection.execute("DELETE FROM cache_entry WHERE key IN "
+                               "(SELECT key FROM cache_entry ORDER BY expires_at LIMIT ?)", (excess,))
+            self.stats.evictions += excess
+
+    def delete_prefix(self, prefix):
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        self._connection().execute("DELETE FROM cache_entry WHERE key LIKE ? ESCAPE '\\'", (escaped + "%",))
+
+    def clear(self):
+        self._connection().execute("DELETE FROM cache_entry")
+
+    def __len__(self):
+        return self._connection().execute("SELECT count(*) FROM cache_entry").fetchone()[0]
+
+
+class NullCache:
+    """Заглушка, которая ничего не кэширует."""
+    name = "null"
+
+    def __init__(self):
+        self.stats = CacheStats()
+
+    def get(self, key):
+        self.stats.misses += 1
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete_prefix(self, prefix):
+        pass
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+def create_cache(config, instance_path, prefix="CACHE", filename="response_cache.db"):
+    """
+    Создаёт бэкенд кэша по настройкам приложения.
+
+    Аргументы:
+        config (Config): Настройки приложения.
+        instance_path (str): Папка instance приложения, в ней по умолчанию лежит файл SQLite-кэша.
+        prefix (str): Префикс настроек: читаются `<prefix>_BACKEND`, `<prefix>_MAX_ENTRIES`,
+                      `<prefix>_DEFAULT_TTL` и `<prefix>_SQLITE_PATH`.
+        filename (str): Имя файла SQLite-кэша в папке instance по умолчанию.
+    """
+    backend = config.get(f"{prefix}_BACKEND", "memory")
+    max_entries = config.get(f"{prefix}_MAX_ENTRIES", 1024)
+    default_ttl = config.get(f"{prefix}_DEFAULT_TTL", 30)
+    if backend == "memory":
+        return LRUCache(max_entries, default_ttl)
+    if backend == "sqlite":
+        path = config.get(f"{prefix}_SQLITE_PATH") or os.path.join(instance_path, filename)
+        return SQLiteCache(path, max_entries, default_ttl)
+    if backend == "null":
+        return NullCache()
+    raise ValueError(f"Unknown {prefix}_BACKEND: {backend}")
+
+
+def get_cache():
+    """Возвращает кэш текущего приложения, создавая его при первом обращении."""
+    cache = current_app.extensions.get("response_cache")
+    if cache is None:
+        cache = current_app.extensions["response_cache"] = create_cache(current_app.config,
+                                                                        current_app.instance_path)
+    return cache
+
+
+def _cache_key(tag):
+    query = urlencode(sorted(request.args.items(multi=True)))
+    return f"{tag}:{request.path}?{query}"
+
+
+def cached_response(tag, ttl=None):
+    """
+    Декоратор для GET-эндпоинтов: кэширует успешные ответы под заданным тегом.
+
+    Аргументы:
+        tag (str): Тег, по которому записи сбрасываются при изменении данных.
+        ttl (float): Время жизни записи, по умолчанию CACHE_DEFAULT_TTL.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.environ.get(profiling.ENVIRON_KEY):
+                # Профилируется работа эндпоинта, а не чтение из кэша (см. profiling.py)
+                response = make_response(view(*args, **kwargs))
+                response.headers["X-Cache"] = "BYPASS"
+                return response
+            cache = get_cache()
+            key = _cache_key(tag)
+            cached = cache.get(key)
+            if cached is not None:
+                body, mimetype = cached
+                response = make_response(body, 200)
+                response.mimetype = mimetype
+                response.headers["X-Cache"] = "HIT"
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                cache.set(key, (response.get_data(), response.mimetype), ttl)
+            response.headers["X-Cache"] = "MISS"
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate(tags):
+    """Удаляет из кэша все записи с указанными тегами."""
+    cache = get_cache()
+    for tag in tags:
+        cache.delete_prefix(f"{tag}:")
+
+
+def _collect_changed_tags(session, flush_context):
+    """Запоминает в сессии теги, которые надо сбросить после коммита."""
+    tags = session.info.setdefault("cache_invalidate_tags", set())
+    for user in list(session.new) + list(session.deleted):
+        if isinstance(user, User):
+            tags.update(ALL_TAGS)
+    for user in session.dirty:
+        if isinstance(user, User):
+            state = inspect(user)
+            for field, field_tags in _FIELD_TAGS.items():
+                if state.attrs[field].history.has_changes():
+                    tags.update(field_tags)
+
+
+def _invalidate_after_commit(session):
+    # Сбрасываем после коммита, иначе параллельный запрос мог бы положить в кэш ещё старые данные
+    tags = session.info.pop("cache_invalidate_tags", None)
+    if tags:
+        invalidate(tags)
+
+
+def _forget_changed_tags(session, previous_transaction):
+    session.info.pop("cache_invalidate_tags", None)
+
+
+def init_app(app):
+    """Задаёт настройки кэша по умолчанию и подключает сброс кэша к событиям сессии."""
+    app.config.setdefault("CACHE_BACKEND", "memory")
+    app.config.setdefault("CACHE_DEFAULT_TTL", 30)
+    app.config.setdefault("CACHE_MAX_ENTRIES", 1024)
+    app.config.setdefault("CACHE_SQLITE_PATH", None)
+
+    for name, listener in (("after_flush", _collect_changed_tags),
+                           ("after_commit", _invalidate_after_commit),
+                           ("after_soft_rollback", _forget_changed_tags)):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
@@ -0,0 +1,225 @@
+"""
+Подключение к базе данных и профили настроек SQLite.
+
+Адрес базы берётся из SQLALCHEMY_DATABASE_URI, переменной окружения DATABASE_URL или по умолчанию
+`sqlite:///data_base.db`. Профиль выбирается настройкой DB_PROFILE или переменной окружения DB_PROFILE:
+    - "default": настройки SQLAlchemy и SQLite по умолчанию, как раньше;
+    - "production": для нескольких воркеров gunicorn. Журнал WAL (читатели не ждут писателя),
+      synchronous=NORMAL (fsync только на контрольных точках WAL), mmap_size и cache_size для чтения
+      из памяти, busy_timeout, чтобы при занятой базе ждать, а не сразу получать `database is locked`,
+      пул соединений и отдельный движок только для чтения.
+
+PRAGMA выполняются при каждом новом соединении. Значения профиля можно переопределить настройкой
+SQLITE_PRAGMAS (словарь), пул - через SQLALCHEMY_ENGINE_OPTIONS, движок для чтения - DB_READ_ONLY_ENGINE.
+
+Движок только для чтения (read_engine) открывает тот же файл в режиме `mode=ro` и используется длинными
+потоковыми чтениями (выгрузка, пакетная оценка), чтобы они не занимали соединения пула основного движка.
+
+Асинхронный движок для ASGI-режима (см. asgi.py) создаёт create_async_engine: тот же файл через aiosqlite
+с теми же PRAGMA и параметрами пула.
+
+Схема не создаётся при запуске приложения. Команды:
+    - `flask init-db`: создаёт таблицы и индексы, которых ещё нет (db.create_all), для новой базы;
+    - `flask db ...`: миграции Flask-Migrate. Flask-Migrate и Alembic импортируются только при вызове
+      этой группы команд, а не в каждом воркере при создании приложения.
+"""
+import os
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.ext import asyncio as sqlalchemy_asyncio
+
+from models import db
+
+DEFAULT_DATABASE_URI = "sqlite:///data_base.db"
+
+PROFILES = {
+    "default": {
+        "pragmas": {},
+        "engine_options": {},
+        "read_only_engine": False,
+    },
+    "production": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 5000,
+            "mmap_size": 256 * 1024 * 1024,
+            # Отрицательное значение - размер в килобайтах (64 МБ на соединение)
+            "cache_size": -64 * 1024,
+            "temp_store": "MEMORY",
+        },
+        "engine_options": {
+            "pool_size": 10,
+            "max_overflow": 20,
+            "pool_timeout": 30,
+            "pool_recycle": 3600,
+            "pool_pre_ping": True,
+        },
+        "read_only_engine": True,
+    },
+}
+
+# Эти PRAGMA меняют файл базы, поэтому на соединениях только для чтения не выполняются
+_WRITE_PRAGMAS = {"journal_mode"}
+
+
+def get_profile(name):
+    """
+    Возвращает профиль настроек по имени.
+
+    Исключения:
+        ValueError: Если профиль не известен.
+    """
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(f"DB_PROFILE must be one of {tuple(PROFILES)}, got {name!r}") from None
+
+
+def _is_memory(url):
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def _set_pragmas(engine, pragmas):
+    """Выполняет PRAGMA на каждом новом соединении движка."""
+    if not pragmas:
+        return
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    event.listen(engine, "connect", on_connect)
+
+
+def _create_read_engine(engine, pragmas, engine_options):
+    """Создаёт движок, открывающий файл основной базы только для чтения."""
+    path = engine.url.database
+    url = f"sqlite:///file:{path}?mode=ro&uri=true"
+    read_engine = create_engine(url, **engine_options)
+    read_pragmas = {name: value for name, value in pragmas.items() if name not in _WRITE_PRAGMAS}
+    read_pragmas["query_only"] = 1
+    _set_pragmas(read_engine, read_pragmas)
+    return read_engine
+
+
+def _resolve_sqlite_path(url):
+    """
+    Переводит относительный путь к файлу SQLite в путь от папки instance приложения, как Flask-SQLAlchemy
+    делает для SQLALCHEMY_DATABASE_URI, чтобы относительные адреса не зависели от текущей папки процесса.
+    """
+    url = make_url(url)
+    if url.drivername not in ("sqlite", "sqlite+pysqlite") or url.database in (None, "", ":memory:"):
+        return url
+    # Адрес вида sqlite:///file:path?uri=true
+    is_uri = url.query.get("uri", False)
+    path = url.database[5:] if is_uri else url.database
+    if os.path.isabs(path):
+        return url
+    os.makedirs(current_app.instance_path, exist_ok=True)
+    path = os.path.join(current_app.instance_path, path)
+    return url.set(database=f"file:{path}" if is_uri else path)
+
+
+def create_profile_engine(url):
+    """
+    Создаёт движок для другого файла базы с PRAGMA и параметрами пула профиля текущего приложения.
+
+    Используется для файлов шардов (см. sharding.py); закрывать движок (dispose) должен вызывающий код.
+    Относительный путь к файлу SQLite, как и у основной базы, отсчитывается от папки instance.
+    """
+    engine = create_engine(_resolve_sqlite_path(url), **current_app.config["SQLALCHEMY_ENGINE_OPTIONS"])
+    _set_pragmas(engine, current_app.extensions["database"]["pragmas"])
+    return engine
+
+
+def read_engine():
+    """Возвращает движок для чтения, а если он не настроен - основной движок."""
+    engine = current_app.extensions["database"]["read_engine"]
+    return engine if engine is not None else db.engine
+
+
+def create_async_engine():
+    """
+    Создаёт асинхронный движок (aiosqlite) для базы текущего приложения с PRAGMA и пулом его профиля.
+
+    Возвращает:
+        AsyncEngine: Новый движок; закрывать его (dispose) должен вызывающий код.
+    """
+    url = db.engine.url
+    if url.get_backend_name() == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    engine = sqlalchemy_asyncio.create_async_engine(url, **current_app.config["SQLALCHEMY_ENGINE_OPTIONS"])
+    _set_pragmas(engine.sync_engine, current_app.extensions["database"]["pragmas"])
+    return engine
+
+
+class _LazyMigrateGroup(click.Group):
+    """
+    Группа `flask db`: при вызове подключает Flask-Migrate к приложению и передаёт разбор аргументов
+    и выполнение его группе команд. FlaskGroup вызывает её уже в контексте приложения.
+    """
+
+    def make_context(self, info_name, args, parent=None, **extra):
+        from flask_migrate import Migrate
+        from flask_migrate.cli import db as migrate_cli
+
+        if "migrate" not in current_app.extensions:
+            Migrate(current_app._get_current_object(), db)
+        return migrate_cli.make_context(info_name, args, parent=parent, **extra)
+
+
+migrate_cli = _LazyMigrateGroup("db", help="Миграции базы данных (Flask-Migrate).")
+
+
+@click.command("init-db")
+@with_appcontext
+def init_db_command():
+    """Создаёт таблицы и индексы, которых ещё нет в базе."""
+    db.create_all()
+    click.echo("Database schema created")
+
+
+def init_app(app):
+    """
+    Настраивает подключение к базе по выбранному профилю и подключает db к приложению.
+
+    Вызывается вместо db.init_app(app).
+    """
+    app.config.setdefault("SQLALCHEMY_DATABASE_URI", os.environ.get("DATABASE_URL", DEFAULT_DATABASE_URI))
+    app.config.setdefault("DB_PROFILE", os.environ.get("DB_PROFILE", "default"))
+    profile = get_profile(app.config["DB_PROFILE"])
+    app.config.setdefault("DB_READ_ONLY_ENGINE", profile["read_only_engine"])
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() != "sqlite" or _is_memory(url):
+        # Профиль рассчитан на файл SQLite: для базы в памяти пул, WAL и движок для чтения не имеют смысла
+        pragmas, engine_options, use_read_engine = {}, {}, False
+    else:
+        pragmas = {**profile["pragmas"], **app.config.get("SQLITE_PRAGMAS", {})}
+        engine_options = dict(profile["engine_options"])
+        use_read_engine = app.config["DB_READ_ONLY_ENGINE"]
+    engine_options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    if "busy_timeout" in pragmas:
+        # Драйвер sqlite3 ждёт блокировку сам, задаём ему тот же таймаут в секундах
+        connect_args = {"timeout": pragmas["busy_timeout"] / 1000, **engine_options.get("connect_args", {})}
+        engine_options["connect_args"] = connect_args
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options
+
+    db.init_app(app)
+
+    with app.app_context():
+        engine = db.engine
+        _set_pragmas(engine, pragmas)
+        app.extensions["database"] = {
+            "profile": app.config["DB_PROFILE"],
+            "pragmas": pragmas,
+            "read_engine": _create_read_engine(engine, pragmas, engine_options) if use_read_engine else None,
+        }
+
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_cli)
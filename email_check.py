@@ -0,0 +1,213 @@
+"""
+Проверка адреса почты при создании пользователя (POST /users) с кэшем доставляемости доменов.
+
+validate_email с настройками по умолчанию проверяет доставляемость DNS-запросом MX домена прямо в потоке
+запроса, и медленный DNS-сервер задерживает весь воркер. Здесь проверка синтаксиса отделена от проверки
+домена, а результат проверки домена кэшируется:
+    - домен, принимающий почту, - на EMAIL_DOMAIN_CACHE_DEFAULT_TTL секунд (по умолчанию сутки);
+    - домен, не принимающий почту, и домен, который не удалось проверить (таймаут или ошибка DNS), -
+      на EMAIL_DOMAIN_CACHE_NEGATIVE_TTL секунд, чтобы сбой DNS не запоминался надолго.
+Бэкенды те же, что у кэша ответов (см. cache.py), настройки с префиксом EMAIL_DOMAIN_CACHE_. Одновременные
+проверки одного домена внутри процесса выполняются одним DNS-запросом (single-flight).
+
+Режим EMAIL_DELIVERABILITY_MODE:
+    - "full" (по умолчанию): синтаксис и домен проверяются в запросе, DNS-запрос - только при промахе кэша
+      и не дольше EMAIL_DNS_TIMEOUT секунд;
+    - "syntax": проверяется только синтаксис;
+    - "async": в запросе проверяется синтаксис и домен, если он уже есть в кэше. Неизвестный домен
+      проверяется в фоновом потоке, а адрес принимается сразу; если домен не принимает почту, это пишется
+      в журнал и учитывается в счётчике undeliverable_after_accept, а следующие адреса с ним уже отклоняются.
+Адрес с доменом, который не удалось проверить, принимается, как и в email_validator.
+
+Вместо DNS можно подставить свою проверку домена настройкой EMAIL_DOMAIN_RESOLVER: функция, которая
+по домену возвращает True (принимает почту), None (неизвестно) или выбрасывает EmailUndeliverableError.
+Так проверка работает без сети, например в тестах.
+
+Счётчики кэша и проверок отдаются на GET /cache/stats (раздел email_domains).
+
+email_validator (вместе с idna и certifi) импортируется при первой проверке адреса, а не при запуске воркера.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from cache import create_cache
+from user_cache import SingleFlight
+
+MODES = ("full", "syntax", "async")
+
+# Результаты проверки домена в кэше
+DELIVERABLE = "deliverable"
+UNDELIVERABLE = "undeliverable"
+UNKNOWN = "unknown"
+
+
+def dns_resolver(timeout):
+    """
+    Возвращает проверку домена по записям MX (A/AAAA) через email_validator с таймаутом DNS.
+
+    dnspython импортируется здесь, при первой проверке домена, а не при создании приложения.
+    """
+    import dns.resolver
+    from email_validator.deliverability import validate_email_deliverability
+
+    resolver = dns.resolver.Resolver()
+    resolver.lifetime = timeout
+
+    def resolve(domain):
+        info = validate_email_deliverability(domain, domain, dns_resolver=resolver)
+        return None if "unknown-deliverability" in info else True
+
+    return resolve
+
+
+class DomainChecker:
+    """
+    Проверка адресов почты с кэшем доставляемости доменов.
+
+    Аргументы:
+        backend: Бэкенд кэша (LRUCache, SQLiteCache или NullCache).
+        resolve (callable): Проверка домена, см. EMAIL_DOMAIN_RESOLVER.
+        mode (str): Режим, один из MODES.
+        negative_ttl (float): Время жизни записи о недоставляемом или непроверенном домене в секундах.
+        workers (int): Количество фоновых потоков проверки в режиме "async".
+    """
+
+    def __init__(self, backend, resolve, mode="full", negative_ttl=300, workers=2):
+        if mode not in MODES:
+            raise ValueError(f"EMAIL_DELIVERABILITY_MODE must be one of {MODES}")
+        self.backend = backend
+        self.resolve = resolve
+        self.mode = mode
+        self.negative_ttl = negative_ttl
+        self.workers = workers
+        self.flight = SingleFlight()
+        self.lookups = 0
+        self.lookup_errors = 0
+        self.undeliverable_after_accept = 0
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(domain):
+        return f"domain:{domain}"
+
+    def check(self, email):
+        """
+        Проверяет адрес в соответствии с режимом.
+
+        Возвращает:
+            ValidatedEmail: Результат разбора адреса из email_validator.
+
+        Исключения:
+            EmailNotValidError: Если адрес некорректен или его домен не принимает почту.
+        """
+        from email_validator import EmailUndeliverableError, validate_email
+
+        validated = validate_email(email, check_deliverability=False)
+        if self.mode == "syntax":
+            return validated
+
+        domain = validated.ascii_domain
+        status = self.backend.get(self._key(domain))
+        if status is None:
+            if self.mode == "async":
+                self._verify_later(domain)
+                return validated
+            status = self.flight.do(domain, lambda: self._lookup(domain))
+        if status[0] == UNDELIVERABLE:
+            raise EmailUndeliverableError(status[1])
+        return validated
+
+    def _lookup(self, domain):
+        from email_validator import EmailUndeliverableError
+
+        with self._lock:
+            self.lookups += 1
+        try:
+            status = (DELIVERABLE, None) if self.resolve(domain) else (UNKNOWN, None)
+        except EmailUndeliverableError as e:
+            status = (UNDELIVERABLE, str(e))
+        except Exception as e:
+            logging.warning(f"Email domain check failed for {domain}: {e}")
+            with self._lock:
+                self.lookup_errors += 1
+            status = (UNKNOWN, None)
+        self.backend.set(self._key(domain), status, None if status[0] == DELIVERABLE else self.negative_ttl)
+        return status
+
+    def _verify_later(self, domain):
+        with self._lock:
+            if domain in self._pending:
+                return
+            self._pending.add(domain)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="email-check")
+            self._executor.submit(self._verify, domain)
+
+    def _verify(self, domain):
+        try:
+            status = self.flight.do(domain, lambda: self._lookup(domain))
+            if status[0] == UNDELIVERABLE:
+                logging.warning(f"Accepted email address with undeliverable domain {domain}: {status[1]}")
+                with self._lock:
+                    self.undeliverable_after_accept += 1
+        finally:
+            with self._lock:
+                self._pending.discard(domain)
+
+    def close(self, wait=True):
+        """Останавливает фоновые проверки; при wait=True дожидается уже запущенных."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def stats(self):
+        """Возвращает режим и счётчики кэша доменов и проверок."""
+        cache_stats = self.backend.stats.as_dict()
+        requests = cache_stats["hits"] + cache_stats["misses"]
+        return {"mode": self.mode,
+                "backend": self.backend.name,
+                "entries": len(self.backend),
+                **cache_stats,
+                "hit_rate": cache_stats["hits"] / requests if requests else 0,
+                "lookups": self.lookups,
+                "lookup_errors": self.lookup_errors,
+                "pending": len(self._pending),
+                "undeliverable_after_accept": self.undeliverable_after_accept}
+
+
+def get_checker():
+    """Возвращает проверку адресов текущего приложения, создавая её при первом обращении."""
+    checker = current_app.extensions.get("email_check")
+    if checker is None:
+        config = current_app.config
+        backend = create_cache(config, current_app.instance_path, "EMAIL_DOMAIN_CACHE", "email_domain_cache.db")
+        resolve = config["EMAIL_DOMAIN_RESOLVER"] or dns_resolver(config["EMAIL_DNS_TIMEOUT"])
+        checker = current_app.extensions["email_check"] = DomainChecker(backend, resolve,
+                                                                        config["EMAIL_DELIVERABILITY_MODE"],
+                                                                        config["EMAIL_DOMAIN_CACHE_NEGATIVE_TTL"],
+                                                                        config["EMAIL_VERIFY_WORKERS"])
+    return checker
+
+
+def check_email(email):
+    """Проверяет адрес почты (см. DomainChecker.check)."""
+    return get_checker().check(email)
+
+
+def init_app(app):
+    """Задаёт настройки проверки адресов почты по умолчанию."""
+    app.config.setdefault("EMAIL_DELIVERABILITY_MODE", "full")
+    app.config.setdefault("EMAIL_DNS_TIMEOUT", 5)
+    app.config.setdefault("EMAIL_VERIFY_WORKERS", 2)
+    app.config.setdefault("EMAIL_DOMAIN_RESOLVER", None)
+    app.config.setdefault("EMAIL_DOMAIN_CACHE_BACKEND", "memory")
+    app.config.setdefault("EMAIL_DOMAIN_CACHE_DEFAULT_TTL", 24 * 60 * 60)
+    app.config.setdefault("EMAIL_DOMAIN_CACHE_MAX_ENTRIES", 10000)
+    app.config.setdefault("EMAIL_DOMAIN_CACHE_SQLITE_PATH", None)
+    app.config.setdefault("EMAIL_DOMAIN_CACHE_NEGATIVE_TTL", 300)
@@ -0,0 +1,81 @@
+"""
+Потоковая выгрузка таблицы пользователей (GET /users/export) в NDJSON или CSV.
+
+Строки читаются из базы пачками по EXPORT_BATCH_SIZE (yield_per) в виде кортежей столбцов, без создания
+ORM-объектов, и сразу отдаются клиенту генератором. Ни результат запроса, ни тело ответа целиком в памяти
+не держатся, поэтому потребление памяти воркером не зависит от размера выгрузки.
+
+Выгрузка читает базу в одной транзакции, пока клиент не заберёт ответ целиком.
+"""
+import csv
+import io
+import json
+
+from flask import current_app
+from sqlalchemy import select
+
+from models import User
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_COLUMNS = ("id", "username", "email", "registration_date", "last_active_date")
+
+
+def filter_users(statement, registered_from=None, registered_to=None, domain=None):
+    """
+    Добавляет к запросу пользователей фильтры выгрузки.
+
+    Аргументы:
+        statement (Select): Запрос по таблице пользователей.
+        registered_from (datetime): Начало периода регистрации (включительно).
+        registered_to (datetime): Конец периода регистрации (не включительно).
+        domain (str): Нормализованный домен почты.
+    """
+    if registered_from is not None:
+        statement = statement.where(User.registration_date >= registered_from)
+    if registered_to is not None:
+        statement = statement.where(User.registration_date < registered_to)
+    if domain is not None:
+        statement = statement.where(User.email_domain == domain)
+    return statement
+
+
+def export_statement(registered_from=None, registered_to=None, domain=None):
+    """Строит запрос выгрузки с фильтрами (см. filter_users)."""
+    statement = select(*(getattr(User, column) for column in EXPORT_COLUMNS)).order_by(User.id)
+    statement = filter_users(statement, registered_from, registered_to, domain)
+    return statement.execution_options(yield_per=current_app.config["EXPORT_BATCH_SIZE"])
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def generate_ndjson(result):
+    """Отдаёт строки результата в формате NDJSON, по одной пачке за раз."""
+    for rows in result.partitions():
+        yield "".join(json.dumps({"id": row.id,
+                                  "username": row.username,
+                                  "email": row.email,
+                                  "registration_date": _isoformat(row.registration_date),
+                                  "last_active_date": _isoformat(row.last_active_date)},
+                                 ensure_ascii=False) + "\n" for row in rows)
+
+
+def generate_csv(result):
+    """Отдаёт строки результата в формате CSV с заголовком, по одной пачке за раз."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+
+    for rows in result.partitions():
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows((row.id, row.username, row.email,
+                          _isoformat(row.registration_date), _isoformat(row.last_active_date)) for row in rows)
+        yield buffer.getvalue()
+
+
+def init_app(app):
+    """Задаёт настройки выгрузки по умолчанию."""
+    app.config.setdefault("EXPORT_BATCH_SIZE", 1000)
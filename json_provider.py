@@ -0,0 +1,99 @@
+"""
+Быстрая сериализация JSON-ответов.
+
+FastJSONProvider заменяет стандартный провайдер JSON Flask (app.json), поэтому jsonify, возврат словаря
+из эндпоинта и app.json.dumps (асинхронный режим, см. asgi.py) кодируют через orjson, если он установлен,
+и через стандартный модуль json, если нет. Ответ собирается сразу из байтов orjson, без промежуточной строки.
+
+Даты и время форматирует сам кодировщик в ISO 8601 ("2025-01-31T12:00:00.123456"), как в выгрузке
+(см. export.py) и как их принимает PUT /users/<id>. Прежний формат Flask (RFC 822,
+"Fri, 31 Jan 2025 12:00:00 GMT") включается настройкой JSON_DATETIME_FORMAT = "http"; он медленнее,
+потому что каждая дата форматируется в Python.
+
+Ключи словарей, как и у стандартного провайдера, сортируются (app.json.sort_keys), а в режиме отладки
+или при app.json.compact = False ответ выводится с отступами.
+"""
+import dataclasses
+import decimal
+import uuid
+from datetime import date
+
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DATETIME_FORMATS = ("iso", "http")
+
+
+def _default(o):
+    """Кодирует типы, которые не поддерживает кодировщик, так же, как стандартный провайдер Flask."""
+    if isinstance(o, date):
+        return o.isoformat()
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o):
+        return dataclasses.asdict(o)
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def _default_http_date(o):
+    if isinstance(o, date):
+        return http_date(o)
+    return _default(o)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Провайдер JSON на orjson с запасным вариантом на стандартном модуле json."""
+
+    def _http_dates(self):
+        return self._app.config["JSON_DATETIME_FORMAT"] == "http"
+
+    def _orjson_option(self, indent=False):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if self._http_dates():
+            # Без этого флага orjson сам кодирует даты в ISO 8601 и не вызывает default
+            option |= orjson.OPT_PASSTHROUGH_DATETIME
+        return option
+
+    def _orjson_dumps(self, obj, indent=False):
+        default = _default_http_date if self._http_dates() else _default
+        return orjson.dumps(obj, default=default, option=self._orjson_option(indent))
+
+    def dumps(self, obj, **kwargs):
+        """Кодирует obj в строку JSON. Дополнительные аргументы json.dumps переводят на стандартный модуль."""
+        if orjson is None or kwargs:
+            kwargs.setdefault("default", _default_http_date if self._http_dates() else _default)
+            return super().dumps(obj, **kwargs)
+        return self._orjson_dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Собирает ответ application/json, как jsonify, но без промежуточной строки."""
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self._orjson_dumps(obj, indent) + b"\n", mimetype=self.mimetype)
+
+
+def init_app(app):
+    """Задаёт формат дат по умолчанию и подключает FastJSONProvider к приложению."""
+    app.config.setdefault("JSON_DATETIME_FORMAT", "iso")
+    if app.config["JSON_DATETIME_FORMAT"] not in DATETIME_FORMATS:
+        raise ValueError(f"JSON_DATETIME_FORMAT must be one of {DATETIME_FORMATS}")
+    if not isinstance(app.json, FastJSONProvider):
+        app.json = FastJSONProvider(app)
@@ -0,0 +1,224 @@
+"""
+Метрики производительности запросов и журнал медленных SQL-запросов.
+
+Для каждого запроса к приложению Flask считаются:
+    - длительность обработки (по маршруту, методу и коду ответа);
+    - количество SQL-запросов и время, потраченное на них (события движков SQLAlchemy);
+    - количество загруженных ORM-объектов User. Выборки колонок (repository.py) сюда не попадают, поэтому
+      на горячих путях значение близко к нулю, а рост показывает, что эндпоинт снова загружает
+      объекты целиком (например, User.query.all());
+    - размер ответа (для потоковых ответов не известен и не учитывается).
+
+Метрики отдаются в текстовом формате Prometheus на GET /metrics (см. app.py) и хранятся в памяти процесса,
+так что у каждого воркера gunicorn они свои. При METRICS_SERVER_TIMING = True те же значения для запроса
+добавляются в заголовок Server-Timing.
+
+SQL-запросы дольше METRICS_SLOW_QUERY_MS миллисекунд пишутся в журнал (logging.warning) с текстом запроса
+и маршрутом, в том числе запросы вне обработки HTTP-запроса (фоновый сброс буфера, команды flask).
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import User
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000, 10000)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class Counter:
+    """
+    Счётчик с метками.
+
+    Аргументы:
+        name (str): Имя метрики.
+        description (str): Описание для строки HELP.
+        label_names (tuple[str]): Имена меток.
+    """
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Гистограмма с метками и фиксированными границами корзин.
+
+    Аргументы:
+        name (str): Имя метрики.
+        description (str): Описание для строки HELP.
+        label_names (tuple[str]): Имена меток.
+        buckets (tuple[float]): Верхние границы корзин по возрастанию (+Inf добавляется сама).
+    """
+
+    def __init__(self, name, description, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        # Для каждого набора меток: количества по корзинам (без накопления), сумма и общее количество
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            counts, total = self._values.setdefault(labels, ([0] * (len(self.buckets) + 1), [0, 0]))
+            counts[bisect_left(self.buckets, value)] += 1
+            total[0] += value
+            total[1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, (value_sum, count)) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    bucket_labels = _format_labels(self.label_names + ("le",), labels + (bound,))
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {value_sum}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class Metrics:
+    """Набор метрик приложения."""
+
+    def __init__(self):
+        self.request_duration = Histogram("http_request_duration_seconds", "Request handling time.",
+                                          ("method", "route", "status"))
+        self.sql_queries = Histogram("http_request_sql_queries", "SQL statements executed per request.",
+                                     ("route",), COUNT_BUCKETS)
+        self.sql_duration = Histogram("http_request_sql_duration_seconds", "Time spent in SQL per request.",
+                                      ("route",))
+        self.rows_hydrated = Histogram("http_request_rows_hydrated",
+                                       "ORM User objects loaded per request (column selects are not counted).",
+                                       ("route",), COUNT_BUCKETS)
+        self.response_size = Histogram("http_response_size_bytes", "Response body size.", ("route",), SIZE_BUCKETS)
+        self.slow_queries = Counter("sql_slow_queries_total", "SQL statements slower than METRICS_SLOW_QUERY_MS.",
+                                    ("route",))
+
+    def render(self):
+        """Возвращает все метрики в текстовом формате Prometheus."""
+        lines = []
+        for metric in (self.request_duration, self.sql_queries, self.sql_duration, self.rows_hydrated,
+                       self.response_size, self.slow_queries):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else "unmatched"
+
+
+def _before_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_sql_queries = 0
+    g.metrics_sql_time = 0.0
+    g.metrics_rows = 0
+
+
+def _after_request_factory(app, metrics):
+    def after_request(response):
+        started = g.get("metrics_started")
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = _route()
+        metrics.request_duration.observe((request.method, route, str(response.status_code)), elapsed)
+        metrics.sql_queries.observe((route,), g.metrics_sql_queries)
+        metrics.sql_duration.observe((route,), g.metrics_sql_time)
+        metrics.rows_hydrated.observe((route,), g.metrics_rows)
+        if not response.is_streamed:
+            metrics.response_size.observe((route,), response.calculate_content_length() or 0)
+
+        if app.config["METRICS_SERVER_TIMING"]:
+            # Для потоковых ответов здесь учтено только время до начала отдачи тела
+            response.headers.add("Server-Timing", f"app;dur={elapsed * 1000:.2f}, "
+                                                  f"sql;dur={g.metrics_sql_time * 1000:.2f};"
+                                                  f"desc=\"{g.metrics_sql_queries} queries\"")
+        return response
+
+    return after_request
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["metrics_query_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Слушатель один на процесс: запрос учитывается в метриках приложения, в контексте которого он выполнен
+    started = conn.info.pop("metrics_query_started", None)
+    if started is None or not has_app_context():
+        return
+    metrics = current_app.extensions.get("metrics")
+    if metrics is None:
+        return
+    elapsed = time.perf_counter() - started
+    in_request = has_request_context() and "metrics_started" in g
+    if in_request:
+        g.metrics_sql_queries += 1
+        g.metrics_sql_time += elapsed
+    if elapsed * 1000 >= current_app.config["METRICS_SLOW_QUERY_MS"]:
+        route = _route() if in_request else "background"
+        metrics.slow_queries.inc((route,))
+        logging.warning(f"Slow query ({elapsed * 1000:.1f} ms, {route}): {statement}")
+
+
+def _count_loaded_user(target, context):
+    if has_request_context() and "metrics_started" in g:
+        g.metrics_rows += 1
+
+
+def get_metrics(app):
+    """Возвращает метрики приложения."""
+    return app.extensions["metrics"]
+
+
+def init_app(app):
+    """Задаёт настройки метрик по умолчанию и подключает сбор метрик к запросам и движкам SQLAlchemy."""
+    app.config.setdefault("METRICS_ENABLED", True)
+    app.config.setdefault("METRICS_SERVER_TIMING", False)
+    app.config.setdefault("METRICS_SLOW_QUERY_MS", 100)
+    if not app.config["METRICS_ENABLED"]:
+        return
+
+    metrics = app.extensions["metrics"] = Metrics()
+    app.before_request(_before_request)
+    app.after_request(_after_request_factory(app, metrics))
+    # Слушаем класс Engine, чтобы учитывать все движки: основной, только для чтения, асинхронный и шарды.
+    # Слушатели регистрируются один раз на процесс, иначе каждое созданное приложение считало бы запрос заново
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    if not event.contains(User, "load", _count_loaded_user):
+        event.listen(User, "load", _count_loaded_user)
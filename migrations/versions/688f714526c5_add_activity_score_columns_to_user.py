@@ -0,0 +1,35 @@
+"""Add activity score columns to User model
+
+Revision ID: 688f714526c5
+Revises: ddee48732afa
+Create Date: 2026-10-17 15:12:40.318502
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '688f714526c5'
+down_revision = 'ddee48732afa'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Столбцы остаются пустыми: оценки существующих пользователей заполняет `flask scores refresh`
+    # (пустая оценка считается просроченной, а до пересчёта вероятность считается при чтении)
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('activity_probability', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('activity_score_expires_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_user_activity_probability'), ['activity_probability'], unique=False)
+        batch_op.create_index(batch_op.f('ix_user_activity_score_expires_at'), ['activity_score_expires_at'],
+                              unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_activity_score_expires_at'))
+        batch_op.drop_index(batch_op.f('ix_user_activity_probability'))
+        batch_op.drop_column('activity_score_expires_at')
+        batch_op.drop_column('activity_probability')
@@ -0,0 +1,51 @@
+"""Add email_domain column to User model
+
+Revision ID: 79d925b6fb02
+Revises: af93c30404ca
+Create Date: 2026-10-17 11:40:07.218934
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '79d925b6fb02'
+down_revision = 'af93c30404ca'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 10000
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('email_domain', sa.String(length=120), nullable=True))
+
+    # Домен выделяется так же, как в normalize_email_domain из models.py: часть после последнего '@'
+    # в нижнем регистре. Обновляем пачками, чтобы не держать всю таблицу в памяти
+    connection = op.get_bind()
+    user = sa.table('user', sa.column('id', sa.Integer), sa.column('email', sa.String),
+                    sa.column('email_domain', sa.String))
+    update = user.update().where(user.c.id == sa.bindparam('user_id')).values(email_domain=sa.bindparam('domain'))
+    last_id = 0
+    while True:
+        rows = connection.execute(sa.select(user.c.id, user.c.email)
+                                  .where(user.c.id > last_id)
+                                  .order_by(user.c.id)
+                                  .limit(BACKFILL_BATCH_SIZE)).all()
+        if not rows:
+            break
+        connection.execute(update, [{"user_id": row.id,
+                                     "domain": row.email.rsplit("@", 1)[1].strip().lower() if "@" in row.email else None}
+                                    for row in rows])
+        last_id = rows[-1].id
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_email_domain'), ['email_domain'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_email_domain'))
+        batch_op.drop_column('email_domain')
@@ -0,0 +1,33 @@
+"""Add username_length column to User model
+
+Revision ID: af93c30404ca
+Revises: 9de151f9b8e6
+Create Date: 2026-10-17 10:12:41.503118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'af93c30404ca'
+down_revision = '9de151f9b8e6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('username_length', sa.Integer(), nullable=False, server_default='0'))
+
+    # Заполняем длину для уже существующих пользователей
+    op.execute('UPDATE "user" SET username_length = length(username)')
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index('ix_user_username_length', [sa.text('username_length DESC')], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_username_length')
+        batch_op.drop_column('username_length')
@@ -0,0 +1,27 @@
+"""Add index on last_active_date to User model
+
+Revision ID: b3f1c2d4e5a6
+Revises: 688f714526c5
+Create Date: 2026-10-17 18:02:11.604219
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f1c2d4e5a6'
+down_revision = '688f714526c5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Индекс на registration_date уже создан миграцией ddee48732afa
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_last_active_date'), ['last_active_date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_last_active_date'))
@@ -0,0 +1,54 @@
+"""Add full-text search index on user username and email
+
+Revision ID: c7d2e9a1f3b8
+Revises: b3f1c2d4e5a6
+Create Date: 2026-10-17 21:14:37.302518
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d2e9a1f3b8'
+down_revision = 'b3f1c2d4e5a6'
+branch_labels = None
+depends_on = None
+
+# Должно совпадать с search.CREATE_STATEMENTS и search.DROP_STATEMENTS.
+# batch_alter_table пересоздаёт таблицу user вместе с её триггерами, поэтому после миграций,
+# меняющих её в пакетном режиме, триггеры нужно создать заново
+CREATE_STATEMENTS = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS user_search
+       USING fts5(username, email, content='user', content_rowid='id', prefix='2 3 4')""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_insert AFTER INSERT ON "user" BEGIN
+           INSERT INTO user_search(rowid, username, email) VALUES (new.id, new.username, new.email);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_delete AFTER DELETE ON "user" BEGIN
+           INSERT INTO user_search(user_search, rowid, username, email)
+           VALUES ('delete', old.id, old.username, old.email);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_update AFTER UPDATE OF username, email ON "user" BEGIN
+           INSERT INTO user_search(user_search, rowid, username, email)
+           VALUES ('delete', old.id, old.username, old.email);
+           INSERT INTO user_search(rowid, username, email) VALUES (new.id, new.username, new.email);
+       END""",
+)
+
+DROP_STATEMENTS = (
+    "DROP TRIGGER IF EXISTS user_search_update",
+    "DROP TRIGGER IF EXISTS user_search_delete",
+    "DROP TRIGGER IF EXISTS user_search_insert",
+    "DROP TABLE IF EXISTS user_search",
+)
+
+
+def upgrade():
+    for statement in CREATE_STATEMENTS:
+        op.execute(statement)
+    # Индекс заполняется по уже существующим пользователям
+    op.execute("INSERT INTO user_search(user_search) VALUES ('rebuild')")
+
+
+def downgrade():
+    for statement in DROP_STATEMENTS:
+        op.execute(statement)
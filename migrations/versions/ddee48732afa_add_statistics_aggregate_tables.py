@@ -0,0 +1,70 @@
+"""Add statistics aggregate tables
+
+Revision ID: ddee48732afa
+Revises: 79d925b6fb02
+Create Date: 2026-10-17 13:05:52.774120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ddee48732afa'
+down_revision = '79d925b6fb02'
+branch_labels = None
+depends_on = None
+
+# Должно совпадать с aggregates.TOP_K_CAPACITY
+TOP_K_CAPACITY = 20
+
+
+def upgrade():
+    # Таблицы агрегатов создаёт и `flask init-db` (db.create_all()), поэтому если её запускали на старой базе,
+    # пустые таблицы к моменту миграции уже могут существовать - в этом случае создаём только недостающее
+    existing_tables = sa.inspect(op.get_bind()).get_table_names()
+
+    if 'registration_day_stat' not in existing_tables:
+        op.create_table('registration_day_stat',
+                        sa.Column('day', sa.Date(), nullable=False),
+                        sa.Column('users', sa.Integer(), nullable=False),
+                        sa.PrimaryKeyConstraint('day'))
+    if 'email_domain_stat' not in existing_tables:
+        op.create_table('email_domain_stat',
+                        sa.Column('domain', sa.String(length=120), nullable=False),
+                        sa.Column('users', sa.Integer(), nullable=False),
+                        sa.PrimaryKeyConstraint('domain'))
+    if 'longest_name_top' not in existing_tables:
+        op.create_table('longest_name_top',
+                        sa.Column('user_id', sa.Integer(), nullable=False),
+                        sa.Column('username_length', sa.Integer(), nullable=False),
+                        sa.PrimaryKeyConstraint('user_id'))
+        with op.batch_alter_table('longest_name_top', schema=None) as batch_op:
+            batch_op.create_index('ix_longest_name_top_username_length', [sa.text('username_length DESC')],
+                                  unique=False)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_registration_date'), ['registration_date'], unique=False)
+
+    # Заполняем агрегаты по уже существующим пользователям
+    for table in ('registration_day_stat', 'email_domain_stat', 'longest_name_top'):
+        op.execute(f'DELETE FROM {table}')
+    op.execute('INSERT INTO registration_day_stat (day, users) '
+               'SELECT date(registration_date), count(*) FROM "user" GROUP BY date(registration_date)')
+    op.execute('INSERT INTO email_domain_stat (domain, users) '
+               'SELECT coalesce(email_domain, \'\'), count(*) FROM "user" GROUP BY coalesce(email_domain, \'\')')
+    op.execute('INSERT INTO longest_name_top (user_id, username_length) '
+               'SELECT id, username_length FROM "user" ORDER BY username_length DESC, id '
+               f'LIMIT {TOP_K_CAPACITY}')
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_registration_date'))
+
+    with op.batch_alter_table('longest_name_top', schema=None) as batch_op:
+        batch_op.drop_index('ix_longest_name_top_username_length')
+
+    op.drop_table('longest_name_top')
+    op.drop_table('email_domain_stat')
+    op.drop_table('registration_day_stat')
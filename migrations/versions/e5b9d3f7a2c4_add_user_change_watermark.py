@@ -0,0 +1,55 @@
+"""Add user change watermark table for the analytics snapshot
+
+Revision ID: e5b9d3f7a2c4
+Revises: c7d2e9a1f3b8
+Create Date: 2026-10-17 23:02:11.418305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b9d3f7a2c4'
+down_revision = 'c7d2e9a1f3b8'
+branch_labels = None
+depends_on = None
+
+# Должно совпадать с snapshot.CREATE_STATEMENTS.
+# batch_alter_table пересоздаёт таблицу user вместе с её триггерами, поэтому после миграций,
+# меняющих её в пакетном режиме, триггеры нужно создать заново
+LOG_CHANGE = ("INSERT OR REPLACE INTO user_change (user_id, seq) "
+              "VALUES ({user}.id, (SELECT coalesce(max(seq), 0) + 1 FROM user_change));")
+
+CREATE_STATEMENTS = (
+    f"""CREATE TRIGGER IF NOT EXISTS user_change_insert AFTER INSERT ON "user" BEGIN
+            {LOG_CHANGE.format(user="new")}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS user_change_delete AFTER DELETE ON "user" BEGIN
+            {LOG_CHANGE.format(user="old")}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS user_change_update
+        AFTER UPDATE OF username, email, registration_date, last_active_date ON "user" BEGIN
+            {LOG_CHANGE.format(user="new")}
+        END""",
+)
+
+
+def upgrade():
+    # Снимок при первой сборке читает всех пользователей, поэтому заполнять таблицу не нужно
+    op.create_table('user_change',
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('seq', sa.Integer(), nullable=False),
+                    sa.PrimaryKeyConstraint('user_id'))
+    with op.batch_alter_table('user_change', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_change_seq'), ['seq'], unique=False)
+    for statement in CREATE_STATEMENTS:
+        op.execute(statement)
+
+
+def downgrade():
+    for trigger in ('user_change_update', 'user_change_delete', 'user_change_insert'):
+        op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    with op.batch_alter_table('user_change', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_change_seq'))
+    op.drop_table('user_change')
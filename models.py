@@ -0,0 +1,113 @@
+"""
+Модели базы данных.
+
+Объект db создаётся здесь без привязки к приложению и подключается к нему в app.py через db.init_app(app),
+чтобы модели можно было импортировать из других модулей без циклических импортов.
+"""
+from contextvars import ContextVar
+from datetime import datetime
+
+from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy.orm import validates
+
+# Движок шарда, с которым работает сессия в текущем потоке (см. sharding.py); None - основная база
+current_shard_engine = ContextVar("current_shard_engine", default=None)
+
+
+class ShardRoutingSession(Session):
+    """Сессия, которая при выбранном шарде выполняет запросы и запись на его движке, а не на основной базе."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            engine = current_shard_engine.get()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+# Сессия живёт один запрос (контекст приложения), поэтому объекты после commit не помечаются устаревшими:
+# ответ, собранный из объекта после commit, не перечитывает его из базы (см. repository.py)
+db = SQLAlchemy(session_options={"expire_on_commit": False, "class_": ShardRoutingSession})
+
+
+def normalize_email_domain(email):
+    """
+    Выделяет из адреса электронной почты домен в нормализованном виде (в нижнем регистре).
+
+    Возвращает:
+        str: Домен или None, если в адресе нет символа '@'.
+    """
+    if not email or "@" not in email:
+        return None
+    return email.rsplit("@", 1)[1].strip().lower()
+
+
+class User(db.Model):
+    """
+    Модель пользователя
+
+    Представляет собой пользователя с уникальным именем пользователя, электронной почтой,
+    а также хранит дату регистрации
+
+    Атрибуты:
+        id (int): Уникальный идентификатор пользователя.
+        username (str): Имя пользователя, которое должно быть уникальным и обязательным.
+        email (str): Электронная почта пользователя, которая также должна быть уникальной и обязательной.
+        registration_date (datetime): Дата и время регистрации пользователя, по умолчанию устанавливается текущее время.
+        username_length (int): Длина имени пользователя. Хранится отдельно и индексируется, чтобы топ
+                               самых длинных имен считался в SQL через ORDER BY ... LIMIT, а не в Python.
+        email_domain (str): Домен электронной почты в нижнем регистре. Индексируется для подсчёта долей доменов.
+        activity_probability (int): Сохранённая вероятность активности (см. scoring.py). Индексируется для выборки
+                                    пользователей по значению вероятности.
+        activity_score_expires_at (datetime): Момент, когда сохранённая вероятность перестанет быть верной
+                                              (ближайший порог модели), None - не изменится сама по себе.
+
+    Методы:
+        json(): Возвращает словарь с данными пользователя для сериализации в формат JSON.
+    """
+    __tablename__ = 'user'
+
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    # Индекс нужен для подсчёта регистраций за период (см. aggregates.count_registered_since)
+    registration_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    # Добавил для модели предсказания активности значение ниже
+    # Индекс нужен для выборок и подсчётов по периоду последней активности
+    last_active_date = db.Column(db.DateTime, nullable=True, index=True)
+    # Заполняется автоматически при установке username (см. _sync_username_length)
+    username_length = db.Column(db.Integer, nullable=False, default=0)
+    # Заполняется автоматически при установке email (см. _sync_email_domain)
+    email_domain = db.Column(db.String(120), nullable=True, index=True)
+    # Пересчитываются при изменении дат (см. scoring._score_changed_users) и командой `flask scores refresh`
+    activity_probability = db.Column(db.Integer, nullable=True, index=True)
+    activity_score_expires_at = db.Column(db.DateTime, nullable=True, index=True)
+
+    __table_args__ = (
+        # Индекс по убыванию длины: вместе с неявным rowid даёт порядок (username_length DESC, id ASC),
+        # поэтому выборка топа - это чтение первых k записей индекса без сортировки
+        db.Index('ix_user_username_length', db.desc('username_length')),
+    )
+
+    @validates('username')
+    def _sync_username_length(self, key, username):
+        self.username_length = len(username) if username is not None else 0
+        return username
+
+    @validates('email')
+    def _sync_email_domain(self, key, email):
+        self.email_domain = normalize_email_domain(email)
+        return email
+
+    def json(self):
+        return {"id": self.id,
+                "username": self.username,
+                "email": self.email,
+                "registration_date": self.registration_date,
+                "last_active_date": self.last_active_date}
+
+
+# Колонки User.json(): списки только для чтения выбирают их кортежами, без создания ORM-объектов,
+# а строки превращают в словари того же вида через row._asdict()
+USER_JSON_COLUMNS = (User.id, User.username, User.email, User.registration_date, User.last_active_date)
@@ -0,0 +1,95 @@
+"""
+Курсорная (keyset) пагинация списка пользователей.
+
+В отличие от OFFSET, следующая страница выбирается условием "после последней записи предыдущей страницы"
+по индексу, поэтому глубокие страницы отдаются так же быстро, как первая, и не нужен COUNT(*).
+
+Курсор непрозрачен для клиента: это base64 от JSON с порядком сортировки и ключом последней записи.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from sqlalchemy import literal, tuple_
+
+from models import User
+
+# Поддерживаемые порядки сортировки. Для registration_date id добавлен, чтобы порядок был однозначным
+KEYSET_ORDERS = ("id", "registration_date")
+
+
+class InvalidCursor(ValueError):
+    """Курсор не удалось разобрать или он не соответствует запрошенному порядку."""
+
+
+def encode_cursor(order, user):
+    """
+    Кодирует курсор, указывающий на позицию сразу после пользователя `user`.
+
+    Аргументы:
+        order (str): Порядок сортировки, один из KEYSET_ORDERS.
+        user: Объект с атрибутами id и registration_date.
+
+    Возвращает:
+        str: Непрозрачная строка курсора.
+    """
+    if order == "id":
+        key = [user.id]
+    else:
+        key = [user.registration_date.isoformat(), user.id]
+    payload = json.dumps({"o": order, "k": key}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor, order):
+    """
+    Разбирает курсор, полученный от клиента.
+
+    Возвращает:
+        list: Ключ последней записи предыдущей страницы.
+
+    Исключения:
+        InvalidCursor: Если курсор повреждён или создан для другого порядка сортировки.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        issued_order, key = payload["o"], payload["k"]
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor("malformed cursor") from e
+
+    if issued_order != order:
+        raise InvalidCursor(f"cursor was issued for order_by={issued_order}")
+
+    try:
+        if order == "id":
+            return [int(key[0])]
+        return [datetime.fromisoformat(key[0]), int(key[1])]
+    except (IndexError, TypeError, ValueError) as e:
+        raise InvalidCursor("malformed cursor") from e
+
+
+def keyset_filter(query, order, cursor=None):
+    """
+    Добавляет к запросу порядок сортировки и условие "после позиции курсора".
+
+    Подходит и для Query, и для select(User), поэтому используется также асинхронным режимом (см. asgi.py).
+    """
+    if order == "id":
+        query = query.order_by(User.id)
+        if cursor:
+            query = query.filter(User.id > decode_cursor(cursor, order)[0])
+    else:
+        query = query.order_by(User.registration_date, User.id)
+        if cursor:
+            registration_date, user_id = decode_cursor(cursor, order)
+            # Сравнение кортежей (registration_date, id) > (...) SQLite выполняет по индексу на registration_date
+            query = query.filter(tuple_(User.registration_date, User.id) >
+                                 tuple_(literal(registration_date, User.registration_date.type), literal(user_id)))
+    return query
+
+
+def split_page(users, order, per_page):
+    """Отрезает от выборки из per_page + 1 записей лишнюю и строит по ней курсор следующей страницы."""
+    next_cursor = encode_cursor(order, users[per_page - 1]) if len(users) > per_page else None
+    return users[:per_page], next_cursor
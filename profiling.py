@@ -0,0 +1,217 @@
+"""
+Профилирование отдельных запросов по запросу клиента.
+
+Включается настройкой PROFILING_ENABLED (или переменной окружения PROFILING_ENABLED=1) до запуска приложения:
+тогда init_app оборачивает app.wsgi_app промежуточным слоем. Если профилирование выключено, обёртки нет
+и на обработку запросов оно никак не влияет.
+
+Запрос профилируется, если у него есть заголовок `X-Profile` или параметр `_profile` со значением:
+    - "1": профиль сохраняется в PROFILING_DIR, его id возвращается в заголовке X-Profile-Id;
+    - "inline": вместо ответа эндпоинта возвращается JSON с профилем (код ответа эндпоинта - в `status`).
+Если задан PROFILING_TOKEN, заголовок `X-Profile-Token` должен с ним совпадать, иначе запрос
+обрабатывается как обычно.
+
+Для запроса собираются:
+    - статистика cProfile (файл <id>.prof для pstats/snakeviz и текстовая сводка);
+    - стеки, снятые сэмплированием раз в PROFILING_SAMPLE_INTERVAL секунд, в формате collapsed stacks
+      (файл <id>.folded для flamegraph.pl или speedscope);
+    - SQL-запросы этого запроса с длительностью (файл <id>.sql.json).
+
+Профилируемые запросы идут мимо кэша ответов (см. cache.cached_response), чтобы профиль показывал работу
+эндпоинта, а не чтение из кэша.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from urllib.parse import parse_qs
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Ключ в WSGI environ, по которому код приложения узнаёт, что запрос профилируется
+ENVIRON_KEY = "app.profiling"
+
+
+class StackSampler:
+    """
+    Сэмплирующий профилировщик одного потока: периодически снимает его стек и считает одинаковые стеки.
+
+    Аргументы:
+        thread_id (int): Идентификатор профилируемого потока.
+        interval (float): Интервал между снимками в секундах.
+    """
+
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """Возвращает стеки в формате collapsed stacks: `корень;...;функция количество` по строке на стек."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class SQLRecorder:
+    """Записывает SQL-запросы, выполненные в заданном потоке, пока подключён к событиям движков."""
+
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self.statements = []
+        self._started = {}
+        # event.remove находит обработчик по объекту функции, поэтому связанные методы сохраняем один раз
+        self._listeners = (("before_cursor_execute", self._before), ("after_cursor_execute", self._after))
+
+    def __enter__(self):
+        for name, listener in self._listeners:
+            event.listen(Engine, name, listener)
+        return self
+
+    def __exit__(self, *exc_info):
+        for name, listener in self._listeners:
+            event.remove(Engine, name, listener)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self.thread_id:
+            self._started[id(cursor)] = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        started = self._started.pop(id(cursor), None)
+        if started is not None:
+            self.statements.append({"statement": statement,
+                                    "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                                    "executemany": executemany})
+
+
+class ProfilingMiddleware:
+    """
+    WSGI-обёртка, профилирующая запросы с заголовком X-Profile или параметром _profile.
+
+    Аргументы:
+        app (Flask): Приложение, из которого берутся настройки.
+        wsgi_app: Исходное WSGI-приложение.
+    """
+
+    def __init__(self, app, wsgi_app):
+        self.app = app
+        self.wsgi_app = wsgi_app
+
+    def _mode(self, environ):
+        mode = environ.get("HTTP_X_PROFILE")
+        if mode is None:
+            mode = parse_qs(environ.get("QUERY_STRING", "")).get("_profile", [None])[-1]
+        if mode not in ("1", "inline"):
+            return None
+        token = self.app.config["PROFILING_TOKEN"]
+        if token and environ.get("HTTP_X_PROFILE_TOKEN") != token:
+            return None
+        return mode
+
+    def __call__(self, environ, start_response):
+        mode = self._mode(environ)
+        if mode is None:
+            return self.wsgi_app(environ, start_response)
+
+        environ[ENVIRON_KEY] = True
+        captured = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            captured["status"], captured["headers"] = status, headers
+            return lambda data: captured.setdefault("written", []).append(data)
+
+        thread_id = threading.get_ident()
+        profiler = cProfile.Profile()
+        sampler = StackSampler(thread_id, self.app.config["PROFILING_SAMPLE_INTERVAL"])
+        started = time.perf_counter()
+        with SQLRecorder(thread_id) as recorder:
+            sampler.start()
+            profiler.enable()
+            try:
+                # Тело ответа читается целиком внутри профиля, чтобы учесть и потоковые ответы
+                result = self.wsgi_app(environ, capture_start_response)
+                try:
+                    body = captured.get("written", []) + list(result)
+                finally:
+                    if hasattr(result, "close"):
+                        result.close()
+            finally:
+                profiler.disable()
+                sampler.stop()
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        report = self._save(profile_id, environ, profiler, sampler, recorder, elapsed_ms, captured["status"])
+
+        if mode == "inline":
+            body = [json.dumps(report, ensure_ascii=False).encode()]
+            start_response("200 OK", [("Content-Type", "application/json"),
+                                      ("Content-Length", str(len(body[0]))),
+                                      ("X-Profile-Id", profile_id)])
+            return body
+        headers = [(name, value) for name, value in captured["headers"] if name.lower() != "content-length"]
+        start_response(captured["status"], headers + [("Content-Length", str(sum(map(len, body)))),
+                                                      ("X-Profile-Id", profile_id)])
+        return body
+
+    def _save(self, profile_id, environ, profiler, sampler, recorder, elapsed_ms, status):
+        """Сохраняет профиль в PROFILING_DIR и возвращает его сводку."""
+        directory = self.app.config["PROFILING_DIR"] or os.path.join(self.app.instance_path, "profiles")
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, profile_id)
+
+        profiler.dump_stats(f"{base}.prof")
+        folded = sampler.collapsed()
+        with open(f"{base}.folded", "w") as folded_file:
+            folded_file.write(folded)
+        with open(f"{base}.sql.json", "w") as sql_file:
+            json.dump(recorder.statements, sql_file, ensure_ascii=False, indent=2)
+
+        stats_text = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stats_text)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.app.config["PROFILING_TOP_FUNCTIONS"])
+        return {"profile_id": profile_id,
+                "method": environ.get("REQUEST_METHOD"),
+                "path": environ.get("PATH_INFO"),
+                "status": int(status.split(" ", 1)[0]),
+                "elapsed_ms": elapsed_ms,
+                "files": {"pstats": f"{base}.prof", "folded": f"{base}.folded", "sql": f"{base}.sql.json"},
+                "stats": stats_text.getvalue(),
+                "folded": folded,
+                "sql": recorder.statements}
+
+
+def init_app(app):
+    """Задаёт настройки профилирования и, если оно включено, оборачивает app.wsgi_app."""
+    app.config.setdefault("PROFILING_ENABLED", os.environ.get("PROFILING_ENABLED") == "1")
+    app.config.setdefault("PROFILING_TOKEN", os.environ.get("PROFILING_TOKEN"))
+    app.config.setdefault("PROFILING_DIR", None)
+    app.config.setdefault("PROFILING_SAMPLE_INTERVAL", 0.001)
+    app.config.setdefault("PROFILING_TOP_FUNCTIONS", 30)
+    if app.config["PROFILING_ENABLED"] and not isinstance(app.wsgi_app, ProfilingMiddleware):
+        app.wsgi_app = ProfilingMiddleware(app, app.wsgi_app)
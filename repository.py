@@ -0,0 +1,170 @@
+"""
+Готовые запросы к пользователям для эндпоинтов app.py.
+
+Запросы собираются один раз при импорте модуля из select() с именованными параметрами (bindparam),
+а не строятся заново в каждом обработчике через User.query. Сборка запроса и вычисление его ключа
+в кэше компиляции SQLAlchemy не повторяются на каждый вызов, а скомпилированный SQL берётся из кэша,
+так что на запрос тратится только подстановка параметров. У списков только для чтения запросы выбирают
+колонки ответа (models.USER_JSON_COLUMNS), без создания ORM-объектов и без их учёта в identity map сессии.
+
+Объекты User загружаются только там, где их изменяют (PUT, DELETE). Flask-SQLAlchemy создаёт отдельную
+сессию на запрос и закрывает её после ответа, поэтому сессии создаются с expire_on_commit=False
+(см. models.py): ответ, собранный из объекта после commit, не перечитывает его из базы.
+"""
+from sqlalchemy import bindparam, column, func, or_, select, table, tuple_
+
+from models import db, User, USER_JSON_COLUMNS
+
+_USER_BY_ID = select(User).where(User.id == bindparam("user_id"))
+
+_LONGEST_NAMES = (select(*USER_JSON_COLUMNS)
+                  .order_by(User.username_length.desc(), User.id)
+                  .limit(bindparam("k")))
+
+_USERS_PAGE = (select(*USER_JSON_COLUMNS)
+               .limit(bindparam("limit"))
+               .offset(bindparam("offset")))
+
+# Курсорная пагинация: по порядку сортировки запросы первой страницы и страницы после курсора
+# (условия те же, что в pagination.keyset_filter)
+_KEYSET_PAGES = {
+    "id": (select(*USER_JSON_COLUMNS)
+           .order_by(User.id)
+           .limit(bindparam("limit")),
+           select(*USER_JSON_COLUMNS)
+           .where(User.id > bindparam("after_id"))
+           .order_by(User.id)
+           .limit(bindparam("limit"))),
+    "registration_date": (select(*USER_JSON_COLUMNS)
+                          .order_by(User.registration_date, User.id)
+                          .limit(bindparam("limit")),
+                          select(*USER_JSON_COLUMNS)
+                          .where(tuple_(User.registration_date, User.id) >
+                                 tuple_(bindparam("after_date", type_=User.registration_date.type),
+                                        bindparam("after_id")))
+                          .order_by(User.registration_date, User.id)
+                          .limit(bindparam("limit"))),
+}
+
+_BY_PROBABILITY = (select(*USER_JSON_COLUMNS)
+                   .where(User.activity_probability == bindparam("probability"),
+                          User.id > bindparam("after_id"))
+                   .order_by(User.id)
+                   .limit(bindparam("limit")))
+
+_users_count = func.count(User.id)
+_EMAIL_DOMAINS = (select(User.email_domain,
+                         _users_count.label("users"),
+                         func.sum(_users_count).over().label("total_users"))
+                  .group_by(User.email_domain)
+                  .order_by(_users_count.desc(), User.email_domain)
+                  .limit(bindparam("limit")))
+
+# Индекс поиска FTS5 (см. search.py): совпадения отдаются в порядке rowid, то есть id пользователя,
+# поэтому ORDER BY ... LIMIT не сортирует все совпадения
+_user_search = table("user_search", column("rowid"), column("user_search"))
+_SEARCH = (select(*USER_JSON_COLUMNS)
+           .select_from(_user_search)
+           .join(User, User.id == _user_search.c.rowid)
+           .where(_user_search.c.user_search.match(bindparam("match")),
+                  _user_search.c.rowid > bindparam("after_id"))
+           .order_by(_user_search.c.rowid)
+           .limit(bindparam("limit")))
+
+# Наибольший id + 1, вычисляется в самом INSERT (см. next_shard_user_id)
+_NEXT_USER_ID = func.coalesce(select(func.max(User.id)).scalar_subquery(), 0) + 1
+
+_CONFLICTING_USER = (select(User.id)
+                     .where(or_(User.username == bindparam("username"), User.email == bindparam("email")),
+                            User.id != bindparam("exclude_id"))
+                     .limit(1))
+
+
+def get_user(user_id):
+    """Возвращает ORM-объект пользователя для изменения или None, если его нет."""
+    return db.session.execute(_USER_BY_ID, {"user_id": user_id}).scalar_one_or_none()
+
+
+def longest_names(k):
+    """Возвращает k пользователей с самыми длинными именами (строки с колонками USER_JSON_COLUMNS)."""
+    return db.session.execute(_LONGEST_NAMES, {"k": k}).all()
+
+
+def users_page(page, per_page):
+    """Возвращает страницу пользователей по номеру (строки с колонками USER_JSON_COLUMNS)."""
+    return db.session.execute(_USERS_PAGE, {"limit": per_page, "offset": (page - 1) * per_page}).all()
+
+
+def users_after(order, key, limit):
+    """
+    Возвращает до `limit` пользователей после позиции курсора в порядке `order`.
+
+    Аргументы:
+        order (str): Порядок сортировки, один из pagination.KEYSET_ORDERS.
+        key (list): Ключ последней записи из pagination.decode_cursor или None для первой страницы.
+        limit (int): Количество строк.
+
+    Возвращает:
+        list[Row]: Строки с колонками USER_JSON_COLUMNS.
+    """
+    first_page, next_page = _KEYSET_PAGES[order]
+    if key is None:
+        return db.session.execute(first_page, {"limit": limit}).all()
+    if order == "id":
+        parameters = {"after_id": key[0]}
+    else:
+        parameters = {"after_date": key[0], "after_id": key[1]}
+    return db.session.execute(next_page, {**parameters, "limit": limit}).all()
+
+
+def users_by_probability(probability, after_id, limit):
+    """Возвращает до `limit` пользователей с заданной сохранённой вероятностью и id больше `after_id`."""
+    return db.session.execute(_BY_PROBABILITY, {"probability": probability, "after_id": after_id,
+                                                "limit": limit}).all()
+
+
+def email_domains(limit):
+    """Возвращает `limit` самых популярных доменов с количеством пользователей и общим количеством."""
+    return db.session.execute(_EMAIL_DOMAINS, {"limit": limit}).all()
+
+
+def search_users(match, after_id, limit):
+    """
+    Возвращает до `limit` пользователей, подходящих под выражение поиска, с id больше `after_id`.
+
+    Аргументы:
+        match (str): Выражение FTS5 MATCH из search.match_query.
+        after_id (int): Id последнего пользователя предыдущей страницы, 0 - первая страница.
+        limit (int): Количество строк.
+
+    Возвращает:
+        list[Row]: Строки с колонками USER_JSON_COLUMNS в порядке id.
+    """
+    return db.session.execute(_SEARCH, {"match": match, "after_id": after_id, "limit": limit}).all()
+
+
+def next_shard_user_id(index, count):
+    """
+    Возвращает выражение SQL для id нового пользователя шарда: больше всех id в нём и с остатком `index`
+    от деления на `count`.
+
+    Выражение присваивается User.id и вычисляется в самом INSERT под блокировкой записи SQLite, поэтому
+    процессы, одновременно пишущие в один шард, не выберут одинаковый id.
+    """
+    # % в SQLite сохраняет знак делимого, поэтому остаток приводится к неотрицательному
+    return _NEXT_USER_ID + ((index - _NEXT_USER_ID) % count + count) % count
+
+
+def find_conflicting_user(username, email, exclude_id=0, bind=None):
+    """
+    Возвращает id другого пользователя с тем же именем или адресом почты или None.
+
+    Нужен, когда уникальность не проверяет сама база: в режиме шардирования пользователи с одинаковым
+    именем могут оказаться в разных файлах (см. sharding.py). Если передан `bind`, запрос выполняется
+    на отдельном соединении этого движка, вне транзакции сессии.
+    """
+    params = {"username": username, "email": email, "exclude_id": exclude_id}
+    if bind is None:
+        return db.session.execute(_CONFLICTING_USER, params).scalar()
+    with bind.connect() as connection:
+        return connection.execute(_CONFLICTING_USER, params).scalar()
@@ -0,0 +1,268 @@
+"""
+Оценка вероятности активности пользователей.
+
+activity_probability считает вероятность для одного пользователя, score_arrays - то же самое сразу для
+массивов дат через NumPy. Оба варианта дают одинаковый результат: количество дней считается с округлением
+вниз, как timedelta.days, а пользователи без даты последней активности получают 10.
+
+Для пакетной оценки (POST /users/activity_probability/batch) из базы читаются только нужные столбцы,
+без создания ORM-объектов, и оцениваются пачками по SCORING_BATCH_SIZE.
+
+Вероятность зависит от прошедших дней, поэтому меняется только при изменении дат пользователя или при
+переходе через порог модели (31 и 91 день после регистрации, 15 и 31 день после последней активности).
+Она хранится в столбце User.activity_probability вместе с моментом ближайшего порога
+(User.activity_score_expires_at):
+    - при изменении дат через ORM оценка пересчитывается перед flush;
+    - оценки с наступившим порогом пересчитывает команда `flask scores refresh`, её нужно запускать
+      по расписанию (например, раз в час из cron);
+    - при чтении просроченная оценка не используется, вместо неё вероятность считается на месте, так что
+      ответы верны и тогда, когда команда давно не запускалась. Исключение - выборка по сохранённой
+      оценке (GET /users/by_activity_probability): она только читает и отстаёт от модели до запуска команды.
+"""
+import json
+from datetime import datetime, timedelta
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, event, inspect, or_, select, update
+
+from export import filter_users
+from models import db, User
+
+SCORING_COLUMNS = (User.id, User.registration_date, User.last_active_date)
+
+# Все значения, которые может вернуть модель
+PROBABILITY_BUCKETS = (10, 20, 30, 50, 80)
+
+# Сроки, после которых меняются условия модели: days > 30 и days > 90 для регистрации,
+# days > 14 и days > 30 для последней активности
+_REGISTRATION_THRESHOLDS = (timedelta(days=31), timedelta(days=91))
+_LAST_ACTIVE_THRESHOLDS = (timedelta(days=15), timedelta(days=31))
+
+_ONE_DAY = np.timedelta64(1, "D")
+_NEVER = np.datetime64("9999-12-31T00:00:00", "us")
+
+
+def activity_probability(registration_date, last_active_date, now):
+    """
+    Алгоритм предсказания вероятности активности пользователя на основе его истории.
+
+    Аргументы:
+        registration_date (datetime): Дата регистрации.
+        last_active_date (datetime): Дата последней активности или None.
+        now (datetime): Момент, на который считается вероятность.
+
+    Возвращает:
+        int: Вероятность активности в следующем месяце в процентах (от 0 до 100).
+    """
+    # Тут подразумевается, что если пользователь долгое время не активен, то вероятность очень низкая
+    if not last_active_date:
+        return 10
+
+    days_since_registration = (now - registration_date).days
+    days_since_last_active = (now - last_active_date).days
+
+    if days_since_registration > 90 and days_since_last_active <= 14:
+        return 80
+    if days_since_registration <= 30 and days_since_last_active <= 30:
+        return 30
+    if days_since_registration > 30 and days_since_last_active > 30:
+        return 50
+    return 20
+
+
+def score_arrays(registration_dates, last_active_dates, now):
+    """
+    Векторная версия activity_probability.
+
+    Аргументы:
+        registration_dates (np.ndarray): Даты регистрации (datetime64).
+        last_active_dates (np.ndarray): Даты последней активности (datetime64, NaT - нет активности).
+        now (datetime): Момент, на который считается вероятность.
+
+    Возвращает:
+        np.ndarray: Вероятности в процентах.
+    """
+    now = np.datetime64(now, "us")
+    inactive = np.isnat(last_active_dates)
+    # NaT подменяем на now, чтобы не делить NaT; результат для таких строк всё равно заменяется на 10
+    last_active_dates = np.where(inactive, now, last_active_dates)
+
+    days_since_registration = (now - registration_dates) // _ONE_DAY
+    days_since_last_active = (now - last_active_dates) // _ONE_DAY
+
+    return np.select([inactive,
+                      (days_since_registration > 90) & (days_since_last_active <= 14),
+                      (days_since_registration <= 30) & (days_since_last_active <= 30),
+                      (days_since_registration > 30) & (days_since_last_active > 30)],
+                     [10, 80, 30, 50], default=20)
+
+
+def next_score_change(registration_date, last_active_date, now):
+    """
+    Возвращает ближайший момент после `now`, когда вероятность активности может измениться сама по себе,
+    или None, если такого момента нет.
+    """
+    if not last_active_date:
+        return None
+    moments = ([registration_date + threshold for threshold in _REGISTRATION_THRESHOLDS]
+               + [last_active_date + threshold for threshold in _LAST_ACTIVE_THRESHOLDS])
+    return min((moment for moment in moments if moment > now), default=None)
+
+
+def next_score_change_arrays(registration_dates, last_active_dates, now):
+    """Векторная версия next_score_change, отсутствие момента обозначается NaT."""
+    now = np.datetime64(now, "us")
+    moments = np.stack([registration_dates + np.timedelta64(threshold) for threshold in _REGISTRATION_THRESHOLDS]
+                       + [last_active_dates + np.timedelta64(threshold) for threshold in _LAST_ACTIVE_THRESHOLDS])
+    # Прошедшие пороги (и NaT у пользователей без активности) заменяем на "никогда" и берём ближайший
+    nearest = np.where(moments > now, moments, _NEVER).min(axis=0)
+    return np.where(nearest == _NEVER, np.datetime64("NaT", "us"), nearest)
+
+
+def user_activity_probability(user, now):
+    """Возвращает вероятность активности пользователя, по возможности из сохранённой оценки."""
+    expires_at = user.activity_score_expires_at
+    if user.activity_probability is not None and (expires_at is None or expires_at > now):
+        return user.activity_probability
+    return activity_probability(user.registration_date, user.last_active_date, now)
+
+
+def score_rows(rows, now):
+    """
+    Оценивает строки (id, registration_date, last_active_date).
+
+    Возвращает:
+        list[dict]: Идентификатор пользователя и вероятность активности для каждой строки.
+    """
+    if not rows:
+        return []
+    ids, registration_dates, last_active_dates = zip(*rows)
+    probabilities = score_arrays(np.array(registration_dates, dtype="datetime64[us]"),
+                                 np.array(last_active_dates, dtype="datetime64[us]"), now)
+    return [{"user_id": user_id, "activity_probability": probability}
+            for user_id, probability in zip(ids, probabilities.tolist())]
+
+
+def score_users_by_ids(session, ids, now, batch_size):
+    """
+    Оценивает пользователей с указанными идентификаторами.
+
+    Возвращает:
+        tuple[list[dict], list[int]]: Оценки найденных пользователей в порядке `ids` и ненайденные идентификаторы.
+    """
+    unique_ids = list(dict.fromkeys(ids))
+    scored = {}
+    # IN по частям, чтобы не упереться в ограничение SQLite на количество параметров
+    for start in range(0, len(unique_ids), batch_size):
+        rows = session.execute(select(*SCORING_COLUMNS)
+                               .where(User.id.in_(unique_ids[start:start + batch_size]))).all()
+        for score in score_rows(rows, now):
+            scored[score["user_id"]] = score
+    results = [scored[user_id] for user_id in unique_ids if user_id in scored]
+    not_found = [user_id for user_id in unique_ids if user_id not in scored]
+    return results, not_found
+
+
+def iter_scores(session, now, batch_size, registered_from=None, registered_to=None, domain=None, bind=None):
+    """
+    Оценивает всех пользователей, подходящих под фильтры, пачками по `batch_size`.
+
+    Если передан `bind`, чтение идёт через этот движок (например, database.read_engine()).
+
+    Возвращает:
+        iterator[list[dict]]: Оценки по пачкам в порядке id.
+    """
+    statement = filter_users(select(*SCORING_COLUMNS), registered_from, registered_to, domain)
+    result = session.execute(statement.order_by(User.id).execution_options(yield_per=batch_size),
+                             bind_arguments={"bind": bind} if bind is not None else None)
+    for rows in result.partitions():
+        yield score_rows(rows, now)
+
+
+def generate_ndjson(batches):
+    """Отдаёт оценки из iter_scores в формате NDJSON, по одной пачке за раз."""
+    for scores in batches:
+        yield "".join(json.dumps(score) + "\n" for score in scores)
+
+
+def save_scores(session, rows, now):
+    """
+    Пересчитывает и сохраняет оценки для строк (id, registration_date, last_active_date) одним executemany.
+    """
+    if not rows:
+        return
+    ids, registration_dates, last_active_dates = zip(*rows)
+    registration_dates = np.array(registration_dates, dtype="datetime64[us]")
+    last_active_dates = np.array(last_active_dates, dtype="datetime64[us]")
+    probabilities = score_arrays(registration_dates, last_active_dates, now).tolist()
+    expires_at = next_score_change_arrays(registration_dates, last_active_dates, now).tolist()
+    user = User.__table__
+    statement = (update(user)
+                 .where(user.c.id == bindparam("user_id"))
+                 .values(activity_probability=bindparam("probability"),
+                         activity_score_expires_at=bindparam("expires_at")))
+    session.execute(statement, [{"user_id": user_id, "probability": probability, "expires_at": moment}
+                                for user_id, probability, moment in zip(ids, probabilities, expires_at)])
+
+
+def refresh_due_scores(session, now, batch_size):
+    """
+    Пересчитывает сохранённые оценки, у которых наступил порог, и ещё не посчитанные оценки.
+
+    Возвращает:
+        int: Количество пересчитанных пользователей.
+    """
+    due = or_(User.activity_probability.is_(None), User.activity_score_expires_at <= now)
+    refreshed, last_id = 0, 0
+    while True:
+        rows = session.execute(select(*SCORING_COLUMNS)
+                               .where(due, User.id > last_id)
+                               .order_by(User.id)
+                               .limit(batch_size)).all()
+        if not rows:
+            return refreshed
+        save_scores(session, rows, now)
+        refreshed += len(rows)
+        last_id = rows[-1].id
+
+
+def _score_changed_users(session, flush_context, instances):
+    """Пересчитывает сохранённую оценку у новых пользователей и у пользователей с изменёнными датами."""
+    now = None
+    for user in list(session.new) + list(session.dirty):
+        if not isinstance(user, User):
+            continue
+        state = inspect(user)
+        if not (state.pending or state.attrs.registration_date.history.has_changes()
+                or state.attrs.last_active_date.history.has_changes()):
+            continue
+        now = now or datetime.utcnow()
+        if user.registration_date is None:
+            # Значение по умолчанию подставилось бы только при INSERT, а для оценки дата нужна уже сейчас
+            user.registration_date = now
+        user.activity_probability = activity_probability(user.registration_date, user.last_active_date, now)
+        user.activity_score_expires_at = next_score_change(user.registration_date, user.last_active_date, now)
+
+
+scores_cli = AppGroup("scores", help="Сохранённые оценки вероятности активности пользователей.")
+
+
+@scores_cli.command("refresh")
+def refresh_command():
+    """Пересчитывает оценки, у которых наступил порог модели. Рассчитана на запуск по расписанию."""
+    refreshed = refresh_due_scores(db.session, datetime.utcnow(), current_app.config["SCORING_BATCH_SIZE"])
+    db.session.commit()
+    click.echo(f"Refreshed {refreshed} scores")
+
+
+def init_app(app):
+    """Задаёт настройки оценки по умолчанию, подключает пересчёт оценок к сессии и регистрирует `flask scores`."""
+    app.config.setdefault("SCORING_BATCH_SIZE", 5000)
+    app.config.setdefault("SCORING_MAX_IDS", 100000)
+
+    if not event.contains(db.session, "before_flush", _score_changed_users):
+        event.listen(db.session, "before_flush", _score_changed_users)
+    app.cli.add_command(scores_cli)
@@ -0,0 +1,135 @@
+"""
+Поиск пользователей по имени и адресу почты (GET /users/search).
+
+Индекс - виртуальная таблица SQLite FTS5 user_search с внешним содержимым (content='user'): текст
+хранится только в таблице user, а в индексе - токены с id пользователя (rowid). Индекс обновляют триггеры
+на таблице user при вставке, удалении и изменении username или email, поэтому он согласован с таблицей
+в той же транзакции при любой записи: через ORM, массовым импортом или вручную в SQL. Отметка активности
+(изменение last_active_date) индекс не трогает.
+
+Имя и адрес разбиваются на токены по всем символам, кроме букв и цифр, без учёта регистра:
+"Alice_Smith" - это "alice" и "smith", "alice@mail.ru" - "alice", "mail" и "ru". Запрос разбивается
+так же и ищется как последовательность токенов, последний из которых - префикс: "ali" находит "Alice"
+и "bob@alibaba.com", "alice@ma" - "alice@mail.ru". Для префиксов из 2-4 символов в индексе хранятся
+готовые списки (prefix='2 3 4'), поэтому короткие префиксы не перебирают весь словарь.
+
+Результаты отдаются в порядке id: FTS5 отдаёт совпадения в порядке rowid сам, поэтому страница из LIMIT
+строк читается без сортировки и без подсчёта всех совпадений, а следующая страница - по курсору
+"после id" (см. pagination.py).
+
+Таблица и триггеры создаются вместе с таблицей user (db.create_all, `flask init-db`) и миграцией.
+Если индекс разошёлся с таблицей (например, база восстановлена из копии без него), его можно проверить
+и пересобрать командами:
+    flask search verify
+    flask search rebuild
+"""
+import re
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import DDL, event, text
+from sqlalchemy.exc import DatabaseError
+
+from models import db, User
+
+# Поля, по которым можно искать
+SEARCH_FIELDS = ("all", "username", "email")
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+CREATE_STATEMENTS = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS user_search
+       USING fts5(username, email, content='user', content_rowid='id', prefix='2 3 4')""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_insert AFTER INSERT ON "user" BEGIN
+           INSERT INTO user_search(rowid, username, email) VALUES (new.id, new.username, new.email);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_delete AFTER DELETE ON "user" BEGIN
+           INSERT INTO user_search(user_search, rowid, username, email)
+           VALUES ('delete', old.id, old.username, old.email);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_update AFTER UPDATE OF username, email ON "user" BEGIN
+           INSERT INTO user_search(user_search, rowid, username, email)
+           VALUES ('delete', old.id, old.username, old.email);
+           INSERT INTO user_search(rowid, username, email) VALUES (new.id, new.username, new.email);
+       END""",
+)
+
+DROP_STATEMENTS = (
+    "DROP TRIGGER IF EXISTS user_search_update",
+    "DROP TRIGGER IF EXISTS user_search_delete",
+    "DROP TRIGGER IF EXISTS user_search_insert",
+    "DROP TABLE IF EXISTS user_search",
+)
+
+# Индекс создаётся после таблицы user и удаляется перед ней, иначе после drop_all и create_all
+# в нём остались бы токены удалённых пользователей
+for _statement in CREATE_STATEMENTS:
+    event.listen(User.__table__, "after_create", DDL(_statement))
+for _statement in DROP_STATEMENTS:
+    event.listen(User.__table__, "before_drop", DDL(_statement))
+
+
+def match_query(query, field="all"):
+    """
+    Строит выражение FTS5 MATCH для строки поиска.
+
+    Аргументы:
+        query (str): Строка поиска.
+        field (str): Поле, одно из SEARCH_FIELDS.
+
+    Возвращает:
+        str: Выражение MATCH или None, если в строке нет ни букв, ни цифр.
+    """
+    tokens = _TOKEN.findall(query.lower())
+    if not tokens:
+        return None
+    # Токены состоят только из букв и цифр, поэтому в кавычках их экранировать не нужно
+    phrase = f'"{" ".join(tokens)}" *'
+    return phrase if field == "all" else f"{field} : {phrase}"
+
+
+def verify_index():
+    """
+    Проверяет, что индекс поиска соответствует таблице user (FTS5 integrity-check).
+
+    Возвращает:
+        str: Описание расхождения или None, если индекс актуален.
+    """
+    try:
+        db.session.execute(text("INSERT INTO user_search(user_search, rank) VALUES ('integrity-check', 1)"))
+    except DatabaseError as e:
+        db.session.rollback()
+        return str(e.orig)
+    return None
+
+
+def rebuild_index():
+    """Пересобирает индекс поиска по таблице user."""
+    db.session.execute(text("INSERT INTO user_search(user_search) VALUES ('rebuild')"))
+    db.session.commit()
+
+
+search_cli = AppGroup("search", help="Проверка и пересборка индекса поиска пользователей.")
+
+
+@search_cli.command("verify")
+def verify_command():
+    """Сравнивает индекс поиска с таблицей user."""
+    problem = verify_index()
+    if problem:
+        click.echo(problem)
+        click.echo("Search index is out of date, run `flask search rebuild` to fix it")
+        raise SystemExit(1)
+    click.echo("Search index is consistent")
+
+
+@search_cli.command("rebuild")
+def rebuild_command():
+    """Пересобирает индекс поиска по таблице user."""
+    rebuild_index()
+    click.echo("Search index rebuilt")
+
+
+def init_app(app):
+    """Регистрирует команды `flask search`."""
+    app.cli.add_command(search_cli)
@@ -0,0 +1,377 @@
+"""
+Шардированное хранение пользователей (необязательный режим).
+
+Один файл SQLite - предел и для скорости записи (писатель у файла один), и для размера базы. В режиме
+шардирования пользователи распределяются по нескольким базам (шардам) по id: пользователь хранится
+в шарде id % N. Каждый шард - полная база со схемой приложения: таблица user с индексами, агрегаты
+статистики (aggregates.py) и индекс поиска (search.py), поэтому запись в разные шарды идёт параллельно.
+
+Режим включается настройкой SHARD_DATABASE_URIS (список адресов баз) или переменной окружения
+SHARD_DATABASE_URIS с адресами через запятую. Основная база (SQLALCHEMY_DATABASE_URI) пользователей
+в этом режиме не хранит. Движки шардов создаются с PRAGMA и пулом профиля DB_PROFILE (см. database.py).
+
+db.session выполняет запросы на движке выбранного шарда (models.ShardRoutingSession), поэтому код с ORM -
+модели, события агрегатов, оценок активности и кэшей - работает внутри шарда без изменений:
+    - запросы к одному пользователю (GET, PUT, DELETE /users/<id>, вероятность активности) направляются
+      в его шард (route_to_user);
+    - новые пользователи записываются в шарды по очереди. id вычисляется в самом INSERT так, чтобы id % N
+      указывал на этот шард (repository.next_shard_user_id), а уникальность имени и почты проверяется во всех
+      шардах (check_unique). В отличие от UNIQUE в одной базе, между проверкой и записью остаётся небольшое
+      окно для гонки;
+    - списки и аналитика (GET /users, last_7_days, registrations, top_5_longest_names,
+      email_domain_proportion, statistics, search) выполняются во всех шардах параллельно в пуле потоков
+      (ShardSet.scatter), а результаты объединяются: суммы складываются, упорядоченные списки сливаются.
+      Страница GET /users по номеру берёт из каждого шарда page * per_page строк, поэтому глубокие страницы
+      лучше запрашивать по курсору.
+Массовый импорт, выгрузка, распределение доменов, пакетная оценка и выборка по вероятности активности
+в этом режиме отвечают 501 (single_database_only).
+
+Настройки:
+    - SHARD_DATABASE_URIS: адреса баз шардов, пустой список (по умолчанию) - режим выключен;
+    - SHARD_WORKERS: количество потоков для запросов ко всем шардам, по умолчанию - по числу шардов.
+
+Команды:
+    flask shards init                     создаёт схему во всех шардах
+    flask shards status                   количество пользователей в каждом шарде
+    flask shards reshard URI [URI ...]    копирует пользователей из текущих шардов (или из основной базы,
+                                          если режим выключен) в новый набор пустых баз по id % M
+                                          и пересобирает в них агрегаты; затем новый набор указывается
+                                          в SHARD_DATABASE_URIS
+"""
+import heapq
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+
+import click
+from flask import current_app, g, jsonify, make_response
+from flask.cli import AppGroup
+from sqlalchemy import select
+
+import aggregates
+import database
+import repository
+from models import current_shard_engine, db, User
+
+# Сколько пользователей читается из исходной базы за раз при перераспределении
+RESHARD_BATCH_SIZE = 10000
+
+
+class DuplicateUser(ValueError):
+    """Пользователь с таким именем или адресом почты уже есть в одном из шардов."""
+
+
+class ShardSet:
+    """
+    Движки шардов и пул потоков для запросов ко всем шардам.
+
+    Аргументы:
+        app (Flask): Приложение; в его контексте выполняются запросы в потоках пула.
+        engines (list[Engine]): Движки шардов, шард пользователя - engines[id % len(engines)].
+        workers (int): Количество потоков пула.
+    """
+
+    def __init__(self, app, engines, workers):
+        self.app = app
+        self.engines = engines
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="shard")
+        self._next_shard = itertools.count()
+
+    def __len__(self):
+        return len(self.engines)
+
+    def index_for(self, user_id):
+        return user_id % len(self.engines)
+
+    def next_shard(self):
+        """Возвращает номер шарда для нового пользователя (по очереди)."""
+        return next(self._next_shard) % len(self.engines)
+
+    def scatter(self, fn):
+        """Выполняет fn() в каждом шарде параллельно и возвращает результаты в порядке шардов."""
+        return list(self.executor.map(self._run, self.engines, itertools.repeat(fn)))
+
+    def _run(self, engine, fn):
+        with self.app.app_context(), use_engine(engine):
+            return fn()
+
+    def close(self):
+        """Останавливает пул потоков и закрывает соединения шардов."""
+        self.executor.shutdown(wait=True)
+        for engine in self.engines:
+            engine.dispose()
+
+
+def get_shards():
+    """Возвращает шарды текущего приложения или None, если режим шардирования выключен."""
+    return current_app.extensions.get("sharding")
+
+
+def is_enabled():
+    return get_shards() is not None
+
+
+@contextmanager
+def use_engine(engine):
+    """Направляет запросы db.session в текущем потоке на движок engine (None - основная база)."""
+    token = current_shard_engine.set(engine)
+    try:
+        yield
+    finally:
+        current_shard_engine.reset(token)
+
+
+def route_to_user(user_id):
+    """Направляет запросы db.session до конца текущего контекста приложения в шард пользователя."""
+    shards = get_shards()
+    if shards is None:
+        return
+    token = current_shard_engine.set(shards.engines[shards.index_for(user_id)])
+    g.setdefault("shard_tokens", []).append(token)
+
+
+def _reset_route(exception=None):
+    for token in reversed(g.pop("shard_tokens", [])):
+        current_shard_engine.reset(token)
+
+
+def split_by_shard(values):
+    """
+    Разбивает словарь {id пользователя: значение} по шардам.
+
+    Возвращает:
+        list[tuple[Engine, dict]]: Движок шарда и его часть словаря; без шардирования - (None, values).
+    """
+    shards = get_shards()
+    if shards is None:
+        return [(None, values)]
+    parts = {}
+    for user_id, value in values.items():
+        parts.setdefault(shards.index_for(user_id), {})[user_id] = value
+    return [(shards.engines[index], part) for index, part in sorted(parts.items())]
+
+
+def single_database_only(view):
+    """Декоратор эндпоинта, который в режиме шардирования не поддерживается: отвечает 501."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if is_enabled():
+            return make_response(jsonify({"message": "not supported in sharded mode"}), 501)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def check_unique(username, email, exclude_id=0):
+    """
+    Проверяет во всех шардах, что имя и адрес почты не заняты другим пользователем.
+
+    Исключения:
+        DuplicateUser: Если имя или адрес уже заняты.
+    """
+    # Точечные запросы по уникальным индексам по очереди в текущем потоке дешевле, чем передача в пул потоков
+    for engine in get_shards().engines:
+        if repository.find_conflicting_user(username, email, exclude_id, bind=engine) is not None:
+            raise DuplicateUser("username or email already exists")
+
+
+def create_user(user):
+    """
+    Записывает нового пользователя в очередной шард.
+
+    Аргументы:
+        user (User): Новый пользователь без id.
+
+    Возвращает:
+        User: Тот же пользователь с присвоенным id.
+
+    Исключения:
+        DuplicateUser: Если имя или адрес почты уже заняты.
+    """
+    shards = get_shards()
+    check_unique(user.username, user.email)
+    index = shards.next_shard()
+    with use_engine(shards.engines[index]):
+        user.id = repository.next_shard_user_id(index, len(shards))
+        db.session.add(user)
+        db.session.commit()
+    return user
+
+
+def _merge(pages, key, limit):
+    return list(itertools.islice(heapq.merge(*pages, key=key), limit))
+
+
+def users_after(order, key, limit):
+    """Как repository.users_after, но по всем шардам."""
+    pages = get_shards().scatter(lambda: repository.users_after(order, key, limit))
+    if order == "id":
+        return _merge(pages, lambda row: row.id, limit)
+    return _merge(pages, lambda row: (row.registration_date, row.id), limit)
+
+
+def users_page(page, per_page):
+    """Как repository.users_page, но по всем шардам: страница по порядку id."""
+    # OFFSET по отдельности в каждом шарде не применить, поэтому из каждого берутся первые page * per_page строк
+    return users_after("id", None, page * per_page)[(page - 1) * per_page:]
+
+
+def search_users(match, after_id, limit):
+    """Как repository.search_users, но по всем шардам."""
+    pages = get_shards().scatter(lambda: repository.search_users(match, after_id, limit))
+    return _merge(pages, lambda row: row.id, limit)
+
+
+def _longest_first(username, user_id):
+    return -len(username), user_id
+
+
+def longest_names(k):
+    """Как repository.longest_names, но по всем шардам."""
+    tops = get_shards().scatter(lambda: repository.longest_names(k))
+    return heapq.nsmallest(k, itertools.chain(*tops), key=lambda row: _longest_first(row.username, row.id))
+
+
+def count_users():
+    return sum(get_shards().scatter(aggregates.count_users))
+
+
+def email_domain_counts(domain):
+    """Возвращает общее количество пользователей и количество пользователей домена по всем шардам."""
+    counts = get_shards().scatter(lambda: (aggregates.count_users(), aggregates.count_domain_users(domain)))
+    return sum(total for total, _ in counts), sum(domain_users for _, domain_users in counts)
+
+
+def count_registered_since(moment):
+    return sum(get_shards().scatter(lambda: aggregates.count_registered_since(moment)))
+
+
+def count_registrations_by_bucket(start, end, bucket):
+    """Как aggregates.count_registrations_by_bucket, но по всем шардам."""
+    per_shard = get_shards().scatter(lambda: aggregates.count_registrations_by_bucket(start, end, bucket))
+    # Интервалы у всех шардов одни и те же (bucket_starts), поэтому складываем поэлементно
+    return [(buckets[0][0], sum(users for _, users in buckets)) for buckets in zip(*per_shard)]
+
+
+def combined_statistics(moment, domain, k=5, fields=aggregates.STATISTICS_FIELDS):
+    """Как aggregates.combined_statistics, но по всем шардам."""
+    parts = get_shards().scatter(lambda: aggregates.combined_statistics(moment, domain, k, fields))
+    result = {}
+    if "user_count_7_days" in fields:
+        result["user_count_7_days"] = sum(part["user_count_7_days"] for part in parts)
+    if "top_5_longest_names" in fields:
+        result["top_5_longest_names"] = heapq.nsmallest(
+            k, itertools.chain(*(part["top_5_longest_names"] for part in parts)),
+            key=lambda item: _longest_first(item["username"], item["id"]))
+    if "email_domain_proportion" in fields:
+        result["email_domain_proportion"] = (sum(part["email_domain_proportion"][0] for part in parts),
+                                             sum(part["email_domain_proportion"][1] for part in parts))
+    return result
+
+
+def reshard(target_uris, batch_size=RESHARD_BATCH_SIZE):
+    """
+    Копирует всех пользователей в новый набор баз: пользователь попадает в базу id % len(target_uris).
+
+    Источник - текущие шарды или, если режим шардирования выключен, основная база. id сохраняются,
+    индекс поиска заполняют триггеры при вставке, агрегаты статистики пересчитываются в каждой новой базе.
+
+    Аргументы:
+        target_uris (list[str]): Адреса новых баз; таблицы user в них должны быть пустыми.
+        batch_size (int): Сколько пользователей читается из источника за раз.
+
+    Возвращает:
+        list[int]: Количество скопированных пользователей в каждой новой базе.
+
+    Исключения:
+        ValueError: Если в какой-то из новых баз уже есть пользователи.
+    """
+    user = User.__table__
+    targets = [database.create_profile_engine(uri) for uri in target_uris]
+    try:
+        for uri, engine in zip(target_uris, targets):
+            db.metadata.create_all(engine)
+            with engine.connect() as connection:
+                if connection.execute(select(user.c.id).limit(1)).first() is not None:
+                    raise ValueError(f"target database {uri} already has users")
+
+        shards = get_shards()
+        sources = shards.engines if shards is not None else [db.engine]
+        copied = [0] * len(targets)
+        for source in sources:
+            with source.connect() as connection:
+                result = connection.execution_options(yield_per=batch_size).execute(select(user).order_by(user.c.id))
+                for rows in result.partitions():
+                    parts = [[] for _ in targets]
+                    for row in rows:
+                        parts[row.id % len(targets)].append(row._asdict())
+                    for index, part in enumerate(parts):
+                        if part:
+                            with targets[index].begin() as target:
+                                target.execute(user.insert(), part)
+                            copied[index] += len(part)
+
+        for engine in targets:
+            with use_engine(engine):
+                aggregates.rebuild_aggregates()
+        return copied
+    finally:
+        db.session.remove()
+        for engine in targets:
+            engine.dispose()
+
+
+shards_cli = AppGroup("shards", help="Шарды пользователей: создание схемы, состояние и перераспределение.")
+
+
+@shards_cli.command("init")
+def init_command():
+    """Создаёт таблицы и индексы, которых ещё нет, во всех шардах."""
+    shards = get_shards()
+    if shards is None:
+        raise click.UsageError("SHARD_DATABASE_URIS is not set")
+    for engine in shards.engines:
+        db.metadata.create_all(engine)
+    click.echo(f"Schema created in {len(shards)} shards")
+
+
+@shards_cli.command("status")
+def status_command():
+    """Выводит количество пользователей в каждом шарде."""
+    shards = get_shards()
+    if shards is None:
+        raise click.UsageError("SHARD_DATABASE_URIS is not set")
+    for index, (uri, users) in enumerate(zip(current_app.config["SHARD_DATABASE_URIS"],
+                                             shards.scatter(aggregates.count_users))):
+        click.echo(f"shard {index} ({uri}): {users} users")
+
+
+@shards_cli.command("reshard")
+@click.argument("target_uris", nargs=-1, required=True)
+def reshard_command(target_uris):
+    """Копирует пользователей в новый набор баз TARGET_URIS по id % количество баз."""
+    try:
+        copied = reshard(list(target_uris))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    for uri, users in zip(target_uris, copied):
+        click.echo(f"{uri}: {users} users")
+    click.echo("Done, set SHARD_DATABASE_URIS to the new databases and restart the application")
+
+
+def init_app(app):
+    """
+    Задаёт настройки шардирования по умолчанию, создаёт движки шардов и регистрирует команды `flask shards`.
+
+    Вызывается после database.init_app.
+    """
+    uris = os.environ.get("SHARD_DATABASE_URIS")
+    app.config.setdefault("SHARD_DATABASE_URIS", uris.split(",") if uris else [])
+    app.config.setdefault("SHARD_WORKERS", None)
+    app.teardown_appcontext(_reset_route)
+    app.cli.add_command(shards_cli)
+    if app.config["SHARD_DATABASE_URIS"]:
+        with app.app_context():
+            engines = [database.create_profile_engine(uri) for uri in app.config["SHARD_DATABASE_URIS"]]
+        app.extensions["sharding"] = ShardSet(app, engines, app.config["SHARD_WORKERS"] or len(engines))
@@ -0,0 +1,569 @@
+"""
+Колоночный снимок пользователей для аналитики, отображённый в память.
+
+Снимок хранит только поля, нужные аналитике, по массиву NumPy на столбец в отдельном файле .npy:
+    - id (int64), по возрастанию;
+    - username_length (int16);
+    - domain_id (int32): номер домена почты в словаре доменов снимка, -1 - домена нет;
+    - registration_date и last_active_date (datetime64[us]): точные даты, NaT в last_active_date - активности
+      не было. NaT в registration_date отмечает удалённого пользователя (в базе эта дата обязательна).
+Файлы открываются через np.load(mmap_mode="r"): страницы читаются из кэша ОС и общие для всех воркеров,
+копий столбцов в памяти процессов нет. Сканы идут частями по SNAPSHOT_CHUNK_ROWS строк, поэтому временные
+массивы ограничены размером части, а не таблицы. На диске снимок занимает ~30 байт на пользователя.
+
+Водяной знак изменений - таблица user_change: триггеры на user при вставке, удалении и изменении username,
+email, registration_date или last_active_date записывают id пользователя с очередным номером seq. Строка
+у пользователя одна, поэтому таблица не растёт больше числа когда-либо изменённых пользователей. Снимок
+помнит наибольший учтённый seq; обновление читает только пользователей с seq больше него: новые id
+дописываются в конец, изменённые и удалённые правятся на месте. Снимок собирается заново (в новое поколение
+файлов), если изменений больше REBUILD_FRACTION строк, кончился запас места, накопилось много удалённых
+или сменилась база.
+
+Устаревание: запрос, которому нужен снимок, сначала обновляет его, если с прошлого обновления прошло больше
+SNAPSHOT_MAX_AGE секунд. Обновляет один процесс (блокировка файла), остальные в это время читают прежний
+снимок, поэтому ответы отстают от базы не больше чем на SNAPSHOT_MAX_AGE плюс время обновления. Строка,
+изменённая на месте во время скана, может попасть в ответ уже в новом виде.
+
+При SNAPSHOT_ENABLED снимок используют:
+    - POST /users/activity_probability/batch с фильтром: оценка по столбцам снимка вместо чтения всех
+      подходящих строк из базы;
+    - GET /users/registrations: гистограмма по столбцу registration_date вместо GROUP BY по индексу.
+Статистика (last_7_days, top_5_longest_names, email_domain_proportion, statistics) читает агрегаты
+(aggregates.py), это быстрее любого скана; те же величины по снимку сверяет с базой `flask snapshot verify`.
+В режиме шардирования (sharding.py) снимок не используется.
+
+Настройки:
+    - SNAPSHOT_ENABLED: использовать ли снимок, по умолчанию нет;
+    - SNAPSHOT_PATH: папка снимка, по умолчанию instance/snapshot;
+    - SNAPSHOT_MAX_AGE: сколько секунд снимок считается свежим, по умолчанию 30;
+    - SNAPSHOT_CHUNK_ROWS: по сколько строк сканируются столбцы, по умолчанию 262144.
+
+Команды:
+    flask snapshot refresh [--full]    обновляет снимок (--full - собирает заново)
+    flask snapshot status              размер, возраст и количество неучтённых изменений
+    flask snapshot verify              сверяет снимок с базой
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import DDL, bindparam, event, func, select
+
+import aggregates
+import database
+import repository
+import scoring
+import sharding
+from models import db, User
+
+try:
+    import fcntl
+except ImportError:  # Windows: обновление согласуется только между потоками одного процесса
+    fcntl = None
+
+# Столбцы снимка и их типы
+COLUMNS = {
+    "id": np.int64,
+    "username_length": np.int16,
+    "domain_id": np.int32,
+    "registration_date": "datetime64[us]",
+    "last_active_date": "datetime64[us]",
+}
+
+_SOURCE_COLUMNS = (User.id, User.username_length, User.email_domain, User.registration_date, User.last_active_date)
+
+# Запас места под новых пользователей при сборке снимка (доля от количества строк)
+GROWTH_RESERVE = 0.25
+MIN_CAPACITY = 1024
+
+# При какой доле изменённых или удалённых строк снимок собирается заново, а не правится на месте
+REBUILD_FRACTION = 0.25
+
+# Сколько строк читается из базы за раз при сборке и сколько id передаётся в одном IN при обновлении
+READ_BATCH_SIZE = 10000
+
+META_FILE = "meta.json"
+LOCK_FILE = "lock"
+
+
+class UserChange(db.Model):
+    """
+    Водяной знак изменений пользователей для снимка: номер последнего изменения каждого пользователя.
+
+    Заполняется триггерами на таблице user (CREATE_STATEMENTS), а не через ORM. Строка удалённого
+    пользователя остаётся, чтобы обновление снимка узнало об удалении.
+    """
+    __tablename__ = "user_change"
+
+    user_id = db.Column(db.Integer, primary_key=True)
+    seq = db.Column(db.Integer, nullable=False, index=True)
+
+
+_LOG_CHANGE = ("INSERT OR REPLACE INTO user_change (user_id, seq) "
+               "VALUES ({user}.id, (SELECT coalesce(max(seq), 0) + 1 FROM user_change));")
+
+CREATE_STATEMENTS = (
+    f"""CREATE TRIGGER IF NOT EXISTS user_change_insert AFTER INSERT ON "user" BEGIN
+            {_LOG_CHANGE.format(user="new")}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS user_change_delete AFTER DELETE ON "user" BEGIN
+            {_LOG_CHANGE.format(user="old")}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS user_change_update
+        AFTER UPDATE OF username, email, registration_date, last_active_date ON "user" BEGIN
+            {_LOG_CHANGE.format(user="new")}
+        END""",
+)
+
+# Триггеры создаются вместе с таблицей user_change, уже после таблицы user, и удаляются вместе с user
+UserChange.__table__.add_is_dependent_on(User.__table__)
+for _statement in CREATE_STATEMENTS:
+    event.listen(UserChange.__table__, "after_create", DDL(_statement))
+
+_MAX_SEQ = select(func.coalesce(func.max(UserChange.seq), 0))
+_CHANGED_SINCE = select(UserChange.user_id).where(UserChange.seq > bindparam("watermark")).order_by(UserChange.user_id)
+_COUNT_CHANGED_SINCE = select(func.count()).where(UserChange.seq > bindparam("watermark"))
+_USERS_BY_IDS = select(*_SOURCE_COLUMNS).where(User.id.in_(bindparam("ids", expanding=True)))
+_ALL_USERS = select(*_SOURCE_COLUMNS).order_by(User.id)
+_COUNT_ALL_USERS = select(func.count()).select_from(User)
+
+
+class Snapshot:
+    """
+    Открытый снимок: столбцы, отображённые в память только для чтения, и словарь доменов.
+
+    Аргументы:
+        directory (str): Папка снимка.
+        meta (dict): Описание снимка из meta.json.
+        chunk_rows (int): По сколько строк сканируются столбцы.
+    """
+
+    def __init__(self, directory, meta, chunk_rows):
+        self.meta = meta
+        self.chunk_rows = chunk_rows
+        self.domains = meta["domains"]
+        self.domain_ids = {domain: index for index, domain in enumerate(self.domains)}
+        self.columns = {name: np.load(_column_path(directory, meta["generation"], name), mmap_mode="r")[:meta["rows"]]
+                        for name in COLUMNS}
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def age(self):
+        """Возвращает, сколько секунд прошло с последнего обновления снимка."""
+        return time.time() - self.meta["refreshed_at"]
+
+    def chunks(self, chunk_rows=None):
+        """Отдаёт столбцы частями по chunk_rows строк (срезы без копирования)."""
+        chunk_rows = chunk_rows or self.chunk_rows
+        for start in range(0, len(self), chunk_rows):
+            yield {name: column[start:start + chunk_rows] for name, column in self.columns.items()}
+
+    def _filter(self, chunk, registered_from=None, registered_to=None, domain=None):
+        registration_dates = chunk["registration_date"]
+        # Сравнение с NaT ложно, а без фильтров удалённых отсекает явная проверка
+        mask = ~np.isnat(registration_dates)
+        if registered_from is not None:
+            mask &= registration_dates >= np.datetime64(registered_from, "us")
+        if registered_to is not None:
+            mask &= registration_dates < np.datetime64(registered_to, "us")
+        if domain is not None:
+            mask &= chunk["domain_id"] == self.domain_ids.get(domain, -2)
+        return mask
+
+    def iter_scores(self, now, batch_size, registered_from=None, registered_to=None, domain=None):
+        """
+        Оценивает пользователей снимка, подходящих под фильтры (как scoring.iter_scores).
+
+        Возвращает:
+            iterator[list[dict]]: Оценки пачками до `batch_size` пользователей в порядке id.
+        """
+        for chunk in self.chunks(batch_size):
+            mask = self._filter(chunk, registered_from, registered_to, domain)
+            user_ids = chunk["id"][mask]
+            if not len(user_ids):
+                continue
+            probabilities = scoring.score_arrays(chunk["registration_date"][mask], chunk["last_active_date"][mask],
+                                                 now)
+            yield [{"user_id": user_id, "activity_probability": probability}
+                   for user_id, probability in zip(user_ids.tolist(), probabilities.tolist())]
+
+    def count_registrations_by_bucket(self, start, end, bucket):
+        """Как aggregates.count_registrations_by_bucket, но по столбцу registration_date снимка."""
+        starts = aggregates.bucket_starts(start, end, bucket)
+        if not starts:
+            return []
+        first = np.datetime64(starts[0], "us")
+        step = np.timedelta64(aggregates.REGISTRATION_BUCKETS[bucket][2], "us")
+        counts = np.zeros(len(starts), dtype=np.int64)
+        for chunk in self.chunks():
+            registration_dates = chunk["registration_date"]
+            registration_dates = registration_dates[self._filter(chunk, start, end)]
+            counts += np.bincount((registration_dates - first) // step, minlength=len(starts))
+        return list(zip(starts, counts.tolist()))
+
+    def count_registered_since(self, moment):
+        """Как aggregates.count_registered_since, но по снимку."""
+        return sum(int(self._filter(chunk, moment).sum()) for chunk in self.chunks())
+
+    def count_users_by_domain(self):
+        """Возвращает словарь {домен: количество пользователей} по снимку; пользователи без домена - под ''."""
+        counts = np.zeros(len(self.domains) + 1, dtype=np.int64)
+        for chunk in self.chunks():
+            # Сдвиг на 1: domain_id = -1 (нет домена) попадает в нулевую ячейку
+            counts += np.bincount(chunk["domain_id"][self._filter(chunk)] + 1, minlength=len(counts))
+        result = {domain: users for domain, users in zip(self.domains, counts[1:].tolist()) if users}
+        if counts[0]:
+            result[""] = int(counts[0])
+        return result
+
+    def longest_name_ids(self, k):
+        """Возвращает id k пользователей с самыми длинными именами (как repository.longest_names)."""
+        candidates = []
+        for chunk in self.chunks():
+            mask = self._filter(chunk)
+            user_ids, lengths = chunk["id"][mask], chunk["username_length"][mask]
+            # Порядок (длина по убыванию, id по возрастанию); из каждой части достаточно первых k
+            order = np.lexsort((user_ids, -lengths.astype(np.int64)))[:k]
+            candidates.extend(zip((-lengths[order].astype(np.int64)).tolist(), user_ids[order].tolist()))
+        return [user_id for _, user_id in sorted(candidates)[:k]]
+
+
+def _column_path(directory, generation, name):
+    return os.path.join(directory, f"{generation}.{name}.npy")
+
+
+def read_meta(directory):
+    """Возвращает описание снимка из meta.json или None, если снимка ещё нет."""
+    try:
+        with open(os.path.join(directory, META_FILE)) as meta_file:
+            return json.load(meta_file)
+    except FileNotFoundError:
+        return None
+
+
+def _write_meta(directory, meta):
+    # Читатели видят либо прежний файл, либо новый целиком
+    path = os.path.join(directory, META_FILE)
+    with open(f"{path}.tmp", "w") as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(f"{path}.tmp", path)
+
+
+_refresh_lock = threading.Lock()
+
+
+@contextmanager
+def _exclusive(directory, blocking):
+    """Блокировка обновления снимка между потоками и процессами; отдаёт False, если она занята."""
+    if not _refresh_lock.acquire(blocking=blocking):
+        yield False
+        return
+    try:
+        if fcntl is None:
+            yield True
+            return
+        with open(os.path.join(directory, LOCK_FILE), "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    finally:
+        _refresh_lock.release()
+
+
+def _encode(user_ids, rows, domains, domain_ids):
+    """
+    Переводит строки базы в значения столбцов снимка, пополняя словарь доменов.
+
+    Строка None означает удалённого пользователя: даты NaT, домена нет.
+    """
+    lengths, domain_column, registration_dates, last_active_dates = [], [], [], []
+    for row in rows:
+        if row is None:
+            lengths.append(0)
+            domain_column.append(-1)
+            registration_dates.append(None)
+            last_active_dates.append(None)
+            continue
+        domain_id = -1
+        if row.email_domain is not None:
+            domain_id = domain_ids.get(row.email_domain)
+            if domain_id is None:
+                domain_id = domain_ids[row.email_domain] = len(domains)
+                domains.append(row.email_domain)
+        lengths.append(row.username_length)
+        domain_column.append(domain_id)
+        registration_dates.append(row.registration_date)
+        last_active_dates.append(row.last_active_date)
+    return {"id": np.array(user_ids, dtype=COLUMNS["id"]),
+            "username_length": np.array(lengths, dtype=COLUMNS["username_length"]),
+            "domain_id": np.array(domain_column, dtype=COLUMNS["domain_id"]),
+            "registration_date": np.array(registration_dates, dtype=COLUMNS["registration_date"]),
+            "last_active_date": np.array(last_active_dates, dtype=COLUMNS["last_active_date"])}
+
+
+def _build(directory, meta, connection, watermark, source):
+    """Собирает снимок заново в новом поколении файлов и удаляет файлы прежнего."""
+    count = connection.execute(_COUNT_ALL_USERS).scalar()
+    capacity = max(int(count * (1 + GROWTH_RESERVE)), MIN_CAPACITY)
+    generation = meta["generation"] + 1 if meta is not None else 1
+    columns = {name: np.lib.format.open_memmap(_column_path(directory, generation, name), mode="w+", dtype=dtype,
+                                               shape=(capacity,))
+               for name, dtype in COLUMNS.items()}
+    domains, domain_ids = [], {}
+    rows = 0
+    result = connection.execution_options(yield_per=READ_BATCH_SIZE).execute(_ALL_USERS)
+    for batch in result.partitions():
+        # Пользователи, добавленные после подсчёта, могли не поместиться; у них seq больше watermark,
+        # поэтому их допишет следующее обновление
+        batch = batch[:capacity - rows]
+        values = _encode([row.id for row in batch], batch, domains, domain_ids)
+        for name, column in columns.items():
+            column[rows:rows + len(batch)] = values[name]
+        rows += len(batch)
+        if rows == capacity:
+            break
+    for column in columns.values():
+        column.flush()
+    del columns
+
+    _write_meta(directory, {"database": source, "generation": generation, "rows": rows, "capacity": capacity,
+                            "deleted": 0, "watermark": watermark, "domains": domains, "refreshed_at": time.time()})
+    if meta is not None:
+        # Уже открытые отображения прежнего поколения продолжают работать и после удаления файлов
+        for name in COLUMNS:
+            try:
+                os.remove(_column_path(directory, meta["generation"], name))
+            except OSError:
+                pass
+    return "full"
+
+
+def _apply(directory, meta, connection, changed, watermark):
+    """
+    Переносит в снимок изменения пользователей `changed` на месте.
+
+    Возвращает:
+        bool: False, если снимок нужно собрать заново.
+    """
+    rows_by_id = {}
+    for start in range(0, len(changed), READ_BATCH_SIZE):
+        for row in connection.execute(_USERS_BY_IDS, {"ids": changed[start:start + READ_BATCH_SIZE]}):
+            rows_by_id[row.id] = row
+
+    columns = {name: np.load(_column_path(directory, meta["generation"], name), mmap_mode="r+")
+               for name in COLUMNS}
+    rows = meta["rows"]
+    ids = columns["id"][:rows]
+    changed_ids = np.array(changed, dtype=COLUMNS["id"])
+    positions = np.searchsorted(ids, changed_ids)
+    present = positions < rows
+    present[present] = ids[positions[present]] == changed_ids[present]
+
+    # Новые id, которые не больше последнего id снимка, дописать в конец нельзя без нарушения порядка
+    appended = [user_id for user_id in changed_ids[~present].tolist() if user_id in rows_by_id]
+    if appended and rows and appended[0] <= ids[-1]:
+        return False
+    if rows + len(appended) > meta["capacity"]:
+        return False
+
+    domains = list(meta["domains"])
+    domain_ids = {domain: index for index, domain in enumerate(domains)}
+    updated_ids, updated_positions = changed_ids[present], positions[present]
+    values = _encode(updated_ids.tolist(), [rows_by_id.get(user_id) for user_id in updated_ids.tolist()],
+                     domains, domain_ids)
+    deleted = (meta["deleted"] - int(np.isnat(columns["registration_date"][updated_positions]).sum())
+               + int(np.isnat(values["registration_date"]).sum()))
+    if deleted > REBUILD_FRACTION * max(rows + len(appended), MIN_CAPACITY):
+        return False
+    for name, column in columns.items():
+        column[updated_positions] = values[name]
+
+    values = _encode(appended, [rows_by_id[user_id] for user_id in appended], domains, domain_ids)
+    for name, column in columns.items():
+        column[rows:rows + len(appended)] = values[name]
+        column.flush()
+
+    _write_meta(directory, {**meta, "rows": rows + len(appended), "deleted": deleted, "watermark": watermark,
+                            "domains": domains, "refreshed_at": time.time()})
+    return True
+
+
+def refresh(directory, full=False, blocking=True):
+    """
+    Обновляет снимок в папке directory по текущей базе.
+
+    Аргументы:
+        directory (str): Папка снимка.
+        full (bool): Собрать снимок заново, а не переносить только изменения.
+        blocking (bool): Ждать, если снимок сейчас обновляет другой поток или процесс.
+
+    Возвращает:
+        str: "incremental" или "full" - как был обновлён снимок, None - если блокировка занята
+             и blocking = False.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with _exclusive(directory, blocking) as acquired:
+        if not acquired:
+            return None
+        meta = read_meta(directory)
+        source = db.engine.url.render_as_string()
+        with database.read_engine().connect() as connection:
+            # Водяной знак читается раньше строк: изменения, попавшие в строки позже него, при следующем
+            # обновлении просто перенесутся ещё раз
+            watermark = connection.execute(_MAX_SEQ).scalar()
+            if full or meta is None or meta["database"] != source or meta["watermark"] > watermark:
+                return _build(directory, meta, connection, watermark, source)
+            pending = connection.execute(_COUNT_CHANGED_SINCE, {"watermark": meta["watermark"]}).scalar()
+            if pending > REBUILD_FRACTION * max(meta["rows"], MIN_CAPACITY):
+                return _build(directory, meta, connection, watermark, source)
+            changed = connection.execute(_CHANGED_SINCE, {"watermark": meta["watermark"]}).scalars().all()
+            if not _apply(directory, meta, connection, changed, watermark):
+                return _build(directory, meta, connection, watermark, source)
+            return "incremental"
+
+
+class SnapshotStore:
+    """
+    Снимок текущего процесса: открывает его заново, когда файл meta.json меняется, и обновляет устаревший.
+
+    Аргументы:
+        directory (str): Папка снимка.
+        max_age (float): Сколько секунд снимок считается свежим.
+        chunk_rows (int): По сколько строк сканируются столбцы.
+    """
+
+    def __init__(self, directory, max_age, chunk_rows):
+        self.directory = directory
+        self.max_age = max_age
+        self.chunk_rows = chunk_rows
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._meta_version = None
+
+    def _open(self):
+        try:
+            stat = os.stat(os.path.join(self.directory, META_FILE))
+        except FileNotFoundError:
+            return None
+        version = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            if version != self._meta_version:
+                meta = read_meta(self.directory)
+                self._snapshot = Snapshot(self.directory, meta, self.chunk_rows) if meta is not None else None
+                self._meta_version = version
+            return self._snapshot
+
+    def get(self):
+        """Возвращает снимок, перед этим обновив его, если он устарел или ещё не собран."""
+        snapshot = self._open()
+        if snapshot is None or snapshot.age() > self.max_age:
+            # Без снимка ждём его сборки, а устаревший обновляет один поток, остальные читают прежний
+            if refresh(self.directory, blocking=snapshot is None) is not None:
+                snapshot = self._open()
+        return snapshot
+
+
+def get_store():
+    """Возвращает снимок текущего приложения, создавая его при первом обращении."""
+    store = current_app.extensions.get("snapshot")
+    if store is None:
+        directory = current_app.config["SNAPSHOT_PATH"] or os.path.join(current_app.instance_path, "snapshot")
+        store = current_app.extensions["snapshot"] = SnapshotStore(directory, current_app.config["SNAPSHOT_MAX_AGE"],
+                                                                   current_app.config["SNAPSHOT_CHUNK_ROWS"])
+    return store
+
+
+def is_enabled():
+    return current_app.config["SNAPSHOT_ENABLED"] and not sharding.is_enabled()
+
+
+def get_snapshot():
+    """Возвращает актуальный (с учётом SNAPSHOT_MAX_AGE) снимок текущего приложения."""
+    return get_store().get()
+
+
+def verify_snapshot(snapshot):
+    """
+    Сравнивает снимок с базой: количество пользователей по доменам, регистрации за 7 дней и топ длинных имён.
+
+    Возвращает:
+        list[str]: Описания расхождений, пустой список - если снимок совпадает с базой.
+    """
+    problems = []
+    expected_domains = {stat.domain: stat.users for stat in db.session.query(aggregates.EmailDomainStat)
+                        if stat.users}
+    domains = snapshot.count_users_by_domain()
+    if domains != expected_domains:
+        problems.append(f"users by domain: expected {expected_domains}, snapshot {domains}")
+    moment = datetime.utcnow() - timedelta(days=7)
+    expected, actual = aggregates.count_registered_since(moment), snapshot.count_registered_since(moment)
+    if expected != actual:
+        problems.append(f"registered in 7 days: expected {expected}, snapshot {actual}")
+    expected, actual = [row.id for row in repository.longest_names(5)], snapshot.longest_name_ids(5)
+    if expected != actual:
+        problems.append(f"longest names: expected {expected}, snapshot {actual}")
+    return problems
+
+
+snapshot_cli = AppGroup("snapshot", help="Колоночный снимок пользователей для аналитики.")
+
+
+@snapshot_cli.command("refresh")
+@click.option("--full", is_flag=True, help="Собрать снимок заново, а не переносить только изменения.")
+def refresh_command(full):
+    """Обновляет снимок по текущей базе."""
+    store = get_store()
+    mode = refresh(store.directory, full=full)
+    click.echo(f"Snapshot refreshed ({mode}): {read_meta(store.directory)['rows']} rows")
+
+
+@snapshot_cli.command("status")
+def status_command():
+    """Выводит размер и возраст снимка и количество ещё не перенесённых в него изменений."""
+    store = get_store()
+    meta = read_meta(store.directory)
+    if meta is None:
+        click.echo(f"No snapshot in {store.directory}, run `flask snapshot refresh`")
+        return
+    pending = db.session.execute(_COUNT_CHANGED_SINCE, {"watermark": meta["watermark"]}).scalar()
+    size = sum(os.path.getsize(_column_path(store.directory, meta["generation"], name)) for name in COLUMNS)
+    click.echo(f"rows: {meta['rows']} (deleted {meta['deleted']}, capacity {meta['capacity']})")
+    click.echo(f"size: {size / 1024 / 1024:.1f} MiB, domains: {len(meta['domains'])}")
+    click.echo(f"age: {time.time() - meta['refreshed_at']:.0f} s, pending changes: {pending}")
+
+
+@snapshot_cli.command("verify")
+def verify_command():
+    """Обновляет снимок и сверяет его с базой."""
+    store = get_store()
+    refresh(store.directory)
+    problems = verify_snapshot(store.get())
+    if problems:
+        for problem in problems:
+            click.echo(problem)
+        click.echo("Snapshot differs from the database, run `flask snapshot refresh --full` to rebuild it")
+        raise SystemExit(1)
+    click.echo("Snapshot is consistent")
+
+
+def init_app(app):
+    """Задаёт настройки снимка по умолчанию и регистрирует команды `flask snapshot`."""
+    app.config.setdefault("SNAPSHOT_ENABLED", False)
+    app.config.setdefault("SNAPSHOT_PATH", None)
+    app.config.setdefault("SNAPSHOT_MAX_AGE", 30)
+    app.config.setdefault("SNAPSHOT_CHUNK_ROWS", 1 << 18)
+    app.cli.add_command(snapshot_cli)
@@ -1,20 +1,53 @@
+import asyncio
+import csv
+import io
+import json
 import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from app import app, db, User
+import numpy as np
+from flask import Flask
+from app import create_app, db, User
+from asgi import AsyncUsersApp
+from aggregates import EmailDomainStat, verify_aggregates
+from cache import LRUCache, SQLiteCache
+from email_validator import EmailUndeliverableError
+from user_cache import SingleFlight
+import database
+import json_provider
+import profiling
+import repository
+import scoring
 from datetime import datetime, timedelta
 
 
+def stub_domain_resolver(domain):
+    """Заглушка проверки домена почты для EMAIL_DOMAIN_RESOLVER."""
+    if domain.startswith("nomail."):
+        raise EmailUndeliverableError(f"The domain name {domain} does not exist.")
+    return True
+
+
+# Путь к тестовой базе данных
+TEST_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_database", "test_app.db")
+
+# Тесты работают с отдельным приложением: движок базы создаётся в create_app, поэтому адрес тестовой базы
+# нужно передать сразу, иначе drop_all в тестах выполнится в основной базе instance/data_base.db.
+# Домены почты проверяются без сети: все, кроме доменов nomail.*, принимают почту
+app = create_app({"TESTING": True,
+                  "SQLALCHEMY_DATABASE_URI": f"sqlite:///{TEST_DB_PATH}",
+                  "EMAIL_DOMAIN_RESOLVER": stub_domain_resolver})
+
+
 class FlaskAppTests(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         """Создает тестовый клиент и тестовую базу данных."""
-        app.config['TESTING'] = True
-
-        # Указываем путь к тестовой базе данных
-        test_db_path = os.path.join(os.path.dirname(__file__), "test_database", "test_app.db")
-        os.makedirs(os.path.dirname(test_db_path), exist_ok=True)
-        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///tests/{test_db_path}"
-
+        os.makedirs(os.path.dirname(TEST_DB_PATH), exist_ok=True)
         cls.client = app.test_client()
 
         with app.app_context():
@@ -28,11 +61,10 @@ class FlaskAppTests(unittest.TestCase):
             db.drop_all()
 
         # Удаляем тестовую базу данных и папку
-        test_db_path = os.path.join(os.path.dirname(__file__), "test_database", "test_app.db")
-        if os.path.exists(test_db_path):
-            os.remove(test_db_path)
-        if os.path.exists(os.path.dirname(test_db_path)):
-            os.rmdir(os.path.dirname(test_db_path))
+        if os.path.exists(TEST_DB_PATH):
+            os.remove(TEST_DB_PATH)
+        if os.path.exists(os.path.dirname(TEST_DB_PATH)):
+            os.rmdir(os.path.dirname(TEST_DB_PATH))
 
     def setUp(self):
         """Добавляет тестовые данные в базу перед каждым тестом"""
@@ -49,6 +81,14 @@ class FlaskAppTests(unittest.TestCase):
 
     def tearDown(self):
         """Очищает базу данных после каждого теста."""
+        # Буфер активности сбрасывается до удаления таблиц, чтобы его фоновый поток не писал в пустую базу
+        buffer = app.extensions.pop("activity_buffer", None)
+        if buffer is not None:
+            buffer.close()
+        app.extensions.pop("user_cache", None)
+        checker = app.extensions.pop("email_check", None)
+        if checker is not None:
+            checker.close()
         with app.app_context():
             db.drop_all()
 
@@ -71,6 +111,82 @@ class FlaskAppTests(unittest.TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertIn("message", response.json)
 
+    def test_email_deliverability_cache(self):
+        """Тестирует кэш проверки доменов почты в режимах full, syntax и async."""
+        resolved = []
+
+        def resolver(domain):
+            resolved.append(domain)
+            return stub_domain_resolver(domain)
+
+        app.config['EMAIL_DOMAIN_RESOLVER'] = resolver
+        try:
+            for mode in ("full", "syntax", "async"):
+                app.config['EMAIL_DELIVERABILITY_MODE'] = mode
+                checker = app.extensions.pop("email_check", None)
+                if checker is not None:
+                    checker.close()
+                resolved.clear()
+                statuses = [self.client.post('/users', json={"username": f"{mode}{i}",
+                                                             "email": f"{mode}{i}@{domain}"}).status_code
+                            for i, domain in enumerate(["example.com", "example.com", "nomail.example.com",
+                                                        "nomail.example.com"])]
+                email_check = app.extensions["email_check"]
+                email_check.close()
+                stats = self.client.get('/cache/stats').json["email_domains"]
+                self.assertEqual(stats["mode"], mode)
+
+                if mode == "full":
+                    self.assertEqual(statuses, [201, 201, 400, 400])
+                    self.assertEqual(resolved, ["example.com", "nomail.example.com"])
+                    self.assertEqual((stats["hits"], stats["misses"]), (2, 2))
+                elif mode == "syntax":
+                    self.assertEqual(statuses, [201, 201, 201, 201])
+                    self.assertEqual(resolved, [])
+                else:
+                    # Неизвестный домен проверяется в фоне, адрес принимается сразу; повторный адрес может быть
+                    # отклонён, если фоновая проверка успела закончиться
+                    self.assertEqual(statuses[:3], [201, 201, 201])
+                    self.assertIn(statuses[3], (201, 400))
+                    self.assertEqual(sorted(resolved), ["example.com", "nomail.example.com"])
+                    self.assertEqual(stats["undeliverable_after_accept"], 1)
+                    response = self.client.post('/users', json={"username": "late",
+                                                                "email": "late@nomail.example.com"})
+                    self.assertEqual(response.status_code, 400)
+        finally:
+            app.config['EMAIL_DOMAIN_RESOLVER'] = stub_domain_resolver
+            app.config['EMAIL_DELIVERABILITY_MODE'] = "full"
+
+    def test_bulk_create_users(self):
+        """Тестирует массовое создание пользователей с ошибками по отдельным записям."""
+        response = self.client.post('/users/bulk', json=[
+            {"username": "David", "email": "david@mail.ru"},
+            {"username": "Alice", "email": "alice2@mail.ru"},
+            {"username": "Eve", "email": "not-an-email"},
+            {"username": "Frank"},
+            {"username": "Grace", "email": "david@mail.ru"},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["inserted"], 1)
+        self.assertEqual(response.json["failed"], 4)
+        self.assertEqual([error["index"] for error in response.json["errors"]], [1, 2, 3, 4])
+
+        statistics = self.client.get('/users/statistics?domain=mail.ru').json
+        self.assertEqual(statistics["email_domain_proportion"]["domain_users"], 2)
+        with app.app_context():
+            self.assertEqual(verify_aggregates(), [])
+
+    def test_bulk_create_users_ndjson(self):
+        """Тестирует массовое создание пользователей из NDJSON."""
+        body = '{"username": "David", "email": "david@mail.ru"}\nnot json\n{"username": "Eve", "email": "eve@mail.ru"}\n'
+        response = self.client.post('/users/bulk', data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["inserted"], 2)
+        self.assertEqual(response.json["errors"], [{"index": 1, "message": "invalid JSON"}])
+
+        response = self.client.post('/users/bulk', json={"username": "David"})
+        self.assertEqual(response.status_code, 400)
+
     def test_get_users(self):
         """Тестирует получение списка пользователей."""
         response = self.client.get('/users')
@@ -78,6 +194,184 @@ class FlaskAppTests(unittest.TestCase):
         self.assertIn("users", response.json)
         self.assertGreaterEqual(len(response.json["users"]), 1)
 
+    def test_get_users_offset_mode_total(self):
+        """Тестирует постраничный режим: общее количество и необязательный подсчет total."""
+        response = self.client.get('/users?page=2&per_page=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["total"], 3)
+        self.assertEqual(response.json["total_pages"], 2)
+        self.assertEqual(len(response.json["users"]), 1)
+
+        response = self.client.get('/users?include_total=false')
+        self.assertNotIn("total", response.json)
+        self.assertNotIn("total_pages", response.json)
+
+    def test_get_users_cursor_mode(self):
+        """Тестирует курсорную пагинацию по id и по дате регистрации."""
+        for order, expected in (("id", ["Alice", "Bob", "Charlie"]),
+                                ("registration_date", ["Charlie", "Bob", "Alice"])):
+            names, cursor = [], ""
+            while cursor is not None:
+                response = self.client.get('/users', query_string={"cursor": cursor, "per_page": 2,
+                                                                    "order_by": order})
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn("total", response.json)
+                names += [user["username"] for user in response.json["users"]]
+                cursor = response.json["next_cursor"]
+            self.assertEqual(names, expected)
+
+    def test_get_users_invalid_cursor(self):
+        """Тестирует ответ на поврежденный курсор и курсор от другого порядка сортировки."""
+        response = self.client.get('/users?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+
+        cursor = self.client.get('/users?cursor=&per_page=1').json["next_cursor"]
+        response = self.client.get('/users', query_string={"cursor": cursor, "order_by": "registration_date"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_repository(self):
+        """Тестирует готовые запросы repository.py и то, что объект после commit не перечитывается из базы."""
+        with app.app_context():
+            self.assertEqual([row.username for row in repository.users_after("registration_date", None, 3)],
+                             ["Charlie", "Bob", "Alice"])
+            charlie = repository.users_after("registration_date", None, 1)[0]
+            self.assertEqual([row.username for row in repository.users_after(
+                "registration_date", [charlie.registration_date, charlie.id], 3)], ["Bob", "Alice"])
+            self.assertEqual([row.username for row in repository.users_page(2, 2)], ["Charlie"])
+            self.assertEqual(repository.longest_names(1)[0].username, "Charlie")
+            self.assertEqual([(row.email_domain, row.users, row.total_users) for row in repository.email_domains(1)],
+                             [("gmail.com", 1, 3)])
+            self.assertIsNone(repository.get_user(10_000))
+
+            user = repository.get_user(charlie.id)
+            user.username = "Charles"
+            db.session.commit()
+            with profiling.SQLRecorder(threading.get_ident()) as recorder:
+                self.assertEqual(user.json()["username"], "Charles")
+            self.assertEqual(recorder.statements, [])
+
+    def test_export_users_ndjson(self):
+        """Тестирует потоковую выгрузку пользователей в NDJSON с фильтрами."""
+        response = self.client.get('/users/export')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([row["username"] for row in rows], ["Alice", "Bob", "Charlie"])
+
+        registered_from = (datetime.utcnow() - timedelta(days=5)).isoformat()
+        response = self.client.get('/users/export', query_string={"registered_from": registered_from,
+                                                                   "domain": "GMAIL.com"})
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([row["username"] for row in rows], ["Bob"])
+
+    def test_export_users_csv(self):
+        """Тестирует потоковую выгрузку пользователей в CSV."""
+        response = self.client.get('/users/export?format=csv')
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+        self.assertEqual(rows[0], ["id", "username", "email", "registration_date", "last_active_date"])
+        self.assertEqual(len(rows), 4)
+
+        self.assertEqual(self.client.get('/users/export?format=xml').status_code, 400)
+        self.assertEqual(self.client.get('/users/export?registered_to=yesterday').status_code, 400)
+
+    def test_score_arrays_matches_activity_probability(self):
+        """Тестирует, что векторная оценка совпадает с оценкой по одному пользователю, в том числе на границах."""
+        now = datetime(2024, 6, 1, 12, 0, 0)
+        offsets = [timedelta(days=days, seconds=seconds) for days in (0, 14, 15, 30, 31, 90, 91, 200)
+                   for seconds in (-1, 0, 1)]
+        rows = [(registration_offset, last_active_offset)
+                for registration_offset in offsets for last_active_offset in offsets + [None]]
+        registration_dates = [now - registration_offset for registration_offset, _ in rows]
+        last_active_dates = [now - offset if offset is not None else None for _, offset in rows]
+
+        expected = [scoring.activity_probability(registration_date, last_active_date, now)
+                    for registration_date, last_active_date in zip(registration_dates, last_active_dates)]
+        actual = scoring.score_arrays(np.array(registration_dates, dtype="datetime64[us]"),
+                                      np.array(last_active_dates, dtype="datetime64[us]"), now)
+        self.assertEqual(actual.tolist(), expected)
+
+    def test_activity_probability_batch(self):
+        """Тестирует пакетную оценку по списку идентификаторов и потоковую оценку всей таблицы."""
+        with app.app_context():
+            user = db.session.get(User, 2)
+            user.last_active_date = datetime.utcnow()
+            db.session.commit()
+
+        response = self.client.post('/users/activity_probability/batch', json={"ids": [2, 1, 999]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["results"], [{"user_id": 2, "activity_probability": 30},
+                                                    {"user_id": 1, "activity_probability": 10}])
+        self.assertEqual(response.json["not_found"], [999])
+        self.assertEqual(self.client.post('/users/activity_probability/batch',
+                                          json={"ids": ["1"]}).status_code, 400)
+
+        response = self.client.post('/users/activity_probability/batch', json={})
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([row["user_id"] for row in rows], [1, 2, 3])
+        for row in rows:
+            single = self.client.get(f'/users/{row["user_id"]}/activity_probability')
+            self.assertEqual(row["activity_probability"], single.json["activity_probability"])
+
+        response = self.client.post('/users/activity_probability/batch', json={"filter": {"domain": "yahoo.com"}})
+        self.assertEqual([json.loads(line)["user_id"] for line in response.get_data(as_text=True).splitlines()], [3])
+
+    def test_materialized_activity_score(self):
+        """Тестирует пересчёт сохранённой оценки при изменении дат и командой `flask scores refresh`."""
+        with app.app_context():
+            user = db.session.get(User, 3)
+            self.assertEqual((user.activity_probability, user.activity_score_expires_at), (10, None))
+
+            user.last_active_date = datetime.utcnow()
+            db.session.commit()
+            self.assertEqual(user.activity_probability, 30)
+            self.assertEqual(user.activity_score_expires_at, user.last_active_date + timedelta(days=15))
+
+            # Порог наступил, а команда ещё не запускалась: при чтении оценка считается на месте
+            db.session.execute(db.update(User).where(User.id == 3).values(
+                registration_date=datetime.utcnow() - timedelta(days=100),
+                activity_score_expires_at=datetime.utcnow() - timedelta(days=1)))
+            db.session.commit()
+        self.assertEqual(self.client.get('/users/3/activity_probability').json["activity_probability"], 80)
+
+        result = app.test_cli_runner().invoke(args=["scores", "refresh"])
+        self.assertIn("Refreshed 1 scores", result.output)
+        with app.app_context():
+            user = db.session.get(User, 3)
+            self.assertEqual(user.activity_probability, 80)
+            self.assertEqual(user.activity_score_expires_at, user.last_active_date + timedelta(days=15))
+
+    def test_get_users_by_activity_probability(self):
+        """Тестирует выборку пользователей по значению вероятности активности."""
+        with app.app_context():
+            db.session.get(User, 2).last_active_date = datetime.utcnow()
+            db.session.commit()
+
+        response = self.client.get('/users/by_activity_probability?probability=10&per_page=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user["id"] for user in response.json["users"]], [1])
+        response = self.client.get('/users/by_activity_probability', query_string={
+            "probability": 10, "per_page": 1, "cursor": response.json["next_cursor"]})
+        self.assertEqual([user["id"] for user in response.json["users"]], [3])
+        self.assertIsNone(response.json["next_cursor"])
+
+        response = self.client.get('/users/by_activity_probability?probability=30')
+        self.assertEqual([user["id"] for user in response.json["users"]], [2])
+        self.assertEqual(self.client.get('/users/by_activity_probability?probability=42').status_code, 400)
+
+        # Оценка с наступившим порогом не пересчитывается при чтении, это делает `flask scores refresh`
+        with app.app_context():
+            db.session.execute(db.update(User).where(User.id == 2).values(
+                last_active_date=datetime.utcnow() - timedelta(days=40),
+                activity_score_expires_at=datetime.utcnow() - timedelta(days=1)))
+            db.session.commit()
+        response = self.client.get('/users/by_activity_probability?probability=30')
+        self.assertEqual([user["id"] for user in response.json["users"]], [2])
+        app.test_cli_runner().invoke(args=["scores", "refresh"])
+        response = self.client.get('/users/by_activity_probability?probability=30')
+        self.assertEqual(response.json["users"], [])
+
     def test_get_user_by_id(self):
         """Тестирует получение пользователя по ID."""
         with app.app_context():
@@ -86,6 +380,139 @@ class FlaskAppTests(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn("user", response.json)
 
+    def test_get_user_buffers_activity(self):
+        """Тестирует, что GET /users/<id> не пишет в базу, а откладывает отметку активности в буфер."""
+        response = self.client.get('/users/3')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.json["user"]["last_active_date"])
+        self.assertEqual(response.json["user"]["activity_probability"], 30)
+        self.assertEqual(self.client.get('/users/3/activity_probability').json["activity_probability"], 30)
+
+        buffer = app.extensions["activity_buffer"]
+        self.assertEqual(len(buffer), 1)
+        with app.app_context():
+            self.assertIsNone(db.session.get(User, 3).last_active_date)
+
+        self.client.get('/users/3')
+        self.assertEqual(len(buffer), 1)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(len(buffer), 0)
+        with app.app_context():
+            user = db.session.get(User, 3)
+            self.assertIsNotNone(user.last_active_date)
+            self.assertEqual(user.activity_probability, 30)
+            self.assertEqual(user.activity_score_expires_at, user.last_active_date + timedelta(days=15))
+
+    def test_get_user_without_write_behind(self):
+        """Тестирует запись отметки активности сразу при выключенной отложенной записи."""
+        app.config['ACTIVITY_WRITE_BEHIND'] = False
+        try:
+            self.client.get('/users/3')
+        finally:
+            app.config['ACTIVITY_WRITE_BEHIND'] = True
+        self.assertNotIn("activity_buffer", app.extensions)
+        with app.app_context():
+            self.assertIsNotNone(db.session.get(User, 3).last_active_date)
+
+    def test_asgi_matches_sync_app(self):
+        """Тестирует, что асинхронные обработчики ASGI-режима отвечают так же, как синхронное приложение."""
+        application = AsyncUsersApp(app)
+
+        async def get(path, query_string=b""):
+            scope = {"type": "http", "method": "GET", "path": path, "query_string": query_string,
+                     "headers": [], "http_version": "1.1", "scheme": "http", "root_path": "",
+                     "server": ("testserver", 80), "client": ("127.0.0.1", 12345)}
+            messages = []
+
+            async def receive():
+                return {"type": "http.request", "body": b"", "more_body": False}
+
+            async def send(message):
+                messages.append(message)
+
+            await application(scope, receive, send)
+            return messages[0]["status"], json.loads(b"".join(m.get("body", b"") for m in messages[1:]))
+
+        async def run():
+            try:
+                return [await get("/users", b"per_page=2&page=2"),
+                        await get("/users", b"cursor=&per_page=2"),
+                        await get("/users", b"cursor=garbage"),
+                        await get("/users/3/activity_probability"),
+                        await get("/users/999"),
+                        await get("/users/last_7_days")]
+            finally:
+                await application.engine.dispose()
+
+        results = asyncio.run(run())
+        self.assertEqual(results[0], (200, self.client.get('/users?per_page=2&page=2').json))
+        self.assertEqual(results[1], (200, self.client.get('/users?cursor=&per_page=2').json))
+        self.assertEqual(results[2][0], 400)
+        self.assertEqual(results[3], (200, {"user_id": 3, "activity_probability": 10}))
+        self.assertEqual(results[4], (404, {"message": "user not found"}))
+        # Маршруты без асинхронной версии обслуживает приложение Flask
+        self.assertEqual(results[5], (200, {"users_count_7_days": 2}))
+
+    def test_user_cache(self):
+        """Тестирует кэш пользователей: попадания, сброс при изменениях и кэширование отсутствующих id."""
+        first = self.client.get('/users/2/activity_probability')
+        self.assertEqual(self.client.get('/users/2/activity_probability').json, first.json)
+        with app.app_context():
+            backend = app.extensions["user_cache"].backend
+        self.assertEqual((backend.stats.misses, backend.stats.hits), (1, 1))
+
+        self.client.put('/users/2', json={"username": "Robert"})
+        self.assertEqual(self.client.get('/users/2').json["user"]["username"], "Robert")
+        self.assertEqual(backend.stats.misses, 2)
+
+        self.client.delete('/users/2')
+        self.assertEqual(self.client.get('/users/2').status_code, 404)
+        self.assertEqual(self.client.get('/users/4').status_code, 404)
+        misses = backend.stats.misses
+        self.assertEqual(self.client.get('/users/4').status_code, 404)
+        self.assertEqual(backend.stats.misses, misses)
+
+        # Новый пользователь с закэшированным как отсутствующий id виден сразу
+        self.client.post('/users/bulk', json=[{"username": "Dave", "email": "dave@mail.ru"}])
+        self.assertEqual(self.client.get('/users/4').json["user"]["username"], "Dave")
+
+    def test_user_cache_after_activity_flush(self):
+        """Тестирует, что сброс буфера активности сбрасывает и кэш пользователя."""
+        self.client.get('/users/3')
+        app.extensions["activity_buffer"].flush()
+        with app.app_context():
+            stored = db.session.get(User, 3).last_active_date
+        user = self.client.get('/users/3/activity_probability')
+        self.assertEqual(user.json["activity_probability"], 30)
+        with app.app_context():
+            self.assertEqual(app.extensions["user_cache"].get(3).last_active_date, stored)
+
+    def test_single_flight(self):
+        """Тестирует, что одновременные загрузки одного ключа выполняются один раз."""
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def load():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return "user"
+
+        leader = threading.Thread(target=lambda: results.append(flight.do("user:1:", load)))
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=lambda: results.append(flight.do("user:1:", load))) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        # Даём остальным потокам дойти до ожидания загрузки, начатой первым
+        time.sleep(0.1)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["user"] * 4)
+
     def test_get_user_not_found(self):
         """Тестирует запрос пользователя с несуществующим ID."""
         response = self.client.get('/users/999')
@@ -125,6 +552,24 @@ class FlaskAppTests(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn("top_5_longest_names", response.json)
 
+    def test_top_longest_names_with_k(self):
+        """Тестирует топ самых длинных имен с параметром k и порядок выдачи."""
+        response = self.client.get('/users/top_5_longest_names?k=2')
+        self.assertEqual(response.status_code, 200)
+        names = [user["username"] for user in response.json["top_5_longest_names"]]
+        self.assertEqual(names, ["Charlie", "Alice"])
+
+        response = self.client.get('/users/top_5_longest_names?k=0')
+        self.assertEqual(response.status_code, 400)
+
+    def test_username_length_synced_on_update(self):
+        """Тестирует, что длина имени пересчитывается при обновлении пользователя."""
+        with app.app_context():
+            user = User.query.filter_by(username="Bob").first()
+        self.client.put(f'/users/{user.id}', json={"username": "Bartholomew"})
+        with app.app_context():
+            self.assertEqual(db.session.get(User, user.id).username_length, len("Bartholomew"))
+
     def test_email_domain_proportion(self):
         """Тестирует получение пропорции пользователей с определенным доменом."""
         response = self.client.get('/users/email_domain_proportion?domain=mail.ru')
@@ -134,6 +579,29 @@ class FlaskAppTests(unittest.TestCase):
         self.assertIn("domain_users", response.json)
         self.assertIn("proportions", response.json)
         self.assertEqual(response.json["domain"], "mail.ru")
+        self.assertEqual(response.json["total_users"], 3)
+        self.assertEqual(response.json["domain_users"], 1)
+
+    def test_email_domain_proportion_case_insensitive(self):
+        """Тестирует, что домен сравнивается без учета регистра."""
+        with app.app_context():
+            db.session.add(User(username="Dave", email="dave@MAIL.RU"))
+            db.session.commit()
+        response = self.client.get('/users/email_domain_proportion?domain=Mail.Ru')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["domain"], "mail.ru")
+        self.assertEqual(response.json["domain_users"], 2)
+
+    def test_email_domains(self):
+        """Тестирует распределение пользователей по доменам электронной почты."""
+        with app.app_context():
+            db.session.add(User(username="Dave", email="dave@mail.ru"))
+            db.session.commit()
+        response = self.client.get('/users/email_domains?limit=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["total_users"], 4)
+        self.assertEqual(response.json["domains"][0], {"domain": "mail.ru", "users": 2, "proportion": 0.5})
+        self.assertEqual(len(response.json["domains"]), 2)
 
     def test_activity_probability(self):
         """Тестирует расчет вероятности активности пользователя."""
@@ -143,6 +611,83 @@ class FlaskAppTests(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn("activity_probability", response.json)
 
+    def test_registrations(self):
+        """Тестирует гистограмму регистраций по интервалам и то, что запрос идёт по индексу на registration_date."""
+        now = datetime.utcnow()
+        response = self.client.get('/users/registrations', query_string={
+            "bucket": "day", "registered_from": (now - timedelta(days=14)).isoformat(),
+            "registered_to": (now + timedelta(seconds=1)).isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["total"], 3)
+        self.assertIn(len(response.json["buckets"]), (15, 16))
+        by_day = {bucket["start"][:10]: bucket["users"] for bucket in response.json["buckets"]}
+        self.assertEqual(by_day[now.date().isoformat()], 1)
+        self.assertEqual(by_day[(now - timedelta(days=3)).date().isoformat()], 1)
+        self.assertEqual(sum(by_day.values()), 3)
+
+        response = self.client.get('/users/registrations?bucket=week')
+        self.assertEqual(response.json["total"], 2)
+        for bucket in response.json["buckets"]:
+            self.assertEqual(datetime.fromisoformat(bucket["start"]).weekday(), 0)
+
+        self.assertEqual(self.client.get('/users/registrations?bucket=month').status_code, 400)
+        self.assertEqual(self.client.get('/users/registrations',
+                                         query_string={"bucket": "hour",
+                                                       "registered_from": "2000-01-01T00:00:00"}).status_code, 400)
+
+        with app.app_context():
+            plan = db.session.execute(db.text(
+                "EXPLAIN QUERY PLAN SELECT datetime(registration_date, 'start of day') AS bucket_start, count(*) "
+                "FROM user WHERE registration_date >= :start AND registration_date < :end GROUP BY bucket_start"),
+                {"start": now - timedelta(days=7), "end": now}).all()
+        self.assertTrue(any("COVERING INDEX ix_user_registration_date" in row[-1] for row in plan))
+
+    def test_search_users(self):
+        """Тестирует поиск по префиксу имени и почты, курсор и согласованность индекса с таблицей."""
+        def found(**params):
+            response = self.client.get('/users/search', query_string=params)
+            self.assertEqual(response.status_code, 200)
+            return [user["username"] for user in response.json["users"]]
+
+        self.assertEqual(found(q="al"), ["Alice"])
+        self.assertEqual(found(q="ALICE@ma"), ["Alice"])
+        self.assertEqual(found(q="gmail"), ["Bob"])
+        self.assertEqual(found(q="gmail", field="username"), [])
+
+        first = self.client.get('/users/search?q=com&limit=1').json
+        self.assertEqual([user["username"] for user in first["users"]], ["Bob"])
+        second = self.client.get(f'/users/search?q=com&limit=1&cursor={first["next_cursor"]}').json
+        self.assertEqual([user["username"] for user in second["users"]], ["Charlie"])
+        self.assertIsNone(second["next_cursor"])
+
+        # Индекс обновляется при изменении, удалении и массовой вставке
+        self.client.put('/users/2', json={"username": "Alfred"})
+        self.assertEqual(found(q="al"), ["Alice", "Alfred"])
+        self.client.delete('/users/1')
+        self.assertEqual(found(q="al"), ["Alfred"])
+        self.client.post('/users/bulk', json=[{"username": "Alma", "email": "alma@mail.ru"}])
+        self.assertEqual(found(q="al"), ["Alfred", "Alma"])
+
+        for query_string in ("q=@@", "q=al&limit=0", "q=al&field=phone", "q=al&cursor=broken"):
+            self.assertEqual(self.client.get(f'/users/search?{query_string}').status_code, 400)
+
+        runner = app.test_cli_runner()
+        self.assertEqual(runner.invoke(args=["search", "verify"]).exit_code, 0)
+        with app.app_context():
+            db.session.execute(db.text("INSERT INTO user_search(user_search, rowid, username, email) "
+                                       "VALUES ('delete', 2, 'Alfred', 'bob@gmail.com')"))
+            db.session.commit()
+        self.assertEqual(runner.invoke(args=["search", "verify"]).exit_code, 1)
+        self.assertEqual(runner.invoke(args=["search", "rebuild"]).exit_code, 0)
+        self.assertEqual(runner.invoke(args=["search", "verify"]).exit_code, 0)
+
+        with app.app_context():
+            plan = db.session.execute(db.text(
+                "EXPLAIN QUERY PLAN SELECT user.id FROM user_search JOIN user ON user.id = user_search.rowid "
+                "WHERE user_search MATCH :match AND user_search.rowid > 0 ORDER BY user_search.rowid LIMIT 10"),
+                {"match": '"al" *'}).all()
+        self.assertFalse(any("TEMP B-TREE" in row[-1] for row in plan))
+
     def test_combined_statistics(self):
         """Тестирует получение комбинированной статистики."""
         response = self.client.get('/users/statistics')
@@ -151,6 +696,395 @@ class FlaskAppTests(unittest.TestCase):
         self.assertIn("top_5_longest_names", response.json)
         self.assertIn("email_domain_proportion", response.json)
 
+    def test_combined_statistics_single_query(self):
+        """Тестирует, что статистика считается одним запросом, совпадает с отдельными эндпоинтами и учитывает fields."""
+        app.config['CACHE_BACKEND'] = "null"
+        app.extensions.pop("response_cache", None)
+        try:
+            with profiling.SQLRecorder(threading.get_ident()) as recorder:
+                response = self.client.get('/users/statistics?domain=mail.ru')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(recorder.statements), 1)
+            self.assertEqual(response.json["top_5_longest_names"],
+                             self.client.get('/users/top_5_longest_names').json["top_5_longest_names"])
+            self.assertEqual(response.json["user_count_7_days"],
+                             self.client.get('/users/last_7_days').json["users_count_7_days"])
+            self.assertEqual(response.json["email_domain_proportion"]["domain_users"], 1)
+
+            response = self.client.get('/users/statistics?fields=user_count_7_days')
+            self.assertEqual(list(response.json), ["user_count_7_days"])
+            response = self.client.get('/users/statistics?fields=email_domain_proportion,unknown')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("user_count_7_days", response.json["message"])
+            for fields in ("", " , ", "unknown"):
+                response = self.client.get('/users/statistics', query_string={"fields": fields})
+                self.assertEqual(response.status_code, 400)
+        finally:
+            app.config['CACHE_BACKEND'] = "memory"
+            app.extensions.pop("response_cache", None)
+
+    def test_json_provider(self):
+        """Тестирует кодирование ответов: даты в ISO 8601, формат RFC 822 по настройке и запасной модуль json."""
+        with app.app_context():
+            alice = User.query.filter_by(username="Alice").first()
+        response = self.client.get('/users?per_page=3')
+        users = response.json["users"]
+        self.assertEqual(users[0], {"id": alice.id, "username": "Alice", "email": "alice@mail.ru",
+                                    "registration_date": alice.registration_date.isoformat(),
+                                    "last_active_date": None})
+
+        orjson, json_provider.orjson = json_provider.orjson, None
+        try:
+            fallback = self.client.get('/users?per_page=3')
+        finally:
+            json_provider.orjson = orjson
+        self.assertEqual(fallback.get_data(), response.get_data())
+
+        app.config['JSON_DATETIME_FORMAT'] = "http"
+        try:
+            users = self.client.get('/users?per_page=3').json["users"]
+        finally:
+            app.config['JSON_DATETIME_FORMAT'] = "iso"
+        self.assertTrue(users[0]["registration_date"].endswith(" GMT"))
+
+    def test_statistics_follow_user_changes(self):
+        """Тестирует, что агрегаты статистики обновляются при изменении и удалении пользователей."""
+        with app.app_context():
+            bob = User.query.filter_by(username="Bob").first()
+            alice = User.query.filter_by(username="Alice").first()
+        self.client.put(f'/users/{bob.id}', json={"email": "bob@mail.ru", "username": "Bartholomew"})
+        self.client.delete(f'/users/{alice.id}')
+
+        response = self.client.get('/users/statistics?domain=mail.ru')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["user_count_7_days"], 1)
+        self.assertEqual([user["username"] for user in response.json["top_5_longest_names"]],
+                         ["Bartholomew", "Charlie"])
+        self.assertEqual(response.json["email_domain_proportion"]["total_users"], 2)
+        self.assertEqual(response.json["email_domain_proportion"]["domain_users"], 1)
+        with app.app_context():
+            self.assertEqual(verify_aggregates(), [])
+
+    def test_stats_verify_and_rebuild_commands(self):
+        """Тестирует команды проверки и пересборки агрегатов."""
+        runner = app.test_cli_runner()
+        self.assertEqual(runner.invoke(args=["stats", "verify"]).exit_code, 0)
+
+        with app.app_context():
+            EmailDomainStat.query.delete()
+            db.session.commit()
+        result = runner.invoke(args=["stats", "verify"])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("email_domain_stat[mail.ru]", result.output)
+
+        self.assertEqual(runner.invoke(args=["stats", "rebuild"]).exit_code, 0)
+        self.assertEqual(runner.invoke(args=["stats", "verify"]).exit_code, 0)
+
+    def test_analytics_response_cache(self):
+        """Тестирует кэширование аналитики, учет параметров запроса в ключе и сброс кэша при изменениях."""
+        first = self.client.get('/users/email_domain_proportion?domain=mail.ru')
+        second = self.client.get('/users/email_domain_proportion?domain=mail.ru')
+        other_domain = self.client.get('/users/email_domain_proportion?domain=gmail.com')
+        self.assertEqual(first.headers["X-Cache"], "MISS")
+        self.assertEqual(second.headers["X-Cache"], "HIT")
+        self.assertEqual(second.json, first.json)
+        self.assertEqual(other_domain.headers["X-Cache"], "MISS")
+
+        with app.app_context():
+            bob = User.query.filter_by(username="Bob").first()
+        self.client.put(f'/users/{bob.id}', json={"email": "bob@mail.ru"})
+        response = self.client.get('/users/email_domain_proportion?domain=mail.ru')
+        self.assertEqual(response.headers["X-Cache"], "MISS")
+        self.assertEqual(response.json["domain_users"], 2)
+
+        # Смена почты и отметка активности не влияют на регистрации, поэтому эта запись остается в кэше,
+        # а топ имен отдает дату последней активности и сбрасывается
+        self.client.get('/users/registrations')
+        self.client.get('/users/top_5_longest_names')
+        self.client.put(f'/users/{bob.id}', json={"email": "bob@yahoo.com"})
+        self.assertEqual(self.client.get('/users/registrations').headers["X-Cache"], "HIT")
+        self.assertEqual(self.client.get('/users/top_5_longest_names').headers["X-Cache"], "MISS")
+
+        # То же при записи отметки активности из буфера: UPDATE идет мимо ORM
+        self.client.get(f'/users/{bob.id}')
+        app.extensions["activity_buffer"].flush()
+        response = self.client.get('/users/top_5_longest_names')
+        self.assertEqual(response.headers["X-Cache"], "MISS")
+        users = {user["id"]: user for user in response.json["top_5_longest_names"]}
+        self.assertIsNotNone(users[bob.id]["last_active_date"])
+
+        self.client.delete(f'/users/{bob.id}')
+        self.assertEqual(self.client.get('/users/top_5_longest_names').headers["X-Cache"], "MISS")
+
+        stats = self.client.get('/cache/stats').json
+        self.assertEqual(stats["backend"], "memory")
+        self.assertGreaterEqual(stats["hits"], 2)
+        self.assertGreaterEqual(stats["misses"], 4)
+
+    def test_cache_backends_ttl_and_size(self):
+        """Тестирует ограничение размера и время жизни записей в бэкендах кэша."""
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        for backend in (LRUCache(max_entries=2, default_ttl=60),
+                        SQLiteCache(os.path.join(cache_dir.name, "cache.db"), max_entries=2, default_ttl=60)):
+            backend.set("a", 1)
+            backend.set("b", 2)
+            backend.set("c", 3)
+            self.assertEqual(len(backend), 2)
+            self.assertEqual(backend.stats.evictions, 1)
+            self.assertIsNone(backend.get("a"))
+            self.assertEqual(backend.get("c"), 3)
+
+            backend.set("d", 4, ttl=-1)
+            self.assertIsNone(backend.get("d"))
+            self.assertEqual(backend.stats.expirations, 1)
+
+            backend.delete_prefix("c")
+            self.assertIsNone(backend.get("c"))
+            backend.clear()
+
+    def test_metrics(self):
+        """Тестирует метрики запросов на /metrics, заголовок Server-Timing и журнал медленных запросов."""
+        app.config['METRICS_SERVER_TIMING'] = True
+        app.config['METRICS_SLOW_QUERY_MS'] = 0
+        try:
+            with self.assertLogs(level="WARNING") as logs:
+                response = self.client.get('/users?per_page=2')
+        finally:
+            app.config['METRICS_SERVER_TIMING'] = False
+            app.config['METRICS_SLOW_QUERY_MS'] = 100
+        self.assertIn("sql;dur=", response.headers["Server-Timing"])
+        self.assertTrue(any("Slow query" in line and "/users" in line for line in logs.output))
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        text = response.get_data(as_text=True)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/users",status="200"}', text)
+        self.assertIn('http_request_rows_hydrated_bucket{route="/users",le="2"}', text)
+        # Список выбирает колонки без ORM-объектов, а изменение пользователя загружает его объект
+        self.assertIn('http_request_rows_hydrated_sum{route="/users"} 0', text)
+        self.client.put('/users/1', json={"username": "Alicia"})
+        text = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('http_request_rows_hydrated_sum{route="/users/<int:user_id>"} 1', text)
+
+        # Каждое приложение в процессе считает запрос один раз и только в своих метриках
+        own_metrics = app.extensions["metrics"].render()
+        timings = []
+        for _ in range(3):
+            other_app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{TEST_DB_PATH}",
+                                    "SWAGGER_ENABLED": False,
+                                    "METRICS_SERVER_TIMING": True})
+            timings.append(other_app.test_client().get('/users?page=1').headers["Server-Timing"].split("desc=")[1])
+            with other_app.app_context():
+                db.engine.dispose()
+        self.assertEqual(len(set(timings)), 1, timings)
+        self.assertEqual(app.extensions["metrics"].render(), own_metrics)
+        self.assertIn('http_response_size_bytes_count{route="/users"}', text)
+        self.assertIn('sql_slow_queries_total{route="/users"}', text)
+
+    def test_profiling(self):
+        """Тестирует профилирование отдельного запроса по заголовку X-Profile."""
+        self.assertNotIsInstance(app.wsgi_app, profiling.ProfilingMiddleware)
+        original_wsgi_app = app.wsgi_app
+        with tempfile.TemporaryDirectory() as directory:
+            app.config['PROFILING_ENABLED'] = True
+            app.config['PROFILING_DIR'] = directory
+            profiling.init_app(app)
+            try:
+                self.client.get('/users/statistics')
+                response = self.client.get('/users/statistics', headers={"X-Profile": "inline"})
+                stored = self.client.get('/users/email_domain_proportion?_profile=1')
+                plain = self.client.get('/users/email_domain_proportion')
+            finally:
+                app.wsgi_app = original_wsgi_app
+                app.config['PROFILING_ENABLED'] = False
+                app.config['PROFILING_DIR'] = None
+
+            report = response.json
+            self.assertEqual((report["status"], report["path"]), (200, "/users/statistics"))
+            self.assertIn("get_user_statistics", report["stats"])
+            self.assertTrue(any("registration_day_stat" in sql["statement"] for sql in report["sql"]))
+            self.assertTrue(os.path.exists(report["files"]["pstats"]))
+
+            self.assertEqual(stored.json["domain"], "mail.ru")
+            # Профилируемый запрос не берётся из кэша
+            self.assertEqual(stored.headers["X-Cache"], "BYPASS")
+            profile_id = stored.headers["X-Profile-Id"]
+            self.assertEqual(sorted(os.listdir(directory)).count(f"{profile_id}.sql.json"), 1)
+            self.assertNotIn("X-Profile-Id", plain.headers)
+
+    def test_database_production_profile(self):
+        """Тестирует PRAGMA и движок только для чтения в профиле production."""
+        with tempfile.TemporaryDirectory() as directory:
+            profile_app = Flask(__name__)
+            profile_app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(directory, 'profile.db')}"
+            profile_app.config["DB_PROFILE"] = "production"
+            database.init_app(profile_app)
+            with profile_app.app_context():
+                db.create_all()
+                with db.engine.connect() as connection:
+                    self.assertEqual(connection.exec_driver_sql("PRAGMA journal_mode").scalar(), "wal")
+                    self.assertEqual(connection.exec_driver_sql("PRAGMA synchronous").scalar(), 1)
+                    self.assertEqual(connection.exec_driver_sql("PRAGMA busy_timeout").scalar(), 5000)
+
+                read_engine = database.read_engine()
+                self.assertIsNot(read_engine, db.engine)
+                with read_engine.connect() as connection:
+                    self.assertEqual(connection.exec_driver_sql("SELECT count(*) FROM user").scalar(), 0)
+                    with self.assertRaises(Exception):
+                        connection.exec_driver_sql("DELETE FROM user")
+                read_engine.dispose()
+                db.session.remove()
+                db.engine.dispose()
+
+        with self.assertRaises(ValueError):
+            database.get_profile("fastest")
+
+    def test_analytics_snapshot(self):
+        """Тестирует снимок для аналитики: ответы совпадают с базой, изменения переносятся инкрементально."""
+        def answers():
+            # registered_to - текущий момент, поэтому ответ каждый раз считается заново, а не берётся из кэша
+            now = datetime.utcnow()
+            registrations = self.client.get('/users/registrations', query_string={
+                "registered_from": (now - timedelta(days=30)).isoformat(), "registered_to": now.isoformat()}).json
+            scores = self.client.post('/users/activity_probability/batch', json={"filter": {"domain": "mail.ru"}})
+            return registrations["buckets"], scores.data
+
+        with tempfile.TemporaryDirectory() as directory:
+            app.config.update(SNAPSHOT_PATH=directory, SNAPSHOT_MAX_AGE=0)
+            try:
+                for change in (lambda: None,
+                               lambda: self.client.put('/users/2', json={"email": "bob@mail.ru"}),
+                               lambda: self.client.delete('/users/1'),
+                               lambda: self.client.post('/users', json={"username": "Dave", "email": "dave@mail.ru"})):
+                    change()
+                    app.config['SNAPSHOT_ENABLED'] = False
+                    expected = answers()
+                    app.config['SNAPSHOT_ENABLED'] = True
+                    self.assertEqual(answers(), expected)
+
+                with app.app_context():
+                    snapshot = app.extensions["snapshot"].get()
+                    # Столбцы отображены из файла, а изменения дописаны в первое поколение без пересборки
+                    self.assertIsInstance(snapshot.columns["id"].base, np.memmap)
+                    self.assertEqual((snapshot.meta["generation"], len(snapshot), snapshot.meta["deleted"]), (1, 4, 1))
+                    self.assertEqual(snapshot.count_users_by_domain(), {"mail.ru": 2, "yahoo.com": 1})
+                    self.assertEqual(snapshot.longest_name_ids(2), [3, 4])
+
+                runner = app.test_cli_runner()
+                result = runner.invoke(args=["snapshot", "verify"])
+                self.assertEqual(result.exit_code, 0, result.output)
+                self.assertEqual(runner.invoke(args=["snapshot", "refresh", "--full"]).exit_code, 0)
+                self.assertIn("rows: 3 (deleted 0", runner.invoke(args=["snapshot", "status"]).output)
+            finally:
+                app.config.update(SNAPSHOT_ENABLED=False, SNAPSHOT_PATH=None, SNAPSHOT_MAX_AGE=30)
+                app.extensions.pop("snapshot", None)
+
+    def test_create_app(self):
+        """Тестирует фабрику приложения, команду init-db и отложенную загрузку Flask-Migrate."""
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = os.path.join(directory, "factory.db")
+            factory_app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}",
+                                      "SWAGGER_ENABLED": False,
+                                      "EMAIL_DOMAIN_RESOLVER": stub_domain_resolver})
+            self.assertNotIn("swagger_ui", factory_app.blueprints)
+            self.assertFalse(os.path.exists(db_path))
+
+            result = factory_app.test_cli_runner().invoke(args=["init-db"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            client = factory_app.test_client()
+            response = client.post('/users', json={"username": "factory", "email": "factory@example.com"})
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual([user["username"] for user in client.get('/users').json["users"]], ["factory"])
+            with factory_app.app_context():
+                db.session.remove()
+                db.engine.dispose()
+
+        self.assertIn("swagger_ui", app.blueprints)
+        # Импорт модуля app не создаёт приложение, а тяжёлые зависимости не загружаются и при его создании
+        code = ("import sys, app; assert 'wsgi' not in sys.modules; import wsgi; "
+                "print(sorted({'flask_migrate', 'alembic', 'dns', 'email_validator'} & set(sys.modules)))")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True,
+                                check=True).stdout
+        self.assertEqual(output.strip(), "[]")
+
+    def test_sharding(self):
+        """Тестирует режим шардирования: маршрутизацию по id, объединение результатов и перераспределение."""
+        # Относительный адрес шарда отсчитывается от папки instance, как адрес основной базы
+        with app.app_context():
+            engine = database.create_profile_engine("sqlite:///shard0.db")
+            self.assertEqual(engine.url.database, os.path.join(app.instance_path, "shard0.db"))
+            engine.dispose()
+
+        with tempfile.TemporaryDirectory() as directory:
+            shard_uris = [f"sqlite:///{os.path.join(directory, f'shard{index}.db')}" for index in range(3)]
+            sharded_app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(directory, 'main.db')}",
+                                      "SHARD_DATABASE_URIS": shard_uris,
+                                      "SWAGGER_ENABLED": False,
+                                      "ACTIVITY_WRITE_BEHIND": False,
+                                      "EMAIL_DOMAIN_RESOLVER": stub_domain_resolver})
+            runner = sharded_app.test_cli_runner()
+            for command in (["init-db"], ["shards", "init"]):
+                result = runner.invoke(args=command)
+                self.assertEqual(result.exit_code, 0, result.output)
+            client = sharded_app.test_client()
+
+            ids = []
+            for index, name in enumerate(["ann", "bob", "carolina", "dmitry", "eve", "franklin", "gil"]):
+                response = client.post('/users', json={"username": name, "email": f"{name}@{'ab'[index % 2]}.com"})
+                self.assertEqual(response.status_code, 201)
+                ids.append(response.json["user"]["id"])
+            # Пользователи по очереди попадают в разные шарды, id указывает на шард
+            self.assertEqual([user_id % 3 for user_id in ids], [0, 1, 2, 0, 1, 2, 0])
+            self.assertEqual(client.post('/users', json={"username": "ann", "email": "x@a.com"}).status_code, 500)
+
+            self.assertEqual(client.get(f'/users/{ids[1]}').json["user"]["username"], "bob")
+            response = client.put(f'/users/{ids[1]}', json={"username": "bobby"})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(client.put(f'/users/{ids[2]}', json={"username": "bobby"}).status_code, 500)
+            self.assertEqual(client.delete(f'/users/{ids[6]}').status_code, 200)
+            self.assertEqual(client.get(f'/users/{ids[6]}').status_code, 404)
+
+            response = client.get('/users?page=2&per_page=2')
+            self.assertEqual([user["id"] for user in response.json["users"]], sorted(ids[:6])[2:4])
+            self.assertEqual(response.json["total"], 6)
+            response = client.get('/users?cursor=&per_page=4')
+            self.assertEqual([user["id"] for user in response.json["users"]], sorted(ids[:6])[:4])
+            response = client.get(f'/users?cursor={response.json["next_cursor"]}&per_page=4')
+            self.assertEqual([user["id"] for user in response.json["users"]], sorted(ids[:6])[4:])
+
+            statistics = client.get('/users/statistics?domain=a.com').json
+            self.assertEqual(statistics["user_count_7_days"], 6)
+            self.assertEqual([user["username"] for user in statistics["top_5_longest_names"]],
+                             ["carolina", "franklin", "dmitry", "bobby", "ann"])
+            self.assertEqual((statistics["email_domain_proportion"]["total_users"],
+                              statistics["email_domain_proportion"]["domain_users"]), (6, 3))
+            self.assertEqual(client.get('/users/last_7_days').json["users_count_7_days"], 6)
+            self.assertEqual(client.get('/users/search?q=bob').json["users"][0]["id"], ids[1])
+            self.assertEqual(client.get('/users/export').status_code, 501)
+
+            target_uris = [f"sqlite:///{os.path.join(directory, f'target{index}.db')}" for index in range(2)]
+            result = runner.invoke(args=["shards", "reshard", *target_uris])
+            self.assertEqual(result.exit_code, 0, result.output)
+            resharded_app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(directory, 'main.db')}",
+                                        "SHARD_DATABASE_URIS": target_uris,
+                                        "SWAGGER_ENABLED": False})
+            resharded = resharded_app.test_client()
+            self.assertEqual([user["id"] for user in resharded.get('/users').json["users"]], sorted(ids[:6]))
+            self.assertEqual(resharded.get('/users/statistics?domain=a.com').json, statistics)
+            self.assertEqual(resharded.get(f'/users/{ids[2]}').json["user"]["username"], "carolina")
+
+            for closing_app in (sharded_app, resharded_app):
+                buffer = closing_app.extensions.pop("activity_buffer", None)
+                if buffer is not None:
+                    buffer.close()
+                closing_app.extensions["sharding"].close()
+                with closing_app.app_context():
+                    db.session.remove()
+                    db.engine.dispose()
+
 
 if __name__ == '__main__':
     unittest.main()
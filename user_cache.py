@@ -0,0 +1,189 @@
+"""
+Кэш пользователей по id (read-through) для GET /users/<id> и GET /users/<id>/activity_probability.
+
+В кэше лежат не ORM-объекты, а словари: User.json() и сохранённая оценка активности. Из них собирается
+UserSnapshot с теми же атрибутами и методом json(), которого хватает для ответа и calculate_activity.
+Изменять пользователя (PUT, DELETE) по-прежнему нужно через ORM-объект из get_user_by_id.
+
+Бэкенды те же, что у кэша ответов (см. cache.py), настройки с префиксом USER_CACHE_:
+    - USER_CACHE_BACKEND: "memory" (LRU в памяти процесса, по умолчанию), "sqlite" (общий файл для всех
+      воркеров) или "null";
+    - USER_CACHE_DEFAULT_TTL, USER_CACHE_MAX_ENTRIES, USER_CACHE_SQLITE_PATH.
+
+Отсутствующие id тоже кэшируются, на USER_CACHE_NEGATIVE_TTL секунд, чтобы перебор несуществующих id
+не стоил запроса на каждый id. Одновременные промахи по одному id внутри процесса загружают пользователя
+одним запросом (single-flight), остальные потоки ждут его результат.
+
+Записи сбрасываются после коммита сессии, в которой пользователи добавлены, изменены или удалены,
+а после записи мимо ORM (буфер активности, массовый импорт) - явно через invalidate.
+"""
+import threading
+
+from flask import current_app
+from sqlalchemy import event
+
+from cache import create_cache
+from models import db, User
+
+# Значение в кэше для id, которого нет в базе
+MISSING = "missing"
+
+
+class UserSnapshot:
+    """Пользователь, восстановленный из кэша: атрибуты User, нужные для чтения, и json()."""
+
+    def __init__(self, payload):
+        self._user = payload["user"]
+        for name, value in self._user.items():
+            setattr(self, name, value)
+        self.activity_probability = payload["activity_probability"]
+        self.activity_score_expires_at = payload["activity_score_expires_at"]
+
+    def json(self):
+        return dict(self._user)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Выполняет одну загрузку на ключ: параллельные вызовы с тем же ключом ждут и получают её результат."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class UserCache:
+    """
+    Read-through кэш пользователей поверх бэкенда из cache.py.
+
+    Аргументы:
+        backend: Бэкенд кэша (LRUCache, SQLiteCache или NullCache).
+        negative_ttl (float): Время жизни записи об отсутствующем id в секундах.
+    """
+
+    def __init__(self, backend, negative_ttl=5):
+        self.backend = backend
+        self.negative_ttl = negative_ttl
+        self.flight = SingleFlight()
+        # Растёт при каждом сбросе: загрузка, начатая до сброса, не кладёт в кэш устаревшие данные
+        self._version = 0
+
+    @staticmethod
+    def _key(user_id):
+        # Двоеточие в конце, чтобы сброс по префиксу "user:1:" не задевал "user:10:"
+        return f"user:{user_id}:"
+
+    def get(self, user_id):
+        """
+        Возвращает пользователя из кэша, при промахе загружая его из базы.
+
+        Возвращает:
+            UserSnapshot: Пользователь или None, если его нет в базе.
+        """
+        key = self._key(user_id)
+        payload = self.backend.get(key)
+        if payload is None:
+            payload = self.flight.do(key, lambda: self._load(user_id))
+        if payload == MISSING:
+            return None
+        return UserSnapshot(payload)
+
+    def _load(self, user_id):
+        version = self._version
+        user = db.session.get(User, user_id)
+        if user is None:
+            payload, ttl = MISSING, self.negative_ttl
+        else:
+            payload, ttl = {"user": user.json(),
+                            "activity_probability": user.activity_probability,
+                            "activity_score_expires_at": user.activity_score_expires_at}, None
+        if version == self._version:
+            self.backend.set(self._key(user_id), payload, ttl)
+        return payload
+
+    def invalidate(self, user_ids):
+        """Удаляет из кэша записи указанных пользователей."""
+        self._version += 1
+        for user_id in user_ids:
+            self.backend.delete_prefix(self._key(user_id))
+
+
+def get_user_cache():
+    """Возвращает кэш пользователей текущего приложения, создавая его при первом обращении."""
+    user_cache = current_app.extensions.get("user_cache")
+    if user_cache is None:
+        backend = create_cache(current_app.config, current_app.instance_path, "USER_CACHE", "user_cache.db")
+        user_cache = current_app.extensions["user_cache"] = UserCache(backend,
+                                                                      current_app.config["USER_CACHE_NEGATIVE_TTL"])
+    return user_cache
+
+
+def get_user(user_id):
+    """Возвращает пользователя по id через кэш (UserSnapshot) или None, если его нет."""
+    return get_user_cache().get(user_id)
+
+
+def invalidate(user_ids):
+    """Сбрасывает кэш указанных пользователей."""
+    get_user_cache().invalidate(user_ids)
+
+
+def _collect_changed_users(session, flush_context):
+    """Запоминает в сессии id пользователей, которые надо сбросить после коммита."""
+    ids = session.info.setdefault("user_cache_invalidate_ids", set())
+    for user in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(user, User) and user.id is not None:
+            ids.add(user.id)
+
+
+def _invalidate_after_commit(session):
+    ids = session.info.pop("user_cache_invalidate_ids", None)
+    if ids:
+        invalidate(ids)
+
+
+def _forget_changed_users(session, previous_transaction):
+    session.info.pop("user_cache_invalidate_ids", None)
+
+
+def init_app(app):
+    """Задаёт настройки кэша пользователей по умолчанию и подключает его сброс к событиям сессии."""
+    app.config.setdefault("USER_CACHE_BACKEND", "memory")
+    app.config.setdefault("USER_CACHE_DEFAULT_TTL", 60)
+    app.config.setdefault("USER_CACHE_MAX_ENTRIES", 10000)
+    app.config.setdefault("USER_CACHE_SQLITE_PATH", None)
+    app.config.setdefault("USER_CACHE_NEGATIVE_TTL", 5)
+
+    for name, listener in (("after_flush", _collect_changed_users),
+                           ("after_commit", _invalidate_after_commit),
+                           ("after_soft_rollback", _forget_changed_users)):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
@@ -0,0 +1,13 @@
+"""
+Точка входа WSGI: приложение с настройками из окружения (DATABASE_URL, DB_PROFILE и другие).
+
+Модуль app только определяет create_app и не создаёт приложение при импорте, поэтому тесты, бенчмарки
+и команды, которым нужно своё приложение, не создают ещё одно с основной базой. Приложение для сервера
+создаётся здесь, один раз на воркер.
+
+Запуск:
+    gunicorn wsgi:app
+"""
+from app import create_app
+
+app = create_app()